@@ -0,0 +1,59 @@
+"""Measures how fast XPath expressions, patterns and attribute value 
+templates are parsed, on a corpus of expressions taken from real 
+stylesheets. Run as: python tests/benchParser.py [repeat]"""
+
+import sys, time
+import xslt.xp
+
+EXPRESSIONS = [
+	'.', '..', '@id', 'node()', 'text()', '*', '@*', '/', '//item',
+	'$items', '$count + 1', 'position()', 'last()', 'position() = last()',
+	'not(position() = last())', 'count(//section)', 'count(preceding-sibling::item) + 1',
+	'string-length(normalize-space(.)) > 0', 'concat(@prefix, \':\', local-name())',
+	'substring-before(@href, \'#\')', 'substring(@date, 1, 4)', 'translate(., \'abc\', \'ABC\')',
+	'sum(line/@price * line/@qty)', 'sum(//order/total) div count(//order)',
+	'@type = \'chapter\' or @type = \'appendix\'', 'not(@hidden) and @lang = $lang',
+	'following-sibling::*[1][self::para]', 'preceding::h1[1]/@id', 'ancestor-or-self::*[@xml:lang][1]/@xml:lang',
+	'ancestor::section[parent::body]', 'descendant::note[not(@inline)]',
+	'key(\'by-id\', @ref)/title', 'id(@idref)/@label', 'document(@src)/root/entry[@key = current()/@key]',
+	'generate-id() = generate-id(key(\'groups\', @group)[1])', 'format-number(@amount, \'#,##0.00\')',
+	'/doc/body/section[@id = $target]//para[contains(., \'XPath\')]',
+	'child::chapter/descendant::title[position() < 3]', 'attribute::href | attribute::src',
+	'(//a | //b)[last()]', '-@offset * 2 mod 7', '@width >= 100 and @height <= 200',
+	'count(ancestor::list) mod 2 = 1', 'boolean(following::footnote)', 'h:table/h:tr[h:td]',
+	'processing-instruction(\'xml-stylesheet\')', 'comment()', 'self::node()',
+	'number(@n) != number(@m)', 'starts-with(name(), \'x-\')', '3.14 * @r * @r', '.5e1',
+]
+
+PATTERNS = [
+	'/', '*', 'node()', 'text()', '@*', 'item', 'section/title', 'chapter//para',
+	'list/item[1]', 'item[@type = \'x\']', 'h:div[@class]', 'processing-instruction()',
+	'id(\'main\')', 'key(\'k\', \'v\')//x', 'a | b | c', 'para[last()]', '/doc/front/title',
+	'table//tr[position() mod 2 = 0]/td', 'comment()', '@xml:lang',
+]
+
+TEMPLATES = [
+	'plain', '{@href}', 'item-{position()}', '{$base}/{@name}.html', 'x{1}y',
+	'{concat(@a, @b)}', 'row {count(preceding-sibling::row) + 1} of {count(../row)}',
+]
+
+CORPUS = [(xslt.xp.XPath, s) for s in EXPRESSIONS] + \
+	[(xslt.xp.Pattern, s) for s in PATTERNS] + \
+	[(xslt.xp.AttributeTemplate, s) for s in TEMPLATES]
+
+
+def run(repeat):
+	start = time.time()
+	for i in range(repeat):
+		for cls, s in CORPUS:
+			cls.compile(s)
+	return time.time() - start
+
+
+if __name__ == '__main__':
+	repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+	run(1) # warm up
+	elapsed = run(repeat)
+	n = repeat * len(CORPUS)
+	print '%d expressions in %.2fs, %.0f expressions/s, %.1fus per expression' % (
+		n, elapsed, n / elapsed, elapsed / n * 1e6)
@@ -0,0 +1,78 @@
+import unittest
+import os, tempfile, shutil
+import xslt, xslt.core, xslt.batch, xslt.registry
+
+class TestTransformMany(unittest.TestCase):
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.write('s.xsl', '<s:stylesheet version="1.0" xmlns:s="http://www.w3.org/1999/XSL/Transform">'
+			'<s:output method="text"/>'
+			'<s:template match="/"><s:message><s:value-of select="/r"/></s:message><s:value-of select="/r * 2"/></s:template>'
+			'</s:stylesheet>')
+		self.uris = []
+		for i in range(20):
+			self.write('d%d.xml' % i, '<r>%d</r>' % i)
+			self.uris.append(self.path('d%d.xml' % i))
+		self.write('bad.xml', '<r>')
+		self.uris.insert(5, self.path('bad.xml'))
+		self.p = xslt.XSLTProcessor(xslt.core.DocumentProvider())
+		self.p.setStylesheet(self.path('s.xsl'))
+		
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+		
+	def path(self, name):
+		return os.path.join(self.dir, name)
+		
+	def write(self, name, text):
+		f = open(self.path(name), 'w')
+		f.write(text)
+		f.close()
+		
+	def check(self, items):
+		self.assertEquals(len(items), 21)
+		for uri, result, messages, error in items:
+			if uri == self.path('bad.xml'):
+				self.assertEquals(result, None)
+				self.assertTrue(isinstance(error, xslt.TransformFailed))
+				self.assertEquals((error.uri, error.type), (uri, 'ExpatError'))
+			else:
+				n = int(os.path.basename(uri)[1:-4])
+				self.assertEquals((result, messages, error), (str(n * 2), [str(n)], None))
+		
+	def testOrdered(self):
+		items = list(self.p.transformMany(self.uris, workers=3))
+		self.assertEquals([i[0] for i in items], self.uris)
+		self.check(items)
+		
+	def testUnordered(self):
+		items = list(self.p.transformMany(self.uris, workers=3, ordered=False))
+		self.assertEquals(sorted(i[0] for i in items), sorted(self.uris))
+		self.check(items)
+		
+	def testInProcess(self):
+		items = list(self.p.transformMany(self.uris, workers=1))
+		self.assertEquals([i[0] for i in items], self.uris)
+		self.check(items)
+		
+	def testClose(self):
+		items = self.p.transformMany(self.uris, workers=2)
+		self.assertEquals(items.next()[1], '0')
+		items.close()
+		
+	def testForget(self):
+		# documents are loaded by the provider of the registry stylesheet
+		registry = xslt.registry.StylesheetRegistry(dp=xslt.core.DocumentProvider())
+		p = xslt.XSLTProcessor(xslt.core.DocumentProvider(), registry=registry)
+		p.setStylesheet(self.path('s.xsl'))
+		self.check(list(p.transformMany(self.uris, workers=1)))
+		self.assertEquals(registry.dp.cache.keys(), [self.path('s.xsl')])
+		
+	def testNoProcessor(self):
+		# e.g. in a worker started again by the pool
+		uri, result, messages, error = xslt.batch.transformItem(None, self.uris[0])
+		self.assertEquals((uri, result, messages), (self.uris[0], None, []))
+		self.assertEquals(error.type, 'AttributeError')
+		
+if __name__ == '__main__':
+	unittest.main()
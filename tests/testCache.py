@@ -0,0 +1,119 @@
+import unittest
+import os, stat, tempfile, shutil
+import xslt, xslt.core, xslt.cache
+
+class TestStylesheetCache(unittest.TestCase):
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.cacheDir = os.path.join(self.dir, 'cache')
+		os.mkdir(os.path.join(self.dir, 'sub'))
+		self.write('main.xsl', '<s:stylesheet version="1.0" xmlns:s="http://www.w3.org/1999/XSL/Transform">'
+			'<s:import href="sub/imp.xsl"/><s:include href="inc.xsl"/>'
+			'<s:key name="k" match="i" use="@id"/>'
+			'<s:template match="/"><out><s:apply-templates select="//i"/>'
+			'<k><s:value-of select="key(\'k\', \'b\')"/></k><s:call-template name="inc"/></out></s:template>'
+			'<s:template match="i[@id=\'a\']"><a><s:apply-imports/></a></s:template>'
+			'</s:stylesheet>')
+		self.write('inc.xsl', '<s:stylesheet version="1.0" xmlns:s="http://www.w3.org/1999/XSL/Transform">'
+			'<s:template name="inc"><inc><s:value-of select="count(//i)"/></inc></s:template>'
+			'</s:stylesheet>')
+		self.write('sub/imp.xsl', '<s:stylesheet version="1.0" xmlns:s="http://www.w3.org/1999/XSL/Transform">'
+			'<s:output omit-xml-declaration="yes"/>'
+			'<s:template match="i">[<s:value-of select="."/>]</s:template>'
+			'</s:stylesheet>')
+		self.write('d.xml', '<r><i id="a">1</i><i id="b">2</i></r>')
+		self.expected = '<out><a>[1]</a>[2]<k>2</k><inc>2</inc></out>'
+		
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+		
+	def path(self, name):
+		return os.path.join(self.dir, name)
+		
+	def write(self, name, text):
+		f = open(self.path(name), 'w')
+		f.write(text)
+		f.close()
+		
+	def transform(self):
+		p = xslt.XSLTProcessor(xslt.core.DocumentProvider(), cacheDir=self.cacheDir)
+		p.setStylesheet(self.path('main.xsl'))
+		return p.transform(self.path('d.xml'))
+		
+	def entries(self):
+		return os.listdir(self.cacheDir)
+		
+	def testDependencies(self):
+		s = xslt.Stylesheet(self.path('main.xsl'), dp=xslt.core.DocumentProvider())
+		self.assertEquals(s.dependencies(), 
+			[self.path('main.xsl'), self.path('inc.xsl'), self.path('sub/imp.xsl')])
+		
+	def testLoad(self):
+		self.assertEquals(self.transform(), self.expected)
+		self.assertEquals(len(self.entries()), 1)
+		
+		cache = xslt.cache.StylesheetCache(self.cacheDir)
+		entry = os.path.join(self.cacheDir, self.entries()[0])
+		stylesheet = cache.load(entry)
+		self.assertTrue(isinstance(stylesheet, xslt.Stylesheet))
+		self.assertEquals(stylesheet.imports[0].output, {'omit-xml-declaration': True})
+		
+		self.assertEquals(self.transform(), self.expected)
+		self.assertEquals(len(self.entries()), 1)
+		
+	def testChangedInclude(self):
+		self.transform()
+		self.write('inc.xsl', '<s:stylesheet version="1.0" xmlns:s="http://www.w3.org/1999/XSL/Transform">'
+			'<s:template name="inc"><inc/></s:template></s:stylesheet>')
+		self.assertEquals(self.transform(), self.expected.replace('<inc>2</inc>', '<inc/>'))
+		
+	def testChangedImport(self):
+		self.transform()
+		self.write('sub/imp.xsl', '<s:stylesheet version="1.0" xmlns:s="http://www.w3.org/1999/XSL/Transform">'
+			'<s:output omit-xml-declaration="yes"/>'
+			'<s:template match="i">(<s:value-of select="."/>)</s:template>'
+			'</s:stylesheet>')
+		self.assertEquals(self.transform(), self.expected.replace('[', '(').replace(']', ')'))
+		
+	def testChangedMain(self):
+		self.transform()
+		self.write('main.xsl', '<s:stylesheet version="1.0" xmlns:s="http://www.w3.org/1999/XSL/Transform">'
+			'<s:output omit-xml-declaration="yes"/><s:template match="/"><x/></s:template></s:stylesheet>')
+		self.assertEquals(self.transform(), '<x/>')
+		self.assertEquals(len(self.entries()), 2)
+		
+	def testBrokenEntry(self):
+		self.transform()
+		self.write(os.path.join('cache', self.entries()[0]), 'broken')
+		self.assertEquals(self.transform(), self.expected)
+		self.assertEquals(self.transform(), self.expected)
+		
+	def testPrivateDirectory(self):
+		self.transform()
+		self.assertEquals(stat.S_IMODE(os.stat(self.cacheDir).st_mode), 0700)
+		
+	def testSharedDirectory(self):
+		os.mkdir(self.cacheDir)
+		os.chmod(self.cacheDir, 0777)
+		self.assertRaises(OSError, xslt.cache.StylesheetCache, self.cacheDir)
+		if os.getuid() == 0:
+			os.chmod(self.cacheDir, 0700)
+			os.chown(self.cacheDir, 1, -1)
+			self.assertRaises(OSError, xslt.cache.StylesheetCache, self.cacheDir)
+		
+	def testUntrustedEntry(self):
+		self.transform()
+		entry = os.path.join(self.cacheDir, self.entries()[0])
+		cache = xslt.cache.StylesheetCache(self.cacheDir)
+		os.chmod(entry, 0666)
+		self.assertEquals(cache.load(entry), None)
+		if os.getuid() == 0:
+			os.chmod(entry, 0600)
+			os.chown(entry, 1, -1)
+			self.assertEquals(cache.load(entry), None)
+		# compiled again and stored as a private entry
+		self.assertEquals(self.transform(), self.expected)
+		self.assertTrue(cache.load(entry) is not None)
+		
+if __name__ == '__main__':
+	unittest.main()
@@ -2,6 +2,7 @@ import unittest
 from xslt.core import *
 import xslt.exceptions, xslt.xp
 import xml.dom.minidom
+import os, tempfile, shutil
 from StringIO import *
 
 class TestAssertEmptyNode(unittest.TestCase):
@@ -161,6 +162,159 @@ class TestTemplateContent(unittest.TestCase):
 		self.assertEquals(map(lambda x: x.inst, a), ['ctx:to', 'ctx:to'])
 
 
+class TestVariableBinding(unittest.TestCase):
+	def testLookup(self):
+		globals = {(None, 'g'): 1, (None, 'x'): 2}
+		inner = VariableBinding((None, 'y'), 4, VariableBinding((None, 'x'), 3, globals))
+		self.assertEquals(inner[(None, 'x')], 3)
+		self.assertEquals(inner[(None, 'y')], 4)
+		self.assertEquals(inner[(None, 'g')], 1)
+		self.assertRaises(KeyError, inner.__getitem__, (None, 'z'))
+		self.assertEquals(globals[(None, 'x')], 2)
+		
+		
+class TestXSLTContext(unittest.TestCase):
+	def setUp(self):
+		self.doc = xml.dom.minidom.parseString('<a><b/><c/><d/></a>')
+		self.nodes = list(self.doc.documentElement.childNodes)
+		self.context = XSLTContext(None)
+		
+	def testIterate(self):
+		self.context.nodeset = self.nodes
+		seen = [(node, self.context.node, self.context.pos, self.context.size) for node in self.context]
+		self.assertEquals(seen, [(n, n, i + 1, 3) for i, n in enumerate(self.nodes)])
+		
+	def testPosition(self):
+		self.context.nodeset = self.nodes
+		x = xslt.xp.XPath('position() = last() - 2')
+		self.assertEquals([x.find(self.context) for node in self.context], [True, False, False])
+		
+	def testRestoreFocus(self):
+		self.context.nodeset = self.nodes
+		for node in self.context:
+			if self.context.pos == 2:
+				focus = self.context.focus()
+				self.context.nodeset = [self.doc]
+				self.assertEquals((self.context.node, self.context.size), (self.doc, 1))
+				self.context.restoreFocus(focus)
+				self.assertEquals((self.context.node, self.context.pos, self.context.size), (node, 2, 3))
+		self.assertEquals(self.context.pos, 3)
+		
+	def testCopy(self):
+		self.context.nodeset = self.nodes
+		copy = self.context.copy()
+		copy.nodeset = [self.doc]
+		copy.variables = VariableBinding((None, 'v'), 1, copy.variables)
+		self.assertEquals((self.context.node, self.context.variables), (self.nodes[0], {}))
+		self.assertTrue(copy.messages is self.context.messages)
+		
+		
+class TestDocumentProvider(unittest.TestCase):
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		for name in 'abc':
+			self.write(name, '<%s/>' % name)
+			
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+		
+	def path(self, name):
+		return os.path.join(self.dir, name + '.xml')
+		
+	def write(self, name, text):
+		f = open(self.path(name), 'w')
+		f.write(text)
+		f.close()
+		
+	def testMaxEntries(self):
+		dp = DocumentProvider(maxEntries=2)
+		a = dp.document(self.path('a'))
+		b = dp.document(self.path('b'))
+		self.assertTrue(dp.document(self.path('a')) is a)
+		dp.document(self.path('c'))
+		self.assertEquals(dp.cache.keys(), [self.path('a'), self.path('c')])
+		self.assertEquals(dp.evictions, 1)
+		# evicted documents are unlinked
+		self.assertEquals(b.documentElement, None)
+		self.assertEquals(a.documentElement.tagName, 'a')
+		
+	def testMaxBytes(self):
+		self.write('b', '<b>%s</b>' % ('x' * 100))
+		dp = DocumentProvider(maxBytes=111)
+		dp.document(self.path('a'))
+		dp.document(self.path('c'))
+		self.assertEquals(dp.size, 8)
+		dp.document(self.path('b'))
+		self.assertEquals(dp.cache.keys(), [self.path('c'), self.path('b')])
+		self.assertEquals(dp.size, 111)
+		
+	def testRevalidate(self):
+		dp = DocumentProvider(revalidate=True)
+		a = dp.document(self.path('a'))
+		self.write('a', '<x></x>')
+		self.assertEquals(dp.document(self.path('a')).documentElement.tagName, 'x')
+		self.assertEquals(a.documentElement, None)
+		
+		dp.revalidate = False
+		self.write('a', '<y></y>')
+		self.assertEquals(dp.document(self.path('a')).documentElement.tagName, 'x')
+		
+	def testUnlinkAfterRelease(self):
+		dp = DocumentProvider(maxEntries=1)
+		generation = dp.acquire()
+		a = dp.document(self.path('a'))
+		dp.document(self.path('b'))
+		self.assertEquals(dp.cache.keys(), [self.path('b')])
+		self.assertEquals(a.documentElement.tagName, 'a')
+		dp.release(generation)
+		self.assertEquals(a.documentElement, None)
+		
+	def testUnlinkOverlapping(self):
+		# transformations overlap, there is always one running
+		dp = DocumentProvider(maxEntries=1)
+		first = dp.acquire()
+		a = dp.document(self.path('a'))
+		b = dp.document(self.path('b'))
+		second = dp.acquire()
+		c = dp.document(self.path('c'))
+		self.assertEquals(a.documentElement.tagName, 'a')
+		self.assertEquals(b.documentElement.tagName, 'b')
+		dp.release(first)
+		# a was dropped before second started, b was in use by it
+		self.assertEquals(a.documentElement, None)
+		self.assertEquals(b.documentElement.tagName, 'b')
+		third = dp.acquire()
+		dp.document(self.path('a'))
+		dp.release(second)
+		self.assertEquals(b.documentElement, None)
+		self.assertEquals(c.documentElement.tagName, 'c')
+		dp.release(third)
+		self.assertEquals(c.documentElement, None)
+		self.assertEquals(dp._dropped, [])
+		
+	def testDOMDocument(self):
+		dp = DocumentProvider(maxEntries=1)
+		doc = xml.dom.minidom.parseString('<d/>')
+		uri = dp.addDOMDocument(doc)
+		self.assertTrue(dp.document(uri) is doc)
+		dp.document(self.path('a'))
+		self.assertEquals(doc.documentElement.tagName, 'd')
+		
+	def testDOMDocumentIndex(self):
+		dp = DocumentProvider()
+		doc = xml.dom.minidom.parseString('<d><e/></d>')
+		uri = dp.addDOMDocument(doc)
+		index = doc.xpath_index
+		self.assertEquals(dp.addDOMDocument(doc), uri)
+		self.assertTrue(doc.xpath_index is index)
+		# indexed again after it is removed and changed
+		dp.remove(uri)
+		doc.documentElement.appendChild(doc.createElement('f'))
+		self.assertEquals(dp.addDOMDocument(doc), uri)
+		self.assertFalse(doc.xpath_index is index)
+		self.assertEquals(doc.xpath_last, doc.documentElement.lastChild.xpath_order)
+		
+		
 class ElementTest(unittest.TestCase):
 	class ElementMock(Element):
 		def __init__(self, test):
@@ -0,0 +1,152 @@
+import unittest
+import xslt, xslt.dispatch, xslt.xp, xslt.tools, xslt.core
+import xml.dom.minidom
+import os, tempfile, weakref, gc
+
+class Template(object):
+	def __init__(self, match, priority=None, namespaces={}):
+		self.match = match
+		self.namespaces = namespaces
+		pattern = xslt.xp.Pattern(match)
+		self.priority = priority if priority is not None else xslt.tools.computeDefaultPriority(pattern.expr)
+		self.patterns = [(pattern, self, self.priority)]
+
+	def __repr__(self):
+		return 'Template(%r)' % self.match
+
+class TestDispatchTable(unittest.TestCase):
+	def setUp(self):
+		self.doc = xml.dom.minidom.parseString('<r xmlns:p="uri:p"><a><b/><b x="1">t</b><b/></a>'
+			'<c><d><b/></d></c><p:e/><!--z--><?pi x?></r>')
+		self.r = self.doc.documentElement
+		self.a, self.c, self.e, self.comment, self.pi = self.r.childNodes
+		self.b = self.doc.getElementsByTagName('b')
+		self.context = xslt.core.XSLTContext(None)
+
+	def table(self, *templates):
+		patterns = []
+		for t in templates:
+			patterns += t.patterns
+		patterns.sort(key=lambda x: x[2])
+		return xslt.dispatch.DispatchTable(patterns)
+
+	def find(self, table, node):
+		self.context.nodeset = [node]
+		return table.find(node, self.context)
+
+	def testNames(self):
+		b, star, q = Template('b'), Template('*'), Template('q:*', namespaces={'q': 'uri:p'})
+		table = self.table(b, star, q)
+		self.assertTrue(self.find(table, self.b[0]) is b)
+		self.assertTrue(self.find(table, self.a) is star)
+		self.assertTrue(self.find(table, self.e) is q)
+		self.assertEquals(self.find(table, self.b[1].firstChild), None)
+		self.assertEquals(self.find(table, self.doc), None)
+
+	def testPaths(self):
+		root, ab, cb, rc = Template('/'), Template('a/b'), Template('c//b'), Template('/r/c')
+		table = self.table(root, ab, cb, rc)
+		self.assertTrue(self.find(table, self.doc) is root)
+		self.assertTrue(self.find(table, self.b[0]) is ab)
+		self.assertTrue(self.find(table, self.b[3]) is cb)
+		self.assertTrue(self.find(table, self.c) is rc)
+		self.assertEquals(self.find(table, self.a), None)
+
+	def testPredicates(self):
+		b, second, x, last = Template('b'), Template('b[2]'), Template("b[@x = '1']", 1), Template('a/b[last()]')
+		table = self.table(b, second, x, last)
+		self.assertTrue(self.find(table, self.b[0]) is b)
+		self.assertTrue(self.find(table, self.b[1]) is x)
+		self.assertTrue(self.find(table, self.b[2]) is last)
+		self.assertTrue(self.find(table, self.b[3]) is b)
+
+	def testPriorityAndOrder(self):
+		first, second, low = Template('b'), Template('b'), Template('b', -1)
+		self.assertTrue(self.find(self.table(first, second, low), self.b[0]) is second)
+		self.assertTrue(self.find(self.table(low, Template('node()')), self.b[0]).match == 'node()')
+
+	def testNodeKinds(self):
+		text, comment, pi, attr = Template('text()'), Template('comment()'), \
+			Template("processing-instruction('pi')"), Template('@x')
+		table = self.table(text, comment, pi, attr, Template('@*', -1))
+		self.assertTrue(self.find(table, self.b[1].firstChild) is text)
+		self.assertTrue(self.find(table, self.comment) is comment)
+		self.assertTrue(self.find(table, self.pi) is pi)
+		self.assertTrue(self.find(table, self.b[1].getAttributeNode('x')) is attr)
+		self.assertEquals(self.find(table, self.a), None)
+
+	def testUnion(self):
+		t = Template('a | c/d', 0.5)
+		t.patterns = [(xslt.xp.Pattern(p), t, 0.5) for p in xslt.tools.splitUnionExpr(t.patterns[0][0].expr)]
+		table = self.table(t)
+		self.assertTrue(self.find(table, self.a) is t)
+		self.assertTrue(self.find(table, self.c.firstChild) is t)
+		self.assertEquals(self.find(table, self.c), None)
+
+	def testMatchCache(self):
+		# as for documents parsed by a DocumentProvider
+		self.doc.xslt_matches = weakref.WeakKeyDictionary()
+		b = Template('b')
+		table = self.table(b, Template('a'))
+		self.assertTrue(self.find(table, self.b[0]) is b)
+		self.assertEquals(self.find(table, self.c), None)
+		self.assertEquals(self.doc.xslt_matches[table], {self.b[0]: b, self.c: None})
+
+		# a new context, as in another transformation, reuses the matches
+		self.context = xslt.core.XSLTContext(None)
+		table.buckets = {}
+		table._candidates = {}
+		self.assertTrue(self.find(table, self.b[0]) is b)
+
+		other = self.table(Template('c'))
+		self.assertTrue(self.find(other, self.c).match == 'c')
+		self.assertEquals(len(self.doc.xslt_matches), 2)
+
+		# matches do not keep dropped tables alive
+		del table, other
+		gc.collect()
+		self.assertEquals(len(self.doc.xslt_matches), 0)
+
+	def testCallerDocumentNotCached(self):
+		table = self.table(Template('b'), Template('b[@y]'))
+		self.assertEquals(self.find(table, self.b[0]).match, 'b')
+		self.b[0].setAttribute('y', '1')
+		self.assertEquals(self.find(table, self.b[0]).match, 'b[@y]')
+		self.assertFalse(hasattr(self.doc, 'xslt_matches'))
+
+	def testProviderDocumentCached(self):
+		fd, path = tempfile.mkstemp(suffix='.xml')
+		try:
+			os.write(fd, '<r><b/></r>')
+			os.close(fd)
+			doc = xslt.core.DocumentProvider().document(path)
+		finally:
+			os.remove(path)
+		table = self.table(Template('b'))
+		self.context.nodeset = [doc.documentElement.firstChild]
+		self.assertEquals(table.find(doc.documentElement.firstChild, self.context).match, 'b')
+		self.assertEquals(len(doc.xslt_matches[table]), 1)
+
+	def testChangedCallerDocument(self):
+		p = xslt.XSLTProcessor(xslt.core.DocumentProvider())
+		p.setStylesheet(xml.dom.minidom.parseString('<xsl:stylesheet version="1.0" '
+			'xmlns:xsl="http://www.w3.org/1999/XSL/Transform"><xsl:output method="text"/>'
+			'<xsl:template match="a">plain</xsl:template>'
+			'<xsl:template match="a[@flag]">flagged</xsl:template></xsl:stylesheet>'))
+		doc = xml.dom.minidom.parseString('<a/>')
+		self.assertEquals(p.transform(doc), 'plain')
+		doc.documentElement.setAttribute('flag', '1')
+		self.assertEquals(p.transform(doc), 'flagged')
+
+	def testNotCached(self):
+		self.doc.xslt_matches = weakref.WeakKeyDictionary()
+		table = self.table(Template('b[@x = $v]'))
+		self.assertFalse(table.cacheable)
+		self.context.variables[(None, 'v')] = u'1'
+		self.assertEquals(self.find(table, self.b[1]).match, 'b[@x = $v]')
+		self.context.variables[(None, 'v')] = u'2'
+		self.assertEquals(self.find(table, self.b[1]), None)
+		self.assertEquals(len(self.doc.xslt_matches), 0)
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,169 @@
+import unittest
+import os, tempfile, shutil
+from StringIO import StringIO
+import xslt, xslt.elements, xslt.core
+import xml.dom.minidom
+
+class TestKey(unittest.TestCase):
+	def setUp(self):
+		sheet = xml.dom.minidom.parseString('<s:stylesheet xmlns:s="http://www.w3.org/1999/XSL/Transform">'
+			'<s:key name="k" match="product" use="@sku"/><s:key name="k" match="para" use="ref/@sku"/>'
+			'</s:stylesheet>')
+		options = {'baseUri': '', 'namespaces': {}}
+		keys = [xslt.elements.Key(n, None, options) for n in sheet.documentElement.childNodes]
+		self.key = keys[0]
+		self.key.update(keys[1])
+		self.doc = xml.dom.minidom.parseString('<r><para><ref sku="a"/><ref sku="b"/></para>'
+			'<product sku="a"/><product sku="b"/><product/></r>')
+		self.context = xslt.core.XSLTContext(None)
+		self.context.nodeset = [self.doc.documentElement]
+		self.para, self.a, self.b = self.doc.documentElement.childNodes[:3]
+
+	def select(self, value):
+		return self.key.select(self.context, self.doc.documentElement, value)
+
+	def testSelect(self):
+		self.assertEquals(self.select(u'a'), [self.para, self.a])
+		self.assertEquals(self.select(u'b'), [self.para, self.b])
+		self.assertEquals(self.select(u'c'), [])
+		self.assertEquals(self.select(1.0), [])
+
+	def testNodeset(self):
+		refs = self.para.childNodes
+		self.assertEquals(self.select([refs[1].getAttributeNode('sku'), refs[0].getAttributeNode('sku'), refs[0]]),
+			[self.para, self.a, self.b])
+
+	def testDocumentOfContextNode(self):
+		# the document of the XPath context node, not of the current node
+		other = xml.dom.minidom.parseString('<o><product sku="a"/></o>')
+		self.assertEquals(self.key.select(self.context, other.documentElement, u'a'),
+			[other.documentElement.firstChild])
+		self.assertEquals(self.key.select(self.context, other.documentElement.firstChild.getAttributeNode('sku'), u'b'), [])
+
+	def testTableBuiltOnce(self):
+		table = self.key.table(self.context, self.doc)
+		self.assertEquals(sorted(table.keys()), [u'a', u'b'])
+		subContext = self.context.copy()
+		subContext.nodeset = [self.b]
+		self.assertTrue(self.key.table(subContext, self.doc) is table)
+		other = xml.dom.minidom.parseString('<r/>')
+		self.assertEquals(self.key.table(self.context, other), {})
+
+class TestInstantiate(unittest.TestCase):
+	stylesheet = ('<s:stylesheet version="1.0" xmlns:s="http://www.w3.org/1999/XSL/Transform">'
+		'<s:variable name="g" select="\'G\'"/>'
+		'<s:template match="/"><out><s:variable name="x" select="\'X\'"/>'
+		'<s:for-each select="r/i"><s:variable name="y" select="position()"/><f y="{$y}/{last()}" x="{$x}"/></s:for-each>'
+		'<after x="{$x}" g="{$g}"/>'
+		'<s:apply-templates select="r/i"><s:with-param name="p" select="name(*)"/></s:apply-templates>'
+		'<s:call-template name="t"/></out></s:template>'
+		'<s:template match="i"><s:param name="p"/><a n="{position()}" p="{$p}">'
+		'<s:call-template name="t"><s:with-param name="q" select="."/></s:call-template></a></s:template>'
+		'<s:template name="t"><s:param name="q" select="$g"/><t q="{$q}"/></s:template>'
+		'</s:stylesheet>')
+	
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		for name, text in [('s.xsl', self.stylesheet), ('d.xml', '<r><i>1</i><i>2</i></r>'),
+				('o.xml', '<o><e ref="a"/><e ref="b"/><e ref="c"/><k id="a"/><k id="b"/></o>'),
+				('k.xsl', '<s:stylesheet version="1.0" xmlns:s="http://www.w3.org/1999/XSL/Transform">'
+					'<s:output method="text"/><s:key name="k" match="k | i" use="@id | ."/>'
+					'<s:template match="/"><s:value-of select="count(document(\'o.xml\')/o/e[key(\'k\', @ref)])"/>'
+					'<s:value-of select="count(key(\'k\', \'2\'))"/></s:template></s:stylesheet>')]:
+			f = open(os.path.join(self.dir, name), 'w')
+			f.write(text)
+			f.close()
+		
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+		
+	def testScopes(self):
+		p = xslt.XSLTProcessor(xslt.core.DocumentProvider())
+		p.setStylesheet(os.path.join(self.dir, 's.xsl'))
+		r = p.stylesheet.transform(os.path.join(self.dir, 'd.xml'), p.createContext())
+		self.assertEquals(r.firstChild.toxml(), '<out><f x="X" y="1/2"/><f x="X" y="2/2"/><after g="G" x="X"/>'
+			'<a n="1" p="r"><t q="1"/></a><a n="2" p="r"><t q="2"/></a><t q="G"/></out>')
+		
+	def testKeyInOtherDocument(self):
+		p = xslt.XSLTProcessor(xslt.core.DocumentProvider())
+		p.setStylesheet(os.path.join(self.dir, 'k.xsl'))
+		self.assertEquals(p.transform(os.path.join(self.dir, 'd.xml')), '21')
+		
+	def testStream(self):
+		p = xslt.XSLTProcessor(xslt.core.DocumentProvider())
+		p.setStylesheet(os.path.join(self.dir, 's.xsl'))
+		s = StringIO()
+		p.transformToStream(os.path.join(self.dir, 'd.xml'), s, chunkSize=8)
+		self.assertEquals(s.getvalue(), p.transform(os.path.join(self.dir, 'd.xml')))
+		self.assertTrue(s.getvalue().startswith('<?xml version="1.0"?><out>'))
+		
+class TestStripSpace(unittest.TestCase):
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		output = ('<s:output method="text"/><s:template match="/">'
+			'<s:value-of select="count(/r/node())"/>,<s:value-of select="count(//b/node())"/></s:template>')
+		for name, text in [('d.xml', '<r>\n <a/>\n <b> </b>\n <!--c-->\n</r>'),
+				('strip.xsl', '<s:strip-space elements="*"/>' + output),
+				('preserve.xsl', '<s:strip-space elements="*"/><s:preserve-space elements="b"/>' + output),
+				('plain.xsl', output),
+				('other.xsl', '<s:strip-space elements="*"/><s:output method="text"/><s:template match="/">'
+					'<s:value-of select="count(document(\'d.xml\')/r/node())"/></s:template>')]:
+			if name.endswith('.xsl'):
+				text = '<s:stylesheet version="1.0" xmlns:s="http://www.w3.org/1999/XSL/Transform">%s</s:stylesheet>' % text
+			f = open(os.path.join(self.dir, name), 'w')
+			f.write(text)
+			f.close()
+		self.dp = xslt.core.DocumentProvider()
+		
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+		
+	def transform(self, stylesheet, doc=None):
+		p = xslt.XSLTProcessor(self.dp)
+		p.setStylesheet(os.path.join(self.dir, stylesheet))
+		return p.transform(doc or os.path.join(self.dir, 'd.xml'))
+		
+	def testStripped(self):
+		self.assertEquals(self.transform('strip.xsl'), '3,0')
+		self.assertEquals(self.transform('preserve.xsl'), '3,1')
+		self.assertEquals(self.transform('strip.xsl'), '3,0')
+		
+	def testSharedDocumentUnchanged(self):
+		self.assertEquals(self.transform('strip.xsl'), '3,0')
+		self.assertEquals(self.transform('plain.xsl'), '7,1')
+		
+	def testCallerDocument(self):
+		doc = xml.dom.minidom.parseString('<r>\n <a/>\n <b> </b>\n</r>')
+		self.assertEquals(self.transform('strip.xsl', doc), '2,0')
+		self.assertEquals(len(doc.documentElement.childNodes), 5)
+		# a changed document is given again to the provider
+		self.dp.remove(self.dp.addDOMDocument(doc))
+		doc.documentElement.appendChild(doc.createElement('b'))
+		self.assertEquals(self.transform('strip.xsl', doc), '3,0')
+		
+	def testCopyKept(self):
+		s = xslt.Stylesheet(os.path.join(self.dir, 'strip.xsl'), dp=self.dp)
+		doc = xml.dom.minidom.parseString('<r>\n <a/>\n</r>')
+		self.dp.addDOMDocument(doc)
+		copy = s.strippedDocument(doc)
+		self.assertTrue(s.strippedDocument(doc) is copy)
+		self.assertEquals(len(copy.documentElement.childNodes), 1)
+		
+	def testCopyUnlinked(self):
+		s = xslt.Stylesheet(os.path.join(self.dir, 'strip.xsl'), dp=self.dp)
+		uri = os.path.join(self.dir, 'd.xml')
+		copy = s.strippedDocument(self.dp.document(uri))
+		self.dp.remove(uri)
+		self.assertEquals(copy.documentElement, None)
+		
+		doc = xml.dom.minidom.parseString('<r>\n <a/>\n</r>')
+		copy = s.strippedDocument(self.dp.document(self.dp.addDOMDocument(doc)))
+		self.dp.remove(self.dp.addDOMDocument(doc))
+		self.assertEquals(copy.documentElement, None)
+		self.assertEquals(len(doc.documentElement.childNodes), 3)
+		
+	def testDocumentFunction(self):
+		self.assertEquals(self.transform('other.xsl'), '3')
+		
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,82 @@
+import unittest
+import xpath, xpath.expr, xpath.index
+import xml.dom.minidom
+
+class TestMergeNodesets(unittest.TestCase):
+	def setUp(self):
+		self.doc = xml.dom.minidom.parseString('<a><b><c/><c/></b><b><c/></b></a>')
+		self.b = self.doc.documentElement.childNodes
+		self.c = [c for b in self.b for c in b.childNodes]
+
+	def testConcatenate(self):
+		r = xpath.expr.merge_nodesets([[], list(self.b[0].childNodes), [], list(self.b[1].childNodes)])
+		self.assertEquals(r, self.c)
+
+	def testOverlapping(self):
+		r = xpath.expr.merge_nodesets([self.c[1:], [self.b[0]] + self.c, self.c[:2]])
+		self.assertEquals(r, [self.b[0]] + self.c)
+
+	def testIndexed(self):
+		xpath.index.index_document(self.doc)
+		self.testOverlapping()
+
+	def testPath(self):
+		r = xpath.find('//c/.. | //b/c/../c', self.doc)
+		self.assertEquals(r, [self.b[0]] + self.c[:2] + [self.b[1], self.c[2]])
+		self.assertEquals(xpath.find('//b/descendant-or-self::node()/c', self.doc), self.c)
+
+class TestNodeSet(unittest.TestCase):
+	def setUp(self):
+		self.doc = xml.dom.minidom.parseString('<a><b/><c/><b/></a>')
+		self.a = self.doc.documentElement
+
+	def testListCompatible(self):
+		r = xpath.find('b', self.a)
+		self.assertTrue(isinstance(r, list))
+		self.assertEquals(r, [self.a.childNodes[0], self.a.childNodes[2]])
+
+	def testFlags(self):
+		r = xpath.find('*', self.a)
+		self.assertTrue(r.ordered and r.unique)
+		r = xpath.find('*[2] | b', self.a)
+		self.assertTrue(r.ordered and r.unique)
+		self.assertEquals(r, list(self.a.childNodes))
+
+	def testOrderedNodeset(self):
+		nodes = list(self.a.childNodes)
+		r = xpath.expr.ordered_nodeset(nodes[::-1] + nodes)
+		self.assertEquals(r, nodes)
+		self.assertTrue(r.ordered and r.unique)
+		self.assertTrue(xpath.expr.ordered_nodeset(r) is r)
+
+	def testVariable(self):
+		nodes = list(self.a.childNodes)[::-1]
+		self.assertEquals(xpath.find('$v/..', self.a, v=nodes), [self.a])
+		self.assertEquals(xpath.find('$v | $v', self.a, v=nodes), nodes[::-1])
+
+class TestCompiled(unittest.TestCase):
+	def setUp(self):
+		self.doc = xml.dom.minidom.parseString('<a xmlns:p="uri:p"><b id="1"/><p:b id="2"/>t<b/></a>')
+		self.a = self.doc.documentElement
+
+	def testEvaluateMatchesCompiled(self):
+		for s in ('count(b)', 'b/@id', 'p:b', '*[2]', 'b[last()]', '1 + 2 * 3 = 7',
+				'string(b[1]/@id) and not(p:b/@x)', "concat('x', 1 div 0)"):
+			x = xpath.XPath(s)
+			ctx = xpath.XPathContext(self.doc)
+			self.assertEquals(x.expr.evaluate(self.a, 1, 1, ctx), x.find(self.a, context=ctx), s)
+
+	def testFunctionTable(self):
+		class Context(xpath.XPathContext):
+			functions = dict(xpath.XPathContext.functions)
+			functions['count'] = lambda node, pos, size, context, v: -1
+		x = xpath.XPath('count(b)')
+		self.assertEquals(x.find(self.a), 2)
+		self.assertEquals(x.find(self.a, context=Context(self.doc)), -1)
+		self.assertEquals(x.find(self.a), 2)
+
+	def testUnknownFunction(self):
+		self.assertRaises(xpath.XPathUnknownFunctionError, xpath.find, 'nothing(b)', self.a)
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,68 @@
+import unittest
+import xpath, xpath.cache
+import xslt.xp
+import xml.dom.minidom
+
+class TestLRUCache(unittest.TestCase):
+	def setUp(self):
+		self.cache = xpath.cache.LRUCache(3)
+		self.created = []
+		
+	def create(self, key):
+		self.created.append(key)
+		return key * 2
+		
+	def testEviction(self):
+		for key in (1, 2, 3, 1, 4, 1, 2):
+			self.assertEquals(self.cache.get(key, self.create), key * 2)
+		# 2 was the least recently used when 4 came
+		self.assertEquals(self.created, [1, 2, 3, 4, 2])
+		self.assertEquals(self.cache.stats(), 
+			{'hits': 2, 'misses': 5, 'evictions': 2, 'size': 3, 'maxsize': 3})
+		self.assertTrue(1 in self.cache and 2 in self.cache and 4 in self.cache)
+		
+	def testResize(self):
+		for key in range(3):
+			self.cache.get(key, self.create)
+		self.cache.resize(1)
+		self.assertEquals(len(self.cache), 1)
+		self.assertTrue(2 in self.cache)
+		self.assertEquals(self.cache.evictions, 2)
+		self.cache.clear()
+		self.assertEquals(len(self.cache), 0)
+		
+	def testWarm(self):
+		self.cache.get(1, self.create)
+		self.cache.warm([1, 2], self.create)
+		self.assertEquals(self.created, [1, 2])
+		self.cache.get(2, self.create)
+		self.assertEquals(self.cache.hits, 1)
+		
+class TestExpressionCaches(unittest.TestCase):
+	def setUp(self):
+		self.doc = xml.dom.minidom.parseString('<a><b/><b/></a>')
+		
+	def testXPath(self):
+		cache = xpath.XPath.cache
+		exprs = ['count(//b) + %d' % i for i in range(cache.maxsize + 10)]
+		for i, s in enumerate(exprs):
+			self.assertEquals(xpath.find(s, self.doc), 2 + i)
+		self.assertEquals(len(cache), cache.maxsize)
+		hits = cache.hits
+		self.assertTrue(xpath.XPath.get(exprs[-1]) is xpath.XPath.get(exprs[-1]))
+		self.assertEquals(cache.hits, hits + 2)
+		self.assertFalse(exprs[0] in cache)
+		
+	def testXSLT(self):
+		cache = xslt.xp.XPathBase.cache
+		# the same string parsed by different rules is cached twice
+		xslt.xp.XPath.warm(['b[1]', 'b | c'])
+		xslt.xp.Pattern.warm(['b[1]'])
+		self.assertTrue(xslt.xp.XPath._key('b[1]') in cache and xslt.xp.Pattern._key('b[1]') in cache)
+		hits = cache.hits
+		self.assertTrue(xslt.xp.XPath('b | c').expr is xslt.xp.XPath('b | c').expr)
+		self.assertEquals(cache.hits, hits + 2)
+		self.assertEquals(str(xslt.xp.AttributeTemplate('x{1}').expr), str(xslt.xp.AttributeTemplate.compile('x{1}')))
+		
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,142 @@
+import unittest
+import xpath, xpath.expr, xpath.index
+import xslt.core, xslt.xp
+import xml.dom.minidom
+
+class TestDocumentIndex(unittest.TestCase):
+	def setUp(self):
+		self.doc = xml.dom.minidom.parseString('<a x="1" b="2"><b><c/>t</b><d y="3"/></a>')
+		self.index = xpath.index.index_document(self.doc)
+		a = self.doc.documentElement
+		self.nodes = [self.doc, a, a.getAttributeNode('b'), a.getAttributeNode('x'),
+			a.firstChild, a.firstChild.firstChild, a.firstChild.lastChild,
+			a.lastChild, a.lastChild.getAttributeNode('y')]
+
+	def testOrder(self):
+		orders = [n.xpath_order for n in self.nodes]
+		self.assertEquals(orders, sorted(orders))
+		self.assertEquals(len(set(orders)), len(orders))
+
+	def testSameAsStructuralOrder(self):
+		shuffled = self.nodes[::-1]
+		xpath.expr.sort_document_order(shuffled)
+		self.assertEquals(shuffled, self.nodes)
+		self.assertEquals(sorted(self.nodes, key=xpath.expr.document_order), self.nodes)
+
+	def testSubtreeInterval(self):
+		b = self.nodes[4]
+		self.assertEquals(b.xpath_last, self.nodes[6].xpath_order)
+		self.assertEquals(self.doc.xpath_last, self.nodes[-1].xpath_order)
+
+	def testDocumentIndex(self):
+		self.assertTrue(xpath.index.document_index(self.nodes[3]) is self.index)
+		self.assertTrue(xpath.index.document_index(self.nodes[5]) is self.index)
+		other = xml.dom.minidom.parseString('<a/>')
+		self.assertEquals(xpath.index.document_index(other.documentElement), None)
+
+	def testFallbackForNewNodes(self):
+		b = self.nodes[4]
+		e = self.doc.createElement('e')
+		b.insertBefore(e, b.firstChild)
+		nodes = [self.nodes[7], e, b]
+		xpath.expr.sort_document_order(nodes)
+		self.assertEquals(nodes, [b, e, self.nodes[7]])
+		self.assertTrue(xpath.expr.precedes(e, self.nodes[5]))
+
+	def testDocumentsDoNotOverlap(self):
+		other = xml.dom.minidom.parseString('<a><b/></a>')
+		xpath.index.index_document(other)
+		self.assertTrue(other.xpath_order > self.doc.xpath_last)
+		
+	def testDeepDocument(self):
+		depth = 5000
+		doc = xml.dom.minidom.parseString('<a>' * depth + 't' + '</a>' * depth)
+		xpath.index.index_document(doc)
+		text = doc
+		while text.firstChild is not None:
+			text = text.firstChild
+		self.assertEquals(text.xpath_order, doc.xpath_order + depth + 1)
+		self.assertEquals(doc.xpath_last, text.xpath_order)
+		self.assertEquals(doc.documentElement.xpath_last, text.xpath_order)
+
+class TestNameIndex(unittest.TestCase):
+	def setUp(self):
+		self.doc = xml.dom.minidom.parseString(
+			'<a xmlns:p="uri:p"><b><b/><p:b/></b><c><b/></c><q:b xmlns:q="uri:p"/></a>')
+		self.a = self.doc.documentElement
+		self.b = [n for n in xpath.expr.axes['descendant'](self.doc) if n.localName == 'b']
+
+	def find(self, s, node):
+		return xpath.find(s, node, namespaces={'x': 'uri:p'})
+
+	def testSameAsWalk(self):
+		expected = [self.find(s, self.a) for s in ('//b', './/x:b', 'descendant-or-self::b', 'c//b')]
+		xpath.index.index_document(self.doc)
+		for s, r in zip(('//b', './/x:b', 'descendant-or-self::b', 'c//b'), expected):
+			self.assertEquals(self.find(s, self.a), r, s)
+
+	def testDescendants(self):
+		index = xpath.index.index_document(self.doc)
+		outer, inner, p, c, q = self.b
+		self.assertEquals(index.descendants(self.doc, None, 'b'), [outer, inner, c])
+		self.assertEquals(index.descendants(outer, None, 'b'), [inner])
+		self.assertEquals(index.descendants(outer, None, 'b', self_too=True), [outer, inner])
+		self.assertEquals(index.descendants(self.a, 'uri:p', 'b'), [p, q])
+		self.assertEquals(index.descendants(inner, None, 'b'), [])
+		self.assertEquals(index.descendants(self.a, None, 'x'), [])
+
+	def testUnnumberedNode(self):
+		xpath.index.index_document(self.doc)
+		e = self.doc.createElement('e')
+		e.appendChild(self.doc.createElement('b'))
+		self.assertEquals(xpath.find('.//b', e), [e.firstChild])
+
+class TestAttributeIndex(unittest.TestCase):
+	def setUp(self):
+		self.doc = xml.dom.minidom.parseString('<r xmlns:p="uri:p"><b x="1"><b x="01"/><c x="1"/></b>'
+			'<b x="2" p:x="1"/><v><i>1</i><i>2</i></v><b x="1"/></r>')
+		self.queries = ("//b[@x = '1']", "//b[@x = 1]", "//*[@x = //i]", "//b[//i[2] = @x]",
+			"b/b[@x = '01']", "//b[@x = '1'][2]", "//b[@p:x = '1']", "descendant-or-self::b[@x = '1']",
+			"//b[@x = $v]", "//b[@x = concat('0', '1')]", "count(//b[@x = '3'])")
+
+	def find(self, s, node):
+		return xpath.find(s, node, namespaces={'p': 'uri:p'}, v=u'2')
+
+	def testOwners(self):
+		index = xpath.index.index_document(self.doc)
+		r = self.doc.documentElement
+		b = r.getElementsByTagName('b')
+		c = r.getElementsByTagName('c')
+		self.assertEquals(index.attribute_owners(None, 'x', '1'), [b[0], c[0], b[3]])
+		self.assertEquals(index.attribute_owners('uri:p', 'x', '1'), [b[2]])
+		self.assertEquals(index.attribute_owners(None, 'x', '3'), [])
+		self.assertEquals(index.attribute_owners(None, 'y', '1'), [])
+
+	def testSameAsScan(self):
+		r = self.doc.documentElement
+		nodes = (r, r.firstChild, r.firstChild.firstChild)
+		expected = [self.find(s, n) for s in self.queries for n in nodes]
+		xpath.index.index_document(self.doc)
+		self.assertEquals([self.find(s, n) for s in self.queries for n in nodes], expected)
+
+	def testCurrent(self):
+		xpath.index.index_document(self.doc)
+		b = self.doc.getElementsByTagName('b')
+		context = xslt.core.XSLTContext(None)
+		context.nodeset = [b[1]]
+		x = xslt.xp.XPath("//b[@x = current()/@x] | //b[@x = substring(current()/@x, 2)]")
+		self.assertEquals(x.find(context), [b[0], b[1], b[3]])
+
+	def testSeveralDocuments(self):
+		other = xml.dom.minidom.parseString('<r><b x="1"/><b x="2"/></r>')
+		xpath.index.index_document(self.doc)
+		xpath.index.index_document(other)
+		v = xpath.find('//b', self.doc) + xpath.find('//b', other)
+		expected = [v[0], v[3], v[4]]
+		self.assertEquals(xpath.find('$v[@x = "1"]', self.doc, v=v), expected)
+		self.assertEquals(xpath.find('$v[@x = "1"]', other, v=v), expected)
+		self.assertEquals(xpath.find('count($v[@x = "1"])', self.doc, v=v), 3)
+		self.assertEquals(xpath.find('$v[@x = id("a")]', self.doc, v=v), [])
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,126 @@
+import unittest
+import xml.dom.minidom
+import xpath, xpath.expr, xpath.index, xpath.functions
+
+DOCUMENT = '''<a>
+	<b x="1"><c/><b x="2"><c/><d/></b><c y="3"/></b>
+	<b skip="1"><b><c/></b></b>
+	<e><c/><!-- c --><?p c?>text</e>
+</a>'''
+
+class TestLazy(unittest.TestCase):
+	expressions = ['//b', '//b/c', '//*', '//node()', '/a/b/@*', '//@*', 'descendant::b[c]',
+		'//b | //c', '//c | //b', '//b//c', '//b/descendant-or-self::*', '//b/self::b/c',
+		'//b[not(@skip)]/c', '//b[c][d]', '//e/node()', '//e/text()', '//e/comment()',
+		'//processing-instruction()', '/a/*/b/c', '$v/c', '$v//c', '//b[@x = "1"]', '(//b)[2]',
+		'//b[last()]', '//b[position() > 1]/c', '//c/..', '//c/ancestor::*', '//c/following::*']
+		
+	def setUp(self):
+		self.docs = []
+		for indexed in (False, True):
+			doc = xml.dom.minidom.parseString(DOCUMENT)
+			if indexed:
+				xpath.index.index_document(doc)
+			self.docs.append(doc)
+			
+	def context(self, doc):
+		context = xpath.XPathContext(doc)
+		# in reverse document order on purpose
+		context.variables[(None, 'v')] = xpath.find('//b', doc)[::-1]
+		return context
+			
+	def testSameNodes(self):
+		for doc in self.docs:
+			context = self.context(doc)
+			for s in self.expressions:
+				expr = xpath.XPath(s).expr
+				expected = xpath.expr.ordered_nodeset(expr.compiled()(doc, 1, 1, context))
+				iterate = expr.iterated()
+				if iterate is None:
+					continue
+				nodes = list(xpath.expr.iter_nodeset(iterate(doc, 1, 1, context)))
+				self.assertEquals(nodes, expected, s)
+				self.assertEquals(xpath.expr.first_only(iterate(doc, 1, 1, context)), expected[:1], s)
+				
+	def testStreamedNodes(self):
+		for doc in self.docs:
+			context = self.context(doc)
+			for s in self.expressions + ['//b//c', '//b//b', '$v//c', '$v/..', '//c/../c',
+					'//b/following-sibling::*', '(//b)[2]/c | //c', '//*[not(@x)]//c']:
+				expr = xpath.XPath(s).expr
+				expected = xpath.expr.ordered_nodeset(expr.compiled()(doc, 1, 1, context))
+				nodes = list(xpath.expr.iter_unordered(expr.streamed()(doc, 1, 1, context)))
+				self.assertEquals(len(nodes), len(expected), s)
+				self.assertEquals(set(nodes), set(expected), s)
+				self.assertEquals(xpath.find('count(%s)' % s, doc, context=context), len(expected), s)
+				self.assertEquals(xpath.find('boolean(%s)' % s, doc, context=context), bool(expected), s)
+				
+	def testAggregates(self):
+		doc = self.docs[1]
+		self.assertEquals(xpath.find('sum(//@x)', doc), 3)
+		self.assertEquals(xpath.find('sum(//b/@x | //@y)', doc), 6)
+		self.assertEquals(xpath.find('sum(//e)', doc) != xpath.find('sum(//e)', doc), True)
+		self.assertEquals(xpath.find('sum(//f)', doc), 0)
+		self.assertEquals(xpath.find('count(//b/b/c)', doc), 2)
+		self.assertEquals(xpath.find('count(//f) = 0', doc), True)
+		self.assertEquals(xpath.find('boolean(//b[@skip]/b/c)', doc), True)
+		self.assertRaises(xpath.XPathTypeError, xpath.find, 'count("b")', doc)
+		self.assertTrue(xpath.functions.f_count.aggregate)
+		self.assertTrue(xpath.functions.f_boolean.aggregate)
+		self.assertFalse(xpath.functions.f_string.aggregate)
+		
+	def testAggregatesUnordered(self):
+		# the nodes of an unindexed document are never put in document order
+		doc = self.docs[0]
+		calls = []
+		document_order = xpath.expr.document_order
+		def counting(node):
+			calls.append(node)
+			return document_order(node)
+		xpath.expr.document_order = counting
+		try:
+			for s, v in [('count(//c/..)', 4), ('count(//b//c)', 4), ('sum(//c/../@x)', 3),
+					('boolean(//c/ancestor::b)', True), ('count(//b/c | //c)', 5)]:
+				self.assertEquals(xpath.find(s, doc), v, s)
+		finally:
+			xpath.expr.document_order = document_order
+		self.assertEquals(calls, [])
+		
+	def testLazyForms(self):
+		for s in ['//b', '//b/c', '//b[not(@skip)]', '//b | $v', 'a/b//c']:
+			self.assertNotEquals(xpath.XPath(s).expr.iterated(), None, s)
+		for s in ['$v', '(//b)[2]', '(//b)[position() > 1]', '//c/..', 'count(//b)']:
+			self.assertEquals(xpath.XPath(s).expr.iterated(), None, s)
+			
+	def testStopsEarly(self):
+		calls = []
+		def f_not(node, pos, size, context, b):
+			calls.append(node)
+			return not b
+		f_not.lazy = True
+		for doc in self.docs:
+			context = self.context(doc)
+			context.functions = dict(context.functions, **{'not': f_not})
+			for s, n in [('boolean(//b[not(@skip)])', 1), ('string(//b[not(@skip)]/@x)', 1),
+					('string(//b[not(@skip)]/c)', 3),
+					('count(//b[not(@skip)])', 4), ('//c[not(.)] or //b[not(@y)]', 6)]:
+				del calls[:]
+				xpath.find(s, doc, context=context)
+				self.assertEquals(len(calls), n, s)
+			
+	def testFunctions(self):
+		doc = self.docs[0]
+		self.assertEquals(xpath.find('string(//b/c/@y)', doc), '3')
+		self.assertEquals(xpath.find('boolean(//e/c)', doc), True)
+		self.assertEquals(xpath.find('boolean(//e/b)', doc), False)
+		self.assertEquals(xpath.find('not(//d)', doc), False)
+		self.assertEquals(xpath.find('number(//b/@x) + 1', doc), 2)
+		self.assertEquals(xpath.find('name(//b[2]/*)', doc), 'b')
+		self.assertEquals(xpath.findnode('//d', doc).nodeName, 'd')
+		self.assertEquals(xpath.findnode('//f', doc), None)
+		self.assertTrue(xpath.functions.f_string.lazy)
+		self.assertTrue(xpath.functions.f_contains.lazy)
+		self.assertFalse(xpath.functions.f_count.lazy)
+		
+if __name__ == '__main__':
+	unittest.main()
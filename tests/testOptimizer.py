@@ -0,0 +1,77 @@
+import unittest
+import xpath, xpath.optimizer
+import xslt.xp, xslt.tools
+import xml.dom.minidom
+
+def optimized(s):
+	return str(xpath.optimizer.optimize(xslt.xp.XPath.compile(s)))
+
+class TestOptimizer(unittest.TestCase):
+	def setUp(self):
+		self.optimize = xslt.xp.XPathBase.optimize
+		xslt.xp.XPathBase.optimize = False
+
+	def tearDown(self):
+		xslt.xp.XPathBase.optimize = self.optimize
+
+	def testConstantFolding(self):
+		self.assertEquals(optimized('1 + 2 * 3'), '7.0')
+		self.assertEquals(optimized('-(3)'), '-3.0')
+		self.assertEquals(optimized("concat('a', 'b')"), "'ab'")
+		self.assertEquals(optimized('not(1 = 1)'), 'false()')
+		self.assertEquals(optimized('a[1 + 1]'), 'child::a[2.0]')
+		self.assertEquals(optimized('1 + $x'), '(1.0 + $x)')
+
+	def testDescendant(self):
+		self.assertEquals(optimized('//a'), '/descendant::a')
+		self.assertEquals(optimized('.//a/b'), 'descendant::a/child::b')
+		self.assertEquals(optimized("//a[@x = '1']"), "/descendant::a[(attribute::x = '1')]")
+		self.assertEquals(optimized('//@a'), '/descendant-or-self::node()/attribute::a')
+
+	def testPositionalPredicates(self):
+		for s in ('//a[1]', '//a[position() > 1]', '//a[last()]', '//a[$n]', '//a[@x + 1]'):
+			self.assertEquals(optimized(s), str(xslt.xp.XPath.compile(s)), s)
+
+	def testSelfNode(self):
+		self.assertEquals(optimized('./a/.'), 'child::a')
+		self.assertEquals(optimized('.'), 'self::node()')
+		self.assertEquals(optimized('$v/.'), '$v/self::node()')
+
+	def testDoubleNegation(self):
+		self.assertEquals(optimized('not(not(a))'), 'boolean(child::a)')
+		self.assertEquals(optimized('not(not(not(a)))'), 'not(boolean(child::a))')
+
+	def testSameResults(self):
+		doc = xml.dom.minidom.parseString('<r><a x="1"><a x="2"/><b/></a><b><a/></b></r>')
+		for s in ('//a', '//a[1]', '//a[@x]', './/a/.', 'count(//a[not(not(@x))])',
+				'//a[last()]', 'string(//a[2]/@x)', '//*[2]', '//b/..'):
+			expr = xslt.xp.XPath.compile(s)
+			plain = expr.evaluate(doc, 1, 1, xpath.XPathContext(doc))
+			expr = xpath.optimizer.optimize(xslt.xp.XPath.compile(s))
+			fast = expr.evaluate(doc, 1, 1, xpath.XPathContext(doc))
+			self.assertEquals(plain, fast, s)
+
+	def testSwitch(self):
+		self.assertEquals(str(xslt.xp.XPath('//a', useCache=False)), '/descendant-or-self::node()/child::a')
+		xslt.xp.XPathBase.optimize = True
+		self.assertEquals(str(xslt.xp.XPath('//a', useCache=False)), '/descendant::a')
+		
+	def testSwitchCached(self):
+		xslt.xp.XPathBase.optimize = True
+		self.assertEquals(str(xslt.xp.XPath('//a').expr), '/descendant::a')
+		xslt.xp.XPathBase.optimize = False
+		self.assertEquals(str(xslt.xp.XPath('//a').expr), '/descendant-or-self::node()/child::a')
+		
+		class Plain(xslt.xp.XPath):
+			optimize = False
+		xslt.xp.XPathBase.optimize = True
+		self.assertEquals(str(Plain('//a').expr), '/descendant-or-self::node()/child::a')
+		self.assertEquals(str(xslt.xp.XPath('//a').expr), '/descendant::a')
+
+	def testDefaultPriority(self):
+		for s, priority in (('a', 0), ('p:*', -0.25), ('*', -0.5), ('a/b', 0.5), ('a[1]', 0.5)):
+			p = xpath.optimizer.optimize(xslt.xp.Pattern.compile(s))
+			self.assertEquals(xslt.tools.computeDefaultPriority(p), priority, s)
+
+if __name__ == '__main__':
+	unittest.main()
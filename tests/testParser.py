@@ -0,0 +1,76 @@
+import unittest
+import random
+import xpath.expr, xpath.rdparser, xpath.yappsrt
+import xslt.xp
+import benchParser
+
+RULES = ('XPath', 'Pattern', 'AttributeValueTemplate')
+
+def dump(x):
+	"""Returns a structure comparing equal for equal expression trees."""
+	
+	if isinstance(x, list):
+		return [dump(i) for i in x]
+	if isinstance(x, tuple):
+		return tuple(dump(i) for i in x)
+	if hasattr(x, '__dict__') and not callable(x):
+		return type(x).__name__, sorted((k, dump(v)) for k, v in x.__dict__.items() if k != '_compiled')
+	return x
+
+def parse(parserClass, rule, s):
+	try:
+		return dump(getattr(parserClass(s), rule)())
+	except (xpath.yappsrt.SyntaxError, NotImplementedError):
+		return 'error'
+		
+		
+class TestParser(unittest.TestCase):
+	extra = ['child :: a', 'parent::x', 'parent', 'parent (x)', 'text', 'foo/text', 'node ()', 
+		'a:b(c)', 'a:b', 'a :b', 'p:*', '*:x', '$x:y', '$a-(1)', '@a-(1)', 'a andb', 'a or-1', 
+		'1 div-1', '/ and 1', '/*', '/div', '- - 1', '-a|b', 'a|-b', 'count (x)', 'f()', 'f(,)', 
+		'a/', '//', '/', '..[1]', '.[1]', '"x"[1]', 'a[1][2]/b', '1e3', '5.', '.5', 'a!b', 
+		'id', 'id (1)', 'ids(1)', 'child', 'attribute::x', 'descendant::x', 'a|/', '//a', 
+		'id("a")//c', 'key("a", 2)/c', 'key(\'a\')', 'processing-instruction(x)', 
+		'{a} {b}', '  {x}', 'a  {x}  ', ' ', '', 'x}y', '{{a}}', '{}', '{a', '{"}"}', 
+		'1 + 2 * 3 - 4 div 5 mod 6', 'a = b != c < d <= e > f >= g', 'a or b and c or d']
+		
+	def assertSameTree(self, rule, s):
+		self.assertEquals(parse(xslt.xp.YappsParser, rule, s), 
+			parse(xpath.rdparser.Parser, rule, s), (rule, s))
+			
+	def testCorpus(self):
+		for cls, s in benchParser.CORPUS:
+			self.assertNotEquals(parse(xpath.rdparser.Parser, cls._rule, s), 'error')
+			self.assertSameTree(cls._rule, s)
+			
+	def testEdgeCases(self):
+		for s in self.extra:
+			for rule in RULES:
+				self.assertSameTree(rule, s)
+				
+	def testRandom(self):
+		# strings of tokens and names the generated scanner treats specially
+		atoms = ['a', 'p:q', '*', '@', '/', '//', '.', '..', '(', ')', '[', ']', ',', '|', '$', 
+			':', '::', 'and', 'or', 'div', 'mod', '-', '+', '=', '!=', '<', '>=', '1', '.5', 
+			'"s"', "'t'", 'node', 'text', 'processing-instruction', 'child', 'parent', 'self', 
+			'id', 'key', 'f', ' ', '{', '}', 'x-', 'andy', 'e', '1e3', '!']
+		rnd = random.Random(23)
+		for i in xrange(3000):
+			s = ''.join(rnd.choice(atoms) for j in xrange(rnd.randint(1, 6)))
+			self.assertSameTree(rnd.choice(RULES), s)
+			
+	def testErrorPosition(self):
+		for s, pos in [('a +', 3), ('f(1', 3), ('a b', 2), ('@', 1), ('a[1', 3)]:
+			try:
+				xpath.rdparser.parse('XPath', s)
+			except xpath.yappsrt.SyntaxError, e:
+				self.assertEquals(e.pos, pos, s)
+			else:
+				self.fail(s)
+				
+	def testSelected(self):
+		self.assertRaises(xpath.XPathParseError, xslt.xp.XPath, 'a[')
+		self.assertEquals(str(xslt.xp.XPath.compile('a|b')), str(xpath.rdparser.parse('XPath', 'a|b')))
+		
+if __name__ == '__main__':
+	unittest.main()
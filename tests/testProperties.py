@@ -237,12 +237,12 @@ class TestExprProperty(TestProperties):
 class TestPatternProperty(TestProperties):
 
 	def testSimple(self):
-		self.assertEquals(str(patternProperty(self.root, 'pattern')), '/descendant-or-self::node()/child::a')
+		self.assertEquals(str(patternProperty(self.root, 'pattern')), '/descendant::a')
 
 		
 	def testAbsent(self):
 		self.assertEquals(patternProperty(self.root, 'pattern0'), None)
-		self.assertEquals(str(patternProperty(self.root, 'pattern0', default='*')), '/descendant-or-self::node()/child::*:*')
+		self.assertEquals(str(patternProperty(self.root, 'pattern0', default='*')), '/descendant::*:*')
 		
 		
 	def testInvalid(self):
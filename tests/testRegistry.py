@@ -0,0 +1,111 @@
+import unittest
+import os, tempfile, shutil
+import xslt, xslt.core, xslt.registry, xslt.cache
+
+class TestStylesheetRegistry(unittest.TestCase):
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		for name in 'abc':
+			self.writeStylesheet(name + '.xsl', name)
+		self.write('d.xml', '<r/>')
+		self.registry = xslt.registry.StylesheetRegistry(dp=xslt.core.DocumentProvider())
+		
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+		
+	def path(self, name):
+		return os.path.join(self.dir, name)
+		
+	def write(self, name, text):
+		f = open(self.path(name), 'w')
+		f.write(text)
+		f.close()
+		
+	def writeStylesheet(self, name, out, include=''):
+		self.write(name, '<s:stylesheet version="1.0" xmlns:s="http://www.w3.org/1999/XSL/Transform">'
+			'%s<s:output omit-xml-declaration="yes"/><s:template match="/"><%s/></s:template>'
+			'</s:stylesheet>' % (include, out))
+		
+	def touch(self, name, delta):
+		st = os.stat(self.path(name))
+		os.utime(self.path(name), (st.st_atime, st.st_mtime + delta))
+		
+	def transform(self, name):
+		p = xslt.XSLTProcessor(registry=self.registry)
+		p.setStylesheet(self.path(name))
+		return p.transform(self.path('d.xml'))
+		
+	def testShared(self):
+		a = self.registry.stylesheet(self.path('a.xsl'))
+		self.assertTrue(self.registry.stylesheet(self.path('a.xsl')) is a)
+		self.assertEquals(self.transform('a.xsl'), '<a/>')
+		stats = self.registry.stats()
+		self.assertEquals((stats['hits'], stats['misses'], stats['entries']), (2, 1, 1))
+		self.assertEquals(stats['bytes'], os.path.getsize(self.path('a.xsl')))
+		
+	def testChanged(self):
+		a = self.registry.stylesheet(self.path('a.xsl'))
+		self.writeStylesheet('a.xsl', 'x')
+		self.touch('a.xsl', 10)
+		self.assertTrue(self.registry.stylesheet(self.path('a.xsl')) is not a)
+		self.assertEquals(self.transform('a.xsl'), '<x/>')
+		self.assertEquals(self.registry.misses, 2)
+		self.assertEquals(self.registry.stats()['entries'], 1)
+		
+	def testChangedWhileCompiling(self):
+		class Provider(xslt.core.DocumentProvider):
+			def document(self, uri, base=''):
+				doc = xslt.core.DocumentProvider.document(self, uri, base)
+				if self.edit is not None:
+					edit, self.edit = self.edit, None
+					edit()
+				return doc
+		def edit():
+			self.writeStylesheet('a.xsl', 'x')
+			self.touch('a.xsl', 10)
+		self.registry.dp = Provider()
+		self.registry.dp.edit = edit
+		a = self.registry.stylesheet(self.path('a.xsl'))
+		self.assertTrue(self.registry.stylesheet(self.path('a.xsl')) is not a)
+		self.assertEquals(self.transform('a.xsl'), '<x/>')
+		
+	def testChangedInclude(self):
+		self.write('inc.xsl', '<s:stylesheet version="1.0" xmlns:s="http://www.w3.org/1999/XSL/Transform"/>')
+		self.writeStylesheet('i.xsl', 'i', '<s:include href="inc.xsl"/>')
+		self.assertEquals(self.transform('i.xsl'), '<i/>')
+		self.write('inc.xsl', '<s:stylesheet version="1.0" xmlns:s="http://www.w3.org/1999/XSL/Transform">'
+			'<s:template match="/" priority="1"><inc/></s:template></s:stylesheet>')
+		self.touch('inc.xsl', 10)
+		self.assertEquals(self.transform('i.xsl'), '<inc/>')
+		
+	def testMaxEntries(self):
+		self.registry.maxEntries = 2
+		a = self.registry.stylesheet(self.path('a.xsl'))
+		b = self.registry.stylesheet(self.path('b.xsl'))
+		self.registry.stylesheet(self.path('a.xsl'))
+		self.registry.stylesheet(self.path('c.xsl'))
+		self.assertEquals(self.registry.evictions, 1)
+		self.assertEquals(self.registry.entries.keys(), [self.path('a.xsl'), self.path('c.xsl')])
+		self.assertTrue(self.registry.stylesheet(self.path('a.xsl')) is a)
+		self.assertTrue(self.registry.stylesheet(self.path('b.xsl')) is not b)
+		
+	def testMaxBytes(self):
+		size = os.path.getsize(self.path('a.xsl'))
+		self.registry.maxBytes = size * 2
+		for name in 'abc':
+			self.registry.stylesheet(self.path(name + '.xsl'))
+		self.assertEquals(self.registry.stats()['bytes'], size * 2)
+		self.assertEquals(self.registry.entries.keys(), [self.path('b.xsl'), self.path('c.xsl')])
+		# one stylesheet over the budget is still kept
+		self.registry.maxBytes = 1
+		self.registry.stylesheet(self.path('a.xsl'))
+		self.assertEquals(self.registry.entries.keys(), [self.path('a.xsl')])
+		self.assertEquals(self.registry.evictions, 3)
+		
+	def testCache(self):
+		self.registry.cache = xslt.cache.StylesheetCache(self.path('cache'))
+		self.assertEquals(self.transform('a.xsl'), '<a/>')
+		self.assertEquals(len(os.listdir(self.path('cache'))), 1)
+		
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,167 @@
+import unittest
+from StringIO import StringIO
+import xslt.result, xslt.serializer, xslt.core, xslt.exceptions
+import xml.dom, xml.dom.minidom
+
+class TestDOMBuilder(unittest.TestCase):
+	def setUp(self):
+		self.doc = xml.dom.getDOMImplementation().createDocument(None, None, None)
+		self.frag = self.doc.createDocumentFragment()
+		self.builder = xslt.result.DOMBuilder(self.frag)
+		
+	def testEvents(self):
+		b = self.builder
+		b.startElement(None, 'a')
+		b.attribute(None, 'x', '1')
+		b.text('t')
+		b.startElement('uri:p', 'p:b')
+		b.endElement()
+		b.comment('c')
+		b.endElement()
+		b.text('u')
+		self.assertEquals(self.frag.firstChild.toxml(), '<a x="1">t<p:b/><!--c--></a>')
+		self.assertEquals(self.frag.lastChild.data, 'u')
+		
+	def testLateAttribute(self):
+		b = self.builder
+		b.startElement(None, 'a')
+		b.text('t')
+		self.assertRaises(xslt.exceptions.UnexpectedAttribute, b.attribute, None, 'x', '1')
+		
+	def testCopy(self):
+		src = xml.dom.minidom.parseString('<r><a x="1">t<b/></a></r>')
+		self.builder.startElement(None, 'c')
+		self.builder.push([src.documentElement.firstChild.getAttributeNode('x'), src.documentElement, 's'])
+		self.builder.endElement()
+		self.assertEquals(self.frag.firstChild.toxml(), '<c x="1"><r><a x="1">t<b/></a></r>s</c>')
+		
+		
+class TestTextBuilder(unittest.TestCase):
+	def testText(self):
+		b = xslt.result.TextBuilder()
+		b.text('a')
+		b.push([u'\u044f', xml.dom.minidom.parseString('<a>b</a>').documentElement.firstChild])
+		self.assertEquals(b.getvalue(), u'a\u044fb')
+		self.assertRaises(xslt.exceptions.InvalidContent, b.startElement, None, 'a')
+		
+		
+class TestXMLSerializer(unittest.TestCase):
+	def serialize(self, events, **output):
+		s = StringIO()
+		ser = xslt.serializer.XMLSerializer(output, s)
+		ser.startDocument()
+		for e in events:
+			getattr(ser, e[0])(*e[1:])
+		ser.endDocument()
+		return s.getvalue()
+		
+	def testDeclaration(self):
+		self.assertEquals(self.serialize([], encoding='utf-8'), '<?xml version="1.0" encoding="utf-8"?>')
+		self.assertEquals(self.serialize([('text', 'a')], **{'omit-xml-declaration': True}), 'a')
+		
+	def testEscaping(self):
+		self.assertEquals(self.serialize([('startElement', None, 'a'), ('attribute', None, 'x', '<&"'), 
+			('text', 'a<&>'), ('text', '<b/>', True), ('endElement',)], **{'omit-xml-declaration': True}),
+			'<a x=\'&lt;&amp;"\'>a&lt;&amp;&gt;<b/></a>')
+		
+	def testEmptyElements(self):
+		self.assertEquals(self.serialize([('startElement', None, 'a'), ('startElement', None, 'b'), 
+			('endElement',), ('text', ''), ('endElement',)], **{'omit-xml-declaration': True}), '<a><b/></a>')
+			
+	def testNamespaces(self):
+		events = [('startElement', 'uri:a', 'a'), ('startElement', 'uri:a', 'a'), ('attribute', 'uri:p', 'p:x', '1'),
+			('startElement', None, 'b'), ('attribute', 'uri:q', 'y', '2'), ('endElement',), 
+			('startElement', 'uri:p', 'p:c'), ('attribute', 'uri:p', 'p:z', '3'), ('endElement',),
+			('endElement',), ('endElement',)]
+		self.assertEquals(self.serialize(events, **{'omit-xml-declaration': True}),
+			'<a xmlns="uri:a"><a xmlns:p="uri:p" p:x="1"><b xmlns="" xmlns:ns0="uri:q" ns0:y="2"/>'
+			'<p:c p:z="3"/></a></a>')
+			
+	def testDeclaredNamespaces(self):
+		events = [('startElement', None, 'a'), ('attribute', xml.dom.XMLNS_NAMESPACE, 'xmlns:p', 'uri:p'),
+			('startElement', 'uri:p', 'p:b'), ('endElement',), ('endElement',)]
+		self.assertEquals(self.serialize(events, **{'omit-xml-declaration': True}),
+			'<a xmlns:p="uri:p"><p:b/></a>')
+			
+	def testCdataAndDoctype(self):
+		events = [('startElement', None, 'a'), ('startElement', None, 'c'), ('text', 'x]]>y'),
+			('endElement',), ('text', '<'), ('endElement',)]
+		output = {'omit-xml-declaration': True, 'cdata-section-elements': set([(None, 'c')]), 
+			'doctype-system': 'a.dtd'}
+		self.assertEquals(self.serialize(events, **output),
+			'<!DOCTYPE a SYSTEM "a.dtd"><a><c><![CDATA[x]]]]><![CDATA[>y]]></c>&lt;</a>')
+		
+	def testUnencodable(self):
+		events = [('startElement', None, 'c'), ('text', u'x\u044fy\u044f'), ('text', u'\xe9'), ('endElement',)]
+		output = {'omit-xml-declaration': True, 'cdata-section-elements': set([(None, 'c')]), 
+			'encoding': 'iso-8859-1'}
+		self.assertEquals(self.serialize(events, **output),
+			u'<c><![CDATA[x]]>&#1103;<![CDATA[y]]>&#1103;<![CDATA[\xe9]]></c>')
+		for event in [('comment', u'\u044f'), ('processingInstruction', 'p', u'\u044f')]:
+			self.assertRaises(xslt.exceptions.UnencodableContent, self.serialize, [event], **output)
+		self.assertEquals(self.serialize([('comment', u'\xe9')], **output), u'<!--\xe9-->')
+		
+	def testSerializeResult(self):
+		doc = xml.dom.minidom.parseString(u'<a xmlns:p="uri:p"><p:b>\u044f</p:b><!--c--></a>'.encode('utf-8'))
+		ser = xslt.serializer.XMLSerializer({'omit-xml-declaration': True})
+		self.assertEquals(ser.serializeResult(doc), u'<a xmlns:p="uri:p"><p:b>\u044f</p:b><!--c--></a>'.encode('utf-8'))
+		
+		
+class TestTextSerializer(unittest.TestCase):
+	def testText(self):
+		s = StringIO()
+		ser = xslt.serializer.forOutput({'method': (None, 'text')}, s)
+		ser.startElement(None, 'a')
+		ser.attribute(None, 'x', '1')
+		ser.text('a<')
+		ser.endElement()
+		ser.text('b')
+		self.assertEquals(s.getvalue(), 'a<b')
+		
+		
+class TestStreamWriter(unittest.TestCase):
+	class Stream(object):
+		def __init__(self):
+			self.chunks = []
+		def write(self, data):
+			self.chunks.append(data)
+			
+	def testChunks(self):
+		stream = self.Stream()
+		w = xslt.serializer.StreamWriter(stream, chunkSize=4)
+		w.write(u'ab')
+		self.assertEquals(stream.chunks, [])
+		w.write(u'c\u044f')
+		w.write(u'd')
+		self.assertEquals(stream.chunks, [u'abc\u044f'.encode('utf-8')])
+		w.close()
+		self.assertEquals(stream.chunks, [u'abc\u044f'.encode('utf-8'), 'd'])
+		
+	def testCharacterReferences(self):
+		stream = self.Stream()
+		w = xslt.serializer.StreamWriter(stream, 'iso-8859-1')
+		w.write(u'\xe9\u044f')
+		w.close()
+		self.assertEquals(''.join(stream.chunks), '\xe9&#1103;')
+		
+	def testIncremental(self):
+		stream = self.Stream()
+		w = xslt.serializer.StreamWriter(stream, 'utf-16', chunkSize=1)
+		w.write(u'a')
+		w.write(u'b')
+		w.close()
+		self.assertEquals(''.join(stream.chunks).decode('utf-16'), u'ab')
+		
+		
+class TestFixNamespaces(unittest.TestCase):
+	def testFix(self):
+		doc = xml.dom.getDOMImplementation().createDocument(None, None, None)
+		a = doc.appendChild(doc.createElementNS('uri:a', 'a'))
+		b = a.appendChild(doc.createElementNS('uri:a', 'b'))
+		b.setAttributeNS('uri:p', 'p:x', '1')
+		c = b.appendChild(doc.createElementNS(None, 'c'))
+		xslt.core.fixNamespaces(doc)
+		self.assertEquals(a.toxml(), '<a xmlns="uri:a"><b p:x="1" xmlns:p="uri:p"><c xmlns=""/></b></a>')
+		
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,64 @@
+import unittest
+import xpath.parser, xpath.yappsrt
+import xslt.xp
+import benchParser
+
+class ReferenceScanner(xpath.parser.XPathScanner):
+	"""The scanner as generated by yapps: every allowed pattern 
+	is tried at every position."""
+	
+	def scan(self, restrict):
+		while 1:
+			best_match = -1
+			best_pat = '(error)'
+			for p, regexp in self.patterns:
+				if restrict and p not in restrict and p not in self.ignore:
+					continue
+				m = regexp.match(self.input, self.pos)
+				if m and len(m.group(0)) > best_match:
+					best_pat = p
+					best_match = len(m.group(0))
+			if best_pat == '(error)' and best_match < 0:
+				raise xpath.yappsrt.SyntaxError(self.pos, 'Bad Token')
+			if best_pat not in self.ignore:
+				token = (self.pos, self.pos+best_match, best_pat,
+						self.input[self.pos:self.pos+best_match])
+				self.pos = self.pos + best_match
+				if not self.tokens or token != self.tokens[-1]:
+					self.tokens.append(token)
+					self.restrictions.append(restrict)
+				return
+			else:
+				self.pos = self.pos + best_match
+				
+				
+class TestScanner(unittest.TestCase):
+	extra = ['child :: a', 'parent (: x', 'parent::x', 'ancestor-or-self (', 'and-or', 'div div div', 
+		'mod*mod', '.5 + 1. - 1.5e-3', 'a:b(c)', 'a:b', 'a :b', '$x:y', 'text ()', 'node-x', 
+		'"a\'b"', "'a\"b'", '@a!=b', 'a<=b>c', '//@*', '{', 'a]', '1 = ', '', '   ', 
+		'following-sibling ::x', 'self', 'namespace::*', 'processing-instruction("p")']
+	
+	def parse(self, scannerClass, rule, s):
+		parser = xpath.parser.XPath(scannerClass(s))
+		try:
+			getattr(parser, rule)()
+			return parser._scanner.tokens
+		except xpath.yappsrt.SyntaxError, e:
+			return 'error', e.pos
+			
+	def testSameTokens(self):
+		cases = [(cls._rule, s) for cls, s in benchParser.CORPUS]
+		cases += [(rule, s) for rule in ('XPath', 'Pattern', 'AttributeValueTemplate') for s in self.extra]
+		for rule, s in cases:
+			self.assertEquals(self.parse(xpath.parser.XPathScanner, rule, s), 
+				self.parse(ReferenceScanner, rule, s), (rule, s))
+				
+	def testFirstChars(self):
+		chars, nullable = xpath.yappsrt.first_chars(r'[a-c]x|\d+|y?z')
+		self.assertEquals(chars, frozenset('abcyz0123456789'))
+		self.assertFalse(nullable)
+		self.assertEquals(xpath.yappsrt.first_chars(r'[^\{]*')[1], True)
+		self.assertEquals(xpath.yappsrt.first_chars(r'parent(?!\s*\()')[0], frozenset('p'))
+		
+if __name__ == '__main__':
+	unittest.main()
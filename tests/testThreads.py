@@ -0,0 +1,104 @@
+import unittest
+import os, tempfile, shutil, threading, random
+import xslt, xslt.core, xslt.xp
+
+class TestConcurrentTransformations(unittest.TestCase):
+	"""Many threads transform documents with one stylesheet 
+	and document provider; results must be as in a single thread."""
+	
+	threads = 8
+	iterations = 15
+	
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.write('imp.xsl', '<s:stylesheet version="1.0" xmlns:s="http://www.w3.org/1999/XSL/Transform">'
+			'<s:template match="i" mode="m">[<s:value-of select="@id"/>]</s:template>'
+			'</s:stylesheet>')
+		self.write('s.xsl', '<s:stylesheet version="1.0" xmlns:s="http://www.w3.org/1999/XSL/Transform">'
+			'<s:import href="imp.xsl"/>'
+			'<s:strip-space elements="*"/>'
+			'<s:key name="k" match="i" use="@g"/>'
+			'<s:variable name="shared" select="document(\'shared.xml\')/v"/>'
+			'<s:template match="/"><out n="{count(//i)}">'
+			'<s:for-each select="//i[@g = 1]"><s:variable name="p" select="position()"/>'
+			'<s:apply-templates select="."><s:with-param name="p" select="$p"/></s:apply-templates></s:for-each>'
+			'<s:apply-templates select="key(\'k\', 2)" mode="m"/>'
+			'<s:value-of select="$shared"/></out></s:template>'
+			'<s:template match="i"><s:param name="p"/><i p="{$p}"><s:value-of select="concat(., \'-\', @id)"/></i></s:template>'
+			'<s:template match="i[@id mod 5 = 0]" mode="m" priority="1"><five/><s:apply-imports/></s:template>'
+			'</s:stylesheet>')
+		self.write('shared.xml', '<v>shared</v>')
+		self.docs = []
+		for d in range(10):
+			items = ''.join('<i id="%d" g="%d">\n  %d</i>\n' % (i, i % 3, i * d) for i in range(d * 5))
+			self.write('d%d.xml' % d, '<r>\n%s</r>' % items)
+			self.docs.append(self.path('d%d.xml' % d))
+		
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+		
+	def path(self, name):
+		return os.path.join(self.dir, name)
+		
+	def write(self, name, text):
+		f = open(self.path(name), 'w')
+		f.write(text)
+		f.close()
+		
+	def testTransform(self):
+		expected = {}
+		p = xslt.XSLTProcessor(xslt.core.DocumentProvider())
+		p.setStylesheet(self.path('s.xsl'))
+		for doc in self.docs:
+			expected[doc] = p.transform(doc)
+			
+		# a small provider, so documents are also evicted and parsed concurrently
+		p = xslt.XSLTProcessor(xslt.core.DocumentProvider(maxEntries=3))
+		p.setStylesheet(self.path('s.xsl'))
+		errors = []
+		def run(seed):
+			rnd = random.Random(seed)
+			try:
+				for i in range(self.iterations):
+					doc = rnd.choice(self.docs)
+					result = p.transform(doc)
+					if result != expected[doc]:
+						errors.append((doc, result))
+			except Exception, e:
+				errors.append(e)
+				
+		threads = [threading.Thread(target=run, args=(i,)) for i in range(self.threads)]
+		for t in threads:
+			t.start()
+		for t in threads:
+			t.join()
+		self.assertEquals(errors, [])
+		
+	def testExpressionCache(self):
+		cls = xslt.xp.XPath
+		maxsize = cls.cache.maxsize
+		cls.cache.resize(50)
+		self.addCleanup(cls.cache.resize, maxsize)
+		exprs = ['%d + count(//x[%d])' % (i, i) for i in range(100)]
+		expected = dict((s, str(cls.compile(s))) for s in exprs)
+		errors = []
+		def run(seed):
+			rnd = random.Random(seed)
+			try:
+				for i in range(500):
+					s = rnd.choice(exprs)
+					if str(cls.get(s)) != expected[s]:
+						errors.append(s)
+			except Exception, e:
+				errors.append(e)
+				
+		threads = [threading.Thread(target=run, args=(i,)) for i in range(self.threads)]
+		for t in threads:
+			t.start()
+		for t in threads:
+			t.join()
+		self.assertEquals(errors, [])
+		self.assertTrue(len(cls.cache) <= cls.cache.maxsize)
+		
+if __name__ == '__main__':
+	unittest.main()
@@ -161,7 +161,14 @@ class TestStripSpace(unittest.TestCase):
 		node = self.root.childNodes[1]
 		stripSpace(node, preserveSpaceList=[('uri:preserve', 'u')], defaultStrip=False)
 		node.writexml(self.r)
-		self.assertEquals(self.r.getvalue(), '<b> <u xmlns="uri:preserve"> <b/> </u> </b>')
+		self.assertEquals(self.r.getvalue(), '<b> <u xmlns="uri:preserve"> <b> </b> </u> </b>')
+		
+	def testDefaultStripWithList(self):
+		node = self.root.childNodes[1]
+		stripSpace(node, stripSpaceList=[(None, 'b'), ('uri:preserve', 'b')], preserveSpaceList=[('uri:preserve', 'u')],
+			defaultStrip=False)
+		node.writexml(self.r)
+		self.assertEquals(self.r.getvalue(), '<b><u xmlns="uri:preserve"> <b/> </u></b>')
 		
 class TestPushResult(unittest.TestCase):
 	def setUp(self):
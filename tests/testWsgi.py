@@ -0,0 +1,77 @@
+import unittest
+import os, tempfile, shutil, threading
+import xslt, xslt.core, xslt.wsgi
+
+class TestTransformIter(unittest.TestCase):
+	stylesheet = ('<s:stylesheet version="1.0" xmlns:s="http://www.w3.org/1999/XSL/Transform">'
+		'<s:output media-type="application/xml"/>'
+		'<s:template match="/"><out><s:for-each select="//i"><s:message>m</s:message><i><s:value-of select="."/></i></s:for-each></out></s:template>'
+		'</s:stylesheet>')
+		
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.write('s.xsl', self.stylesheet)
+		self.write('d.xml', '<r>%s</r>' % ''.join('<i>%d</i>' % i for i in range(1000)))
+		self.p = xslt.XSLTProcessor(xslt.core.DocumentProvider())
+		self.p.setStylesheet(self.path('s.xsl'))
+		
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+		
+	def path(self, name):
+		return os.path.join(self.dir, name)
+		
+	def write(self, name, text):
+		f = open(self.path(name), 'w')
+		f.write(text)
+		f.close()
+		
+	def testChunks(self):
+		messages = []
+		chunks = list(self.p.transformIter(self.path('d.xml'), messages=messages, chunkSize=100))
+		self.assertTrue(len(chunks) > 10)
+		self.assertEquals(''.join(chunks), self.p.transform(self.path('d.xml')))
+		self.assertEquals(messages, ['m'] * 1000)
+		
+	def testClose(self):
+		threads = threading.active_count()
+		chunks = self.p.transformIter(self.path('d.xml'), chunkSize=10)
+		self.assertTrue(chunks.next().startswith('<?xml'))
+		chunks.close()
+		self.assertEquals(threading.active_count(), threads)
+		
+	def testError(self):
+		self.write('bad.xml', '<r>')
+		self.assertRaises(Exception, list, self.p.transformIter(self.path('bad.xml')))
+		
+		
+class TestXSLTApplication(unittest.TestCase):
+	def setUp(self):
+		TestTransformIter.__dict__['setUp'](self)
+		self.app = xslt.wsgi.XSLTApplication(self.path('s.xsl'), self.dir, chunkSize=100)
+		
+	tearDown = TestTransformIter.__dict__['tearDown']
+	path = TestTransformIter.__dict__['path']
+	write = TestTransformIter.__dict__['write']
+	stylesheet = TestTransformIter.stylesheet
+	
+	def request(self, path):
+		response = []
+		def start_response(status, headers):
+			response.append((status, headers))
+		body = self.app({'PATH_INFO': path}, start_response)
+		return response[0], ''.join(body)
+		
+	def testServe(self):
+		(status, headers), body = self.request('/d.xml')
+		self.assertEquals(status, '200 OK')
+		self.assertEquals(headers, [('Content-Type', 'application/xml; charset=utf-8')])
+		self.assertEquals(body, self.p.transform(self.path('d.xml')))
+		
+	def testNotFound(self):
+		self.assertEquals(self.request('/x.xml')[0][0], '404 Not Found')
+		self.assertEquals(self.request('/../%s/d.xml' % os.path.basename(self.dir))[0][0], '200 OK')
+		self.assertEquals(self.request('/../d.xml')[0][0], '404 Not Found')
+		
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,89 @@
+import unittest
+import os, sys, tempfile, shutil
+import multiprocessing, multiprocessing.pool
+from StringIO import StringIO
+import xsltproc
+
+class TestBatch(unittest.TestCase):
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.write('s.xsl', '<s:stylesheet version="1.0" xmlns:s="http://www.w3.org/1999/XSL/Transform">'
+			'<s:output method="text"/><s:template match="/"><s:value-of select="/r"/></s:template>'
+			'</s:stylesheet>')
+		for i in range(10):
+			self.write('d%d.xml' % i, '<r>%d</r>' % i)
+		self.write('bad.xml', '<r>')
+		xsltproc.processor.setStylesheet(self.path('s.xsl'))
+		self.stderr = sys.stderr
+		sys.stderr = StringIO()
+		
+	def tearDown(self):
+		sys.stderr = self.stderr
+		shutil.rmtree(self.dir)
+		
+	def path(self, name):
+		return os.path.join(self.dir, name)
+		
+	def write(self, name, text):
+		f = open(self.path(name), 'w')
+		f.write(text)
+		f.close()
+		
+	def batch(self, *args):
+		options, args = xsltproc.parser.parse_args(['-o', self.path('out')] + list(args))
+		documents = [self.path('d%d.xml' % i) for i in range(10)] + [self.path('bad.xml')]
+		return xsltproc.batch(options, documents)
+		
+	def check(self):
+		out = self.path('out')
+		self.assertEquals(sorted(os.listdir(out)), sorted('d%d.txt' % i for i in range(10)))
+		for i in range(10):
+			self.assertEquals(open(os.path.join(out, 'd%d.txt' % i)).read(), str(i))
+		self.assertTrue('11 documents, 1 failed' in sys.stderr.getvalue())
+		self.assertTrue('bad.xml' in sys.stderr.getvalue())
+		
+	def testSerial(self):
+		self.assertFalse(self.batch())
+		self.check()
+		
+	def testWorkers(self):
+		self.assertFalse(self.batch('-j', '3'))
+		self.check()
+		
+	def testInterrupted(self):
+		pools = []
+		Pool = multiprocessing.Pool
+		def pool(*args):
+			pools.append(Pool(*args))
+			return pools[-1]
+		multiprocessing.Pool = pool
+		self.addCleanup(setattr, multiprocessing, 'Pool', Pool)
+		class Interrupted(StringIO):
+			def write(self, s):
+				if s.startswith('[ERROR]'):
+					raise KeyboardInterrupt()
+				StringIO.write(self, s)
+		sys.stderr = Interrupted()
+		self.assertRaises(KeyboardInterrupt, self.batch, '-j', '2')
+		self.assertEquals(pools[0]._state, multiprocessing.pool.TERMINATE)
+		
+	def testSameNames(self):
+		for d in ('a', 'b', os.path.join('b', 'c')):
+			os.mkdir(self.path(d))
+			self.write(os.path.join(d, 'doc.xml'), '<r>%s</r>' % d)
+		documents = [self.path(os.path.join(d, 'doc.xml')) for d in ('a', 'b', os.path.join('b', 'c'))]
+		options, args = xsltproc.parser.parse_args(['-o', self.path('out')])
+		self.assertTrue(xsltproc.batch(options, documents + documents[:1]))
+		for d in ('a', 'b', os.path.join('b', 'c')):
+			self.assertEquals(open(self.path(os.path.join('out', d, 'doc.txt'))).read(), d)
+		self.assertTrue('3 documents, 0 failed' in sys.stderr.getvalue())
+		
+	def testCollision(self):
+		self.write('d0.xsl', '<r/>')
+		options, args = xsltproc.parser.parse_args(['-o', self.path('out')])
+		self.assertFalse(xsltproc.batch(options, [self.path('d0.xml'), self.path('d1.xml'), self.path('d0.xsl')]))
+		self.assertFalse(os.path.exists(self.path('out')))
+		self.assertTrue('would both be written to' in sys.stderr.getvalue())
+		
+if __name__ == '__main__':
+	unittest.main()
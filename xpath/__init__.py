@@ -2,7 +2,9 @@ from xpath.exceptions import *
 import xpath.exceptions
 import xpath.expr
 import xpath.parser
+import xpath.rdparser
 import xpath.yappsrt
+import xpath.cache
 import functions
 
 __all__ = ['find', 'findnode', 'findvalue', 'XPathContext', 'XPath']
@@ -80,30 +82,29 @@ class XPathContext(object):
         return xpath.findvalues(expr, node, context=self, **kwargs)
 
 class XPath():
-    _max_cache = 100
-    _cache = {}
+    # expression string -> XPath, used by get() and the module functions;
+    # its size can be changed with cache.resize()
+    cache = xpath.cache.LRUCache(100)
 
     def __init__(self, expr):
         """Init docs.
         """
         try:
-            parser = xpath.parser.XPath(xpath.parser.XPathScanner(str(expr)))
-            self.expr = parser.XPath()
+            self.expr = xpath.rdparser.Parser(str(expr)).XPath()
         except xpath.yappsrt.SyntaxError, e:
             raise XPathParseError(str(expr), e.pos, e.msg)
+        self._evaluate = self.expr.compiled()
 
     @classmethod
     def get(cls, s):
         if isinstance(s, cls):
             return s
-        try:
-            return cls._cache[s]
-        except KeyError:
-            if len(cls._cache) > cls._max_cache:
-                cls._cache.clear()
-            expr = cls(s)
-            cls._cache[s] = expr
-            return expr
+        return cls.cache.get(s, cls)
+
+    @classmethod
+    def warm(cls, expressions):
+        """Parse expressions into the cache, e.g. at startup."""
+        cls.cache.warm(expressions, cls)
 
     @api
     def find(self, node, context=None, **kwargs):
@@ -112,16 +113,23 @@ class XPath():
         elif kwargs:
             context = context.clone()
             context.update(**kwargs)
-        return self.expr.evaluate(node, 1, 1, context)
+        return self._evaluate(node, 1, 1, context)
 
     @api
     def findnode(self, node, context=None, **kwargs):
-        result = self.find(node, context, **kwargs)
+        if context is None:
+            context = XPathContext(node, **kwargs)
+        elif kwargs:
+            context = context.clone()
+            context.update(**kwargs)
+        # The nodes after the first one are not computed.
+        iterate = self.expr.iterated() or self._evaluate
+        result = xpath.expr.first_only(iterate(node, 1, 1, context))
         if not xpath.expr.nodesetp(result):
             raise XPathTypeError("expression is not a node-set")
         if len(result) == 0:
             return None
-        return result[0]
+        return xpath.expr.ordered_nodeset(result)[0]
 
     @api
     def findvalue(self, node, context=None, **kwargs):
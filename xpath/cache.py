@@ -0,0 +1,75 @@
+import threading
+import collections
+
+class LRUCache(object):
+    """A cache of at most maxsize entries dropping the least recently used
+    entry first.  It can be used from several threads.
+
+    The number of hits, misses and evictions is counted, see stats().
+
+    """
+    def __init__(self, maxsize=100):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # key -> value, least recently used first
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, create):
+        """Return the value cached for key, or create(key) which is
+        cached for the next time.
+
+        create is called without holding the lock, so two threads
+        missing the same key at once may both call it; the value of
+        the last one is kept.
+
+        """
+        with self._lock:
+            try:
+                value = self._entries.pop(key)
+            except KeyError:
+                self.misses += 1
+            else:
+                self._entries[key] = value
+                self.hits += 1
+                return value
+        value = create(key)
+        with self._lock:
+            self._entries[key] = value
+            self._evict()
+        return value
+
+    def warm(self, keys, create):
+        """Cache create(key) for each of keys not cached yet."""
+        for key in keys:
+            if key not in self:
+                self.get(key, create)
+
+    def resize(self, maxsize):
+        with self._lock:
+            self.maxsize = maxsize
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Return a dict of the counters, the size and the maximum size."""
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions,
+                    'size': len(self._entries), 'maxsize': self.maxsize}
+
+    def _evict(self):
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
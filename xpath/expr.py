@@ -1,13 +1,16 @@
 from __future__ import division
 from itertools import *
+import heapq
 import math
 import operator
 import xml.dom
 import weakref
+from types import GeneratorType
 
 from xpath.exceptions import *
 from tools import *
 from axes import *
+from index import document_index
 
 
 #
@@ -51,6 +54,58 @@ def document_order(node):
     order.append(sibpos)
     return order
 
+def sort_document_order(nodes):
+    """Sort a list of nodes in document order, in place.
+
+    Nodes of indexed documents are compared by their precomputed order
+    numbers.  If any node has no number (it is not in an indexed document,
+    or was added to the document after it was indexed), all nodes are
+    compared by document_order() instead.
+
+    """
+    try:
+        nodes.sort(key=operator.attrgetter('xpath_order'))
+    except AttributeError:
+        nodes.sort(key=document_order)
+
+def ordered_nodeset(nodes):
+    """Return a NodeSet with the nodes of 'nodes' in document order and
+    without duplicates.
+
+    Sorting and duplicate removal are only done when the flags of 'nodes'
+    (if it is a NodeSet) do not say they are unnecessary.
+
+    """
+    ordered = getattr(nodes, 'ordered', False)
+    unique = getattr(nodes, 'unique', False)
+    if ordered and unique:
+        return nodes
+
+    if not ordered:
+        result = OrderedNodeSet(set(nodes) if not unique else nodes)
+        sort_document_order(result)
+    else:
+        result = OrderedNodeSet()
+        last = None
+        for n in nodes:
+            if n is not last:
+                result.append(n)
+                last = n
+    return result
+
+def owner_document(node):
+    """Return the document node of the document containing node."""
+    if node.nodeType == node.DOCUMENT_NODE:
+        return node
+    return node.ownerDocument
+
+def precedes(a, b):
+    """Return true iff node a comes before node b in document order."""
+    try:
+        return a.xpath_order < b.xpath_order
+    except AttributeError:
+        return document_order(a) < document_order(b)
+
 #
 # Internally, we use the following representations:
 #       nodeset - list of DOM tree nodes in document order
@@ -59,6 +114,205 @@ def document_order(node):
 #       number  - int or float
 #
 
+#
+# Expressions are compiled into nested closures before they are evaluated.
+# A compiled expression is a function taking the same arguments as
+# Expr.evaluate(): (node, pos, size, context).  Everything which does not
+# depend on the evaluation context is worked out once, when the closure is
+# built.
+#
+
+#
+# Node-sets can also be evaluated lazily, for consumers which do not need
+# all of their nodes: boolean() only needs to know whether there is a
+# node, string() only needs the first one.  Expressions which can produce
+# their nodes one at a time have a second compiled form, see
+# Expr.iterated().
+#
+# Aggregate functions, count(), sum() and boolean(), do not need the nodes
+# in document order either.  They get them from a third compiled form,
+# Expr.streamed(), producing the nodes in a single pass without sorting.
+#
+
+def iter_nodeset(v, message="value is not a node-set"):
+    """Return an iterator over the nodes of v, the value of a lazily
+    compiled expression, in document order and without duplicates.
+    Raises XPathTypeError with message if v is not a node-set.
+
+    """
+    if type(v) in ITERATOR_TYPES:
+        return v
+    if not nodesetp(v):
+        raise XPathTypeError(message)
+    return iter(ordered_nodeset(v))
+
+def first_only(v):
+    """Return v, the value of a lazily compiled expression, as an XPath
+    value.  Of a node-set produced lazily only the first node is
+    computed and kept.
+
+    """
+    if type(v) in ITERATOR_TYPES:
+        for n in v:
+            if type(v) is GeneratorType:
+                v.close()
+            return OrderedNodeSet([n])
+        return OrderedNodeSet()
+    return v
+
+def lazy_argument(v, fn):
+    """Return v, the value of a lazily compiled expression, as an
+    argument of the XPath function fn: unchanged if fn is marked as
+    aggregate, only its first node if fn is marked as lazy (see
+    functions.function), all of its nodes otherwise.
+
+    """
+    if type(v) in ITERATOR_TYPES:
+        if getattr(fn, 'aggregate', False):
+            return v
+        if getattr(fn, 'lazy', False):
+            return first_only(v)
+        return OrderedNodeSet(v)
+    return v
+
+def merge_iter(a, b):
+    """Yield the nodes of the iterators a and b, both producing nodes in
+    document order without duplicates, in document order without
+    duplicates.
+
+    """
+    x = next(a, None)
+    y = next(b, None)
+    while x is not None and y is not None:
+        if x is y:
+            yield x
+            x = next(a, None)
+            y = next(b, None)
+        elif precedes(x, y):
+            yield x
+            x = next(a, None)
+        else:
+            yield y
+            y = next(b, None)
+    if x is not None:
+        yield x
+        for x in a:
+            yield x
+    if y is not None:
+        yield y
+        for y in b:
+            yield y
+
+def iter_steps(nodes, step, context):
+    """Yield the nodes selected by step from each of the iterator nodes,
+    in document order and without duplicates.
+
+    nodes must produce nodes in document order.  step is a compiled
+    location step, lazily or not, which only selects nodes in the
+    subtree of its context node or its attributes: all of them follow
+    the context node (or are the context node), so the nodes of later
+    context nodes are only computed when they may come first.
+
+    """
+    # [first node, iterator over the others] for each context node whose
+    # nodes are being merged.
+    heads = []
+    pending = next(nodes, None)
+    last = None
+    while True:
+        if heads:
+            i = 0
+            for j in xrange(1, len(heads)):
+                if precedes(heads[j][0], heads[i][0]):
+                    i = j
+            head = heads[i]
+            if (pending is None or head[0] is pending or
+                precedes(head[0], pending)):
+                if head[0] is not last:
+                    last = head[0]
+                    yield last
+                head[0] = next(head[1], None)
+                if head[0] is None:
+                    del heads[i]
+                continue
+        elif pending is None:
+            return
+        selected = iter_nodeset(step(pending, 1, 1, context),
+                                "path step is not a node-set")
+        first = next(selected, None)
+        if first is not None:
+            heads.append([first, selected])
+        pending = next(nodes, None)
+
+def iter_each(nodes, step, context):
+    """Yield the nodes selected by step from each of the iterator nodes,
+    context node by context node.
+
+    Like iter_steps, but without merging.  The nodes are in document
+    order for location steps along the attribute or self axis: the nodes
+    selected from a context node all precede the nodes selected from the
+    context nodes following it.
+
+    """
+    for node in nodes:
+        for n in iter_nodeset(step(node, 1, 1, context),
+                              "path step is not a node-set"):
+            yield n
+
+def iter_distinct(nodes):
+    """Yield the nodes of the iterator nodes, dropping duplicates."""
+    seen = set()
+    for n in nodes:
+        if n not in seen:
+            seen.add(n)
+            yield n
+
+def iter_unordered(v, message="value is not a node-set"):
+    """Return an iterator over the nodes of v, the value of a streamed
+    expression, without duplicates and in no particular order.  Raises
+    XPathTypeError with message if v is not a node-set.
+
+    """
+    if type(v) in ITERATOR_TYPES:
+        return v
+    if not nodesetp(v):
+        raise XPathTypeError(message)
+    if getattr(v, 'unique', False):
+        return iter(v)
+    return iter_distinct(v)
+
+def converter(name):
+    """Return a function converting a value with the XPath function 'name'
+    (one of 'boolean', 'number' or 'string').
+
+    The returned function takes (value, node, pos, size, context).  The
+    conversion function is looked up once per function table rather than
+    on every call, and values which already have the right type are
+    returned unchanged.
+
+    """
+    # Values of this type need no conversion.
+    ready = {'boolean': bool, 'number': float}.get(name)
+
+    # (function table, function) of the last lookup.
+    resolved = [(None, None)]
+    def convert(v, node, pos, size, context):
+        if type(v) is ready:
+            return v
+        functions, fn = resolved[0]
+        if functions is not context.functions:
+            functions = context.functions
+            fn = functions.get(name)
+            if fn is None:
+                raise XPathUnknownFunctionError(
+                    'unknown function "%s()"' % name)
+            resolved[0] = (functions, fn)
+        # Values of lazily compiled expressions are accepted too.
+        if type(v) in ITERATOR_TYPES:
+            v = lazy_argument(v, fn)
+        return fn(node, pos, size, context, v)
+    return convert
+
 class Expr(object):
     """Abstract base class for XPath expressions."""
 
@@ -71,6 +325,89 @@ class Expr(object):
         Returns an XPath value: a nodeset, string, boolean, or number.
 
         """
+        return self.compiled()(node, pos, size, context)
+
+    def compiled(self):
+        """Return the compiled form of the expression, compiling it the
+        first time it is needed.
+
+        """
+        try:
+            return self._compiled
+        except AttributeError:
+            self._compiled = self.compile()
+            return self._compiled
+
+    def __getstate__(self):
+        # The compiled form is made of closures; it is rebuilt on demand
+        # after unpickling.  Axes are functions, stored by name.
+        state = self.__dict__.copy()
+        state.pop('_compiled', None)
+        state.pop('_iterated', None)
+        state.pop('_streamed', None)
+        if 'axis' in state:
+            state['axis'] = state['axis'].__name__
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if 'axis' in state:
+            self.axis = axes[state['axis']]
+
+    def compile(self):
+        """Compile the expression.
+
+        Returns a function taking (node, pos, size, context) and returning
+        the value of the expression.  Subclasses override this method.
+
+        """
+        raise NotImplementedError
+
+    def iterated(self):
+        """Return the lazy compiled form of the expression, compiling it
+        the first time it is needed, or None if there is none.
+
+        """
+        try:
+            return self._iterated
+        except AttributeError:
+            self._iterated = self.compile_iter()
+            return self._iterated
+
+    def compile_iter(self):
+        """Compile the expression for lazy evaluation.
+
+        Returns a function like compile(), except that the function may
+        return a node-set as an iterator producing the nodes in document
+        order, without duplicates, as they are found (see iter_nodeset
+        and first_only).  Returns None if the expression is not evaluated
+        lazily, which is the default.
+
+        """
+        return None
+
+    def streamed(self):
+        """Return the streamed compiled form of the expression, compiling
+        it the first time it is needed.
+
+        """
+        try:
+            return self._streamed
+        except AttributeError:
+            self._streamed = self.compile_stream()
+            return self._streamed
+
+    def compile_stream(self):
+        """Compile the expression for aggregate functions.
+
+        Returns a function like compile(), except that the function may
+        return a node-set as an iterator producing the nodes without
+        duplicates, in no particular order (see iter_unordered).  The
+        default is the lazily compiled form, or the compiled form if
+        there is none.
+
+        """
+        return self.iterated() or self.compiled()
 
 class BinaryOperatorExpr(Expr):
     """Base class for all binary operators."""
@@ -80,10 +417,15 @@ class BinaryOperatorExpr(Expr):
         self.left = left
         self.right = right
 
-    def evaluate(self, node, pos, size, context):
-        # Subclasses either override evaluate() or implement operate().
-        return self.operate(self.left.evaluate(node, pos, size, context),
-                            self.right.evaluate(node, pos, size, context))
+    def compile(self):
+        # Subclasses either override compile() or implement operate().
+        left = self.left.compile()
+        right = self.right.compile()
+        operate = self.operate
+        def evaluate(node, pos, size, context):
+            return operate(left(node, pos, size, context),
+                           right(node, pos, size, context))
+        return evaluate
 
     def __str__(self):
         return '(%s %s %s)' % (self.left, self.op, self.right)
@@ -91,20 +433,36 @@ class BinaryOperatorExpr(Expr):
 class AndExpr(BinaryOperatorExpr):
     """<x> and <y>"""
 
-    def evaluate(self, node, pos, size, context):
-        evaluateOp = lambda x: invoke('boolean', node, pos, size, context, x.evaluate(node, pos, size, context))
+    def compile(self):
+        # The operands are only converted to booleans, node-sets are
+        # evaluated lazily.
+        left = self.left.iterated() or self.left.compile()
+        right = self.right.iterated() or self.right.compile()
+        boolean = converter('boolean')
         # Note that XPath boolean operations short-circuit.
-        return (evaluateOp(self.left) and
-                evaluateOp(self.right))
+        def evaluate(node, pos, size, context):
+            return (boolean(left(node, pos, size, context),
+                            node, pos, size, context) and
+                    boolean(right(node, pos, size, context),
+                            node, pos, size, context))
+        return evaluate
 
 class OrExpr(BinaryOperatorExpr):
     """<x> or <y>"""
 
-    def evaluate(self, node, pos, size, context):
-        evaluateOp = lambda x: invoke('boolean', node, pos, size, context, x.evaluate(node, pos, size, context))
-        
+    def compile(self):
+        # The operands are only converted to booleans, node-sets are
+        # evaluated lazily.
+        left = self.left.iterated() or self.left.compile()
+        right = self.right.iterated() or self.right.compile()
+        boolean = converter('boolean')
         # Note that XPath boolean operations short-circuit.
-        return (evaluateOp(self.left) or evaluateOp(self.right))
+        def evaluate(node, pos, size, context):
+            return (boolean(left(node, pos, size, context),
+                            node, pos, size, context) or
+                    boolean(right(node, pos, size, context),
+                            node, pos, size, context))
+        return evaluate
 
 class EqualityExpr(BinaryOperatorExpr):
     """<x> = <y>, <x> != <y>, etc."""
@@ -118,37 +476,46 @@ class EqualityExpr(BinaryOperatorExpr):
         '>'  : operator.gt,
     }
 
-    def evaluate(self, node, pos, size, context):
-        a = self.left.evaluate(node, pos, size, context)
-        b = self.right.evaluate(node, pos, size, context)
-        
-        return self.operateImpl(a, b, node, pos, size, context)
-            
-    def operateImpl(self, a, b, node, pos, size, context):
-        if nodesetp(a):
-            for node in a:
-                if self.operateImpl(string_value(node), b, node, pos, size, context):
-                    return True
-            return False
+    def compile(self):
+        left = self.left.compile()
+        right = self.right.compile()
+        op = self.operators[self.op]
+        equality = self.op in ('=', '!=')
+        to_boolean = converter('boolean')
+        to_number = converter('number')
+        to_string = converter('string')
+
+        def compare(a, b, node, pos, size, context):
+            if nodesetp(a):
+                for node in a:
+                    if compare(string_value(node), b, node, pos, size, context):
+                        return True
+                return False
 
-        if nodesetp(b):
-            for node in b:
-                if self.operateImpl(a, string_value(node), node, pos, size, context):
-                    return True
-            return False
-            
-        if self.op in ('=', '!='):
-            if booleanp(a) or booleanp(b):
-                convert = 'boolean'
-            elif numberp(a) or numberp(b):
-                convert = 'number'
+            if nodesetp(b):
+                for node in b:
+                    if compare(a, string_value(node), node, pos, size, context):
+                        return True
+                return False
+
+            if equality:
+                if booleanp(a) or booleanp(b):
+                    convert = to_boolean
+                elif numberp(a) or numberp(b):
+                    convert = to_number
+                else:
+                    convert = to_string
             else:
-                convert = 'string'
-        else:
-            convert = 'number'
+                convert = to_number
+
+            return op(convert(a, node, pos, size, context),
+                      convert(b, node, pos, size, context))
 
-        a, b = map(lambda x: invoke(convert, node, pos, size, context, x), (a,b))
-        return self.operators[self.op](a, b)
+        def evaluate(node, pos, size, context):
+            return compare(left(node, pos, size, context),
+                           right(node, pos, size, context),
+                           node, pos, size, context)
+        return evaluate
 
 def divop(x, y):
     try:
@@ -172,9 +539,17 @@ class ArithmeticalExpr(BinaryOperatorExpr):
         'mod' : math.fmod
     }
 
-    def evaluate(self, node, pos, size, context):
-        evaluateOp = lambda x: invoke('number', node, pos, size, context, x.evaluate(node, pos, size, context))
-        return self.operators[self.op](evaluateOp(self.left), evaluateOp(self.right))
+    def compile(self):
+        left = self.left.compile()
+        right = self.right.compile()
+        op = self.operators[self.op]
+        number = converter('number')
+        def evaluate(node, pos, size, context):
+            return op(number(left(node, pos, size, context),
+                             node, pos, size, context),
+                      number(right(node, pos, size, context),
+                             node, pos, size, context))
+        return evaluate
 
 class UnionExpr(BinaryOperatorExpr):
     """<x> | <y>"""
@@ -183,8 +558,32 @@ class UnionExpr(BinaryOperatorExpr):
         if not nodesetp(a) or not nodesetp(b):
             raise XPathTypeError("union operand is not a node-set")
 
-        # Need to sort the result to preserve document order.
-        return sorted(set(chain(a, b)), key=document_order)
+        # Need to merge the operands to preserve document order.
+        return merge_nodesets([ordered_nodeset(a), ordered_nodeset(b)])
+
+    def compile_iter(self):
+        left = self.left.iterated()
+        right = self.right.iterated()
+        if left is None and right is None:
+            return None
+        left = left or self.left.compiled()
+        right = right or self.right.compiled()
+        message = "union operand is not a node-set"
+        def iterate(node, pos, size, context):
+            return merge_iter(
+                iter_nodeset(left(node, pos, size, context), message),
+                iter_nodeset(right(node, pos, size, context), message))
+        return iterate
+
+    def compile_stream(self):
+        left = self.left.streamed()
+        right = self.right.streamed()
+        message = "union operand is not a node-set"
+        def stream(node, pos, size, context):
+            return iter_distinct(chain(
+                iter_unordered(left(node, pos, size, context), message),
+                iter_unordered(right(node, pos, size, context), message)))
+        return stream
 
 class NegationExpr(Expr):
     """- <x>"""
@@ -192,8 +591,13 @@ class NegationExpr(Expr):
     def __init__(self, expr):
         self.expr = expr
 
-    def evaluate(self, node, pos, size, context):
-        return -number(self.expr.evaluate(node, pos, size, context), context)
+    def compile(self):
+        expr = self.expr.compile()
+        number = converter('number')
+        def evaluate(node, pos, size, context):
+            return -number(expr(node, pos, size, context),
+                           node, pos, size, context)
+        return evaluate
 
     def __str__(self):
         return '(-%s)' % self.expr
@@ -204,8 +608,9 @@ class LiteralExpr(Expr):
     def __init__(self, literal):
         self.literal = literal
 
-    def evaluate(self, node, pos, size, context):
-        return self.literal
+    def compile(self):
+        literal = self.literal
+        return lambda node, pos, size, context: literal
 
     def __str__(self):
         if isinstance(self.literal, basestring):
@@ -222,18 +627,23 @@ class VariableReference(Expr):
         self.prefix = prefix
         self.name = name
 
-    def evaluate(self, node, pos, size, context):
-        try:
-            if self.prefix is not None:
-                try:
-                    namespaceURI = context.namespaces[self.prefix]
-                except KeyError:
-                    raise XPathUnknownPrefixError(self.prefix)
-                return context.variables[(namespaceURI, self.name)]
-            else:
-                return context.variables[(None, self.name)]
-        except KeyError:
-            raise XPathUnknownVariableError(str(self))
+    def compile(self):
+        prefix = self.prefix
+        name = self.name
+        key = (None, name)
+        def evaluate(node, pos, size, context):
+            try:
+                if prefix is not None:
+                    try:
+                        namespaceURI = context.namespaces[prefix]
+                    except KeyError:
+                        raise XPathUnknownPrefixError(prefix)
+                    return context.variables[(namespaceURI, name)]
+                else:
+                    return context.variables[key]
+            except KeyError:
+                raise XPathUnknownVariableError(str(self))
+        return evaluate
 
     def __str__(self):
         if self.prefix is None:
@@ -255,20 +665,73 @@ class Function(Expr):
             self.prefix = spl[0]
             
         self.args = args
-            
-    def evaluate(self, node, pos, size, context):
-        args = [x.evaluate(node, pos, size, context) for x in self.args]
-        
-        if self.prefix is not None:
-            try:
-                namespaceURI = context.namespaces[self.prefix]
-            except KeyError:
-                raise XPathUnknownPrefixError(self.prefix)
-            name = (namespaceURI, self.name)
+
+    def compile(self):
+        args = [x.compiled() for x in self.args]
+        prefix = self.prefix
+        localName = self.name
+
+        # ((function table, function name), function) of the last lookup.
+        resolved = [((None, None), None)]
+        def lookup(context):
+            if prefix is not None:
+                try:
+                    namespaceURI = context.namespaces[prefix]
+                except KeyError:
+                    raise XPathUnknownPrefixError(prefix)
+                name = (namespaceURI, localName)
+            else:
+                name = localName
+
+            (functions, last), fn = resolved[0]
+            if functions is not context.functions or last != name:
+                functions = context.functions
+                fn = functions.get(name)
+                if fn is None:
+                    raise XPathUnknownFunctionError(
+                        'unknown function "%s()"' % (name,))
+                resolved[0] = ((functions, name), fn)
+            return fn
+
+        if prefix is None:
+            # The name is fixed, only the function table can change.
+            def lookup(context, lookup=lookup):
+                (functions, last), fn = resolved[0]
+                if functions is context.functions:
+                    return fn
+                return lookup(context)
+
+        if len(args) == 0:
+            def evaluate(node, pos, size, context):
+                return lookup(context)(node, pos, size, context)
+        elif len(args) == 1:
+            arg, = args
+            def evaluate(node, pos, size, context):
+                return lookup(context)(node, pos, size, context,
+                                       arg(node, pos, size, context))
         else:
-            name = self.name
-            
-        return invoke(name, node, pos, size, context, *args)
+            def evaluate(node, pos, size, context):
+                values = [x(node, pos, size, context) for x in args]
+                return lookup(context)(node, pos, size, context, *values)
+
+        # Functions only using the first node of node-set arguments (see
+        # functions.function) get their arguments evaluated lazily, and
+        # aggregate functions get them streamed.
+        iterated = [x.iterated() or a for x, a in zip(self.args, args)]
+        streamed = [x.streamed() for x in self.args]
+        if any(i is not a or s is not a
+               for i, s, a in zip(iterated, streamed, args)):
+            def evaluate(node, pos, size, context, eager=evaluate):
+                fn = lookup(context)
+                if getattr(fn, 'aggregate', False):
+                    values = [x(node, pos, size, context) for x in streamed]
+                elif getattr(fn, 'lazy', False):
+                    values = [first_only(x(node, pos, size, context))
+                              for x in iterated]
+                else:
+                    return eager(node, pos, size, context)
+                return fn(node, pos, size, context, *values)
+        return evaluate
 
     def __str__(self):
         return '%s(%s)' % (self.name, ', '.join((str(x) for x in self.args)))
@@ -283,7 +746,8 @@ def merge_into_nodeset(target, source):
         target.extend(source)
         return
 
-    source = [n for n in source if n not in target]
+    present = set(target)
+    source = [n for n in source if n not in present]
     if len(source) == 0:
         return
 
@@ -292,11 +756,55 @@ def merge_into_nodeset(target, source):
     # will need to sort.  (We could also check to see if the last node in
     # the source set comes before the first node in the target set, but this
     # situation is very unlikely in practice.)
-    if document_order(target[-1]) < document_order(source[0]):
+    if precedes(target[-1], source[0]):
         target.extend(source)
     else:
         target.extend(source)
-        target.sort(key=document_order)
+        sort_document_order(target)
+
+def merge_nodesets(nodesets):
+    """Merge a list of node-sets into a single node-set in document order.
+
+    Each of the node-sets must be in document order and free of
+    duplicates.  Nodes present in several node-sets appear in the result
+    once.  The merge is linear in the size of the result when the
+    node-sets follow each other in document order (the common case for
+    steps along the child and attribute axes), and a k-way merge
+    otherwise.
+
+    """
+    nodesets = [ns for ns in nodesets if len(ns) > 0]
+    if len(nodesets) == 0:
+        return OrderedNodeSet()
+    if len(nodesets) == 1:
+        if isinstance(nodesets[0], OrderedNodeSet):
+            return nodesets[0]
+        return OrderedNodeSet(nodesets[0])
+
+    result = OrderedNodeSet(nodesets[0])
+    for ns in nodesets[1:]:
+        if not precedes(result[-1], ns[0]):
+            break
+        result.extend(ns)
+    else:
+        return result
+
+    # The node-sets overlap.  Decorate each of them with order keys and
+    # merge them; duplicates end up next to each other.
+    try:
+        keyed = [[(n.xpath_order, i, n) for n in ns]
+                 for i, ns in enumerate(nodesets)]
+    except AttributeError:
+        keyed = [[(document_order(n), i, n) for n in ns]
+                 for i, ns in enumerate(nodesets)]
+
+    result = OrderedNodeSet()
+    last = None
+    for key, i, n in heapq.merge(*keyed):
+        if n is not last:
+            result.append(n)
+            last = n
+    return result
 
 class AbsolutePathExpr(Expr):
     """Absolute location paths."""
@@ -304,12 +812,40 @@ class AbsolutePathExpr(Expr):
     def __init__(self, path):
         self.path = path
 
-    def evaluate(self, node, pos, size, context):
-        if node.nodeType != node.DOCUMENT_NODE:
-            node = node.ownerDocument
+    def compile(self):
+        if self.path is None:
+            def evaluate(node, pos, size, context):
+                if node.nodeType != node.DOCUMENT_NODE:
+                    node = node.ownerDocument
+                return OrderedNodeSet([node])
+            return evaluate
+
+        path = self.path.compile()
+        def evaluate(node, pos, size, context):
+            if node.nodeType != node.DOCUMENT_NODE:
+                node = node.ownerDocument
+            return path(node, 1, 1, context)
+        return evaluate
+
+    def compile_iter(self):
+        path = self.path and self.path.iterated()
+        if path is None:
+            return None
+        def iterate(node, pos, size, context):
+            if node.nodeType != node.DOCUMENT_NODE:
+                node = node.ownerDocument
+            return path(node, 1, 1, context)
+        return iterate
+
+    def compile_stream(self):
         if self.path is None:
-            return [node]
-        return self.path.evaluate(node, 1, 1, context)
+            return self.compiled()
+        path = self.path.streamed()
+        def stream(node, pos, size, context):
+            if node.nodeType != node.DOCUMENT_NODE:
+                node = node.ownerDocument
+            return path(node, 1, 1, context)
+        return stream
 
     def __str__(self):
         return '/%s' % (self.path or '')
@@ -320,31 +856,235 @@ class PathExpr(Expr):
     def __init__(self, steps):
         self.steps = steps
 
-    def evaluate(self, node, pos, size, context):
-        # The first step in the path is evaluated in the current context.
-        # If this is the only step in the path, the return value is
-        # unimportant.  If there are other steps, however, it must be a
-        # node-set.
-        result = self.steps[0].evaluate(node, pos, size, context)
-        if len(self.steps) > 1 and not nodesetp(result):
-            raise XPathTypeError("path step is not a node-set")
-
-        # Subsequent steps are evaluated for each node in the node-set
-        # resulting from the previous step.
+    def compile(self):
+        steps = [step.compile() for step in self.steps]
+        first = steps[0]
+        rest = steps[1:]
+
+        # If this is the only step in the path, its value is the value of
+        # the path, whatever its type.
+        if not rest:
+            return first
+
+        def evaluate(node, pos, size, context):
+            # The first step in the path is evaluated in the current
+            # context.  Since there are other steps, it must be a node-set.
+            result = first(node, pos, size, context)
+            if not nodesetp(result):
+                raise XPathTypeError("path step is not a node-set")
+
+            # Subsequent steps are evaluated for each node in the node-set
+            # resulting from the previous step.
+            for step in rest:
+                result = ordered_nodeset(result)
+                size = len(result)
+                if size == 1:
+                    nodes = step(result[0], 1, 1, context)
+                    if not nodesetp(nodes):
+                        raise XPathTypeError("path step is not a node-set")
+                    result = nodes
+                    continue
+
+                aggregate = []
+                for i in xrange(size):
+                    nodes = step(result[i], i+1, size, context)
+                    if not nodesetp(nodes):
+                        raise XPathTypeError("path step is not a node-set")
+                    aggregate.append(ordered_nodeset(nodes))
+                result = merge_nodesets(aggregate)
+
+            return ordered_nodeset(result)
+        return evaluate
+
+    def compile_iter(self):
+        if len(self.steps) == 1:
+            return self.steps[0].iterated()
+        # The nodes of the steps can be merged lazily, see iter_steps.
+        rest = []
         for step in self.steps[1:]:
-            aggregate = []
-            for i in xrange(len(result)):
-                nodes = step.evaluate(result[i], i+1, len(result), context)
+            inner = step.expr if type(step) is PredicateList else step
+            if type(inner) is not AxisStep or inner.axis not in SUBTREE_AXES:
+                return None
+            if inner.axis is axes['attribute'] or inner.axis is axes['self']:
+                merge = iter_each
+            else:
+                merge = iter_steps
+            rest.append((merge, step.iterated() or step.compiled()))
+        first = self.steps[0].iterated() or self.steps[0].compiled()
+        def iterate(node, pos, size, context):
+            nodes = iter_nodeset(first(node, pos, size, context),
+                                 "path step is not a node-set")
+            for merge, step in rest:
+                nodes = merge(nodes, step, context)
+            return nodes
+        return iterate
+
+    def compile_stream(self):
+        if len(self.steps) == 1:
+            return self.steps[0].streamed()
+
+        # The nodes are produced context node by context node.  Distinct
+        # context nodes have distinct children, attributes and selves,
+        # and so distinct descendants as long as none of them is an
+        # ancestor of another (they are "flat").  Otherwise duplicates
+        # are dropped as the nodes are produced.
+        def step_axis(step):
+            if type(step) is PredicateList:
+                step = step.expr
+            return step.axis if type(step) is AxisStep else None
+
+        def distinct(flat):
+            for step in self.steps[1:]:
+                axis = step_axis(step)
+                if axis in DESCENDANT_AXES and flat:
+                    flat = False
+                elif axis not in DISJOINT_AXES:
+                    return False
+            return True
+
+        first_flat = step_axis(self.steps[0]) in FLAT_AXES
+        distinct_flat = distinct(True)
+        distinct_nested = distinct(False)
+        steps = [step.streamed() for step in self.steps]
+        first = steps[0]
+        rest = steps[1:]
+        message = "path step is not a node-set"
+        def stream(node, pos, size, context):
+            nodes = first(node, pos, size, context)
+            flat = first_flat
+            if type(nodes) not in ITERATOR_TYPES:
                 if not nodesetp(nodes):
-                    raise XPathTypeError("path step is not a node-set")
-                merge_into_nodeset(aggregate, nodes)
-            result = aggregate
-
-        return result
+                    raise XPathTypeError(message)
+                flat = flat or len(nodes) <= 1
+            nodes = iter_unordered(nodes, message)
+            for step in rest:
+                nodes = iter_each(nodes, step, context)
+            if not (distinct_flat if flat else distinct_nested):
+                nodes = iter_distinct(nodes)
+            return nodes
+        return stream
 
     def __str__(self):
         return '/'.join((str(s) for s in self.steps))
 
+# Axes selecting nodes in the subtree of the context node or its attributes.
+SUBTREE_AXES = frozenset([axes['child'], axes['attribute'], axes['self'],
+                          axes['descendant'], axes['descendant-or-self']])
+
+# Axes selecting distinct nodes from distinct context nodes.
+DISJOINT_AXES = frozenset([axes['child'], axes['attribute'], axes['self']])
+
+# Axes selecting distinct nodes from context nodes none of which is an
+# ancestor of another.
+DESCENDANT_AXES = frozenset([axes['descendant'], axes['descendant-or-self']])
+
+# Axes selecting nodes none of which is an ancestor of another.
+FLAT_AXES = frozenset([axes['child'], axes['attribute'], axes['self'],
+                       axes['parent'], axes['following-sibling'],
+                       axes['preceding-sibling']])
+
+# Core functions whose value depends only on their arguments.
+PURE_FUNCTIONS = frozenset([
+    'string', 'concat', 'starts-with', 'contains', 'substring-before',
+    'substring-after', 'substring', 'string-length', 'normalize-space',
+    'translate', 'boolean', 'not', 'true', 'false', 'number', 'floor',
+    'ceiling', 'round',
+])
+
+def context_independent(expr):
+    """Return True if the value of expr is the same for all context nodes
+    in a document, whatever the context position and size.
+
+    current() counts as context independent: in XSLT it is the current
+    node of the instruction, not the context node of the expression.
+
+    """
+    if isinstance(expr, (LiteralExpr, VariableReference, AbsolutePathExpr)):
+        return True
+    if isinstance(expr, Function):
+        if expr.prefix is not None:
+            return False
+        if not expr.args:
+            return expr.name in ('true', 'false', 'current')
+        if expr.name not in PURE_FUNCTIONS:
+            return False
+        return all(context_independent(x) for x in expr.args)
+    if isinstance(expr, BinaryOperatorExpr):
+        return context_independent(expr.left) and \
+            context_independent(expr.right)
+    if isinstance(expr, (NegationExpr, PredicateList)):
+        return context_independent(expr.expr)
+    if isinstance(expr, PathExpr):
+        # Only the first step is evaluated in the context.
+        return context_independent(expr.steps[0])
+    return False
+
+def attribute_equality(expr):
+    """If expr compares a single attribute step (like @a) with a context
+    independent value, return the NameTest of the step and the value
+    expression.  Otherwise return None.
+
+    """
+    if type(expr) is not EqualityExpr or expr.op != '=':
+        return None
+    for step, value in ((expr.left, expr.right), (expr.right, expr.left)):
+        if type(step) is PathExpr and len(step.steps) == 1:
+            step = step.steps[0]
+        if (type(step) is AxisStep and step.axis is axes['attribute'] and
+            isinstance(step.test, NameTest) and step.test.localName != '*' and
+            context_independent(value)):
+            return step.test, value
+    return None
+
+# Core functions which never return a number.
+NON_NUMERIC = frozenset([
+    'string', 'concat', 'starts-with', 'contains', 'substring-before',
+    'substring-after', 'substring', 'normalize-space', 'translate',
+    'boolean', 'not', 'true', 'false', 'lang', 'local-name',
+    'namespace-uri', 'name', 'id',
+])
+
+def uses_position(expr):
+    """Return True if expr may use the context position or size.
+
+    Calls of position(), last() and functions outside the core library
+    count as uses, wherever they appear.
+
+    """
+    if isinstance(expr, Function):
+        if expr.prefix is not None or expr.name in ('position', 'last'):
+            return True
+        return any(uses_position(x) for x in expr.args)
+    if isinstance(expr, BinaryOperatorExpr):
+        return uses_position(expr.left) or uses_position(expr.right)
+    if isinstance(expr, (NegationExpr, PredicateList)):
+        if isinstance(expr, PredicateList) and \
+                any(uses_position(x) for x in expr.predicates):
+            return True
+        return uses_position(expr.expr)
+    if isinstance(expr, PathExpr):
+        return any(uses_position(x) for x in expr.steps)
+    if isinstance(expr, AbsolutePathExpr):
+        return expr.path is not None and uses_position(expr.path)
+    return False
+
+def may_be_number(expr):
+    """Return True unless expr provably does not evaluate to a number."""
+    if isinstance(expr, (EqualityExpr, AndExpr, OrExpr, UnionExpr,
+                         AxisStep, PredicateList, AbsolutePathExpr)):
+        return False
+    if isinstance(expr, PathExpr):
+        return len(expr.steps) == 1 and may_be_number(expr.steps[0])
+    if isinstance(expr, LiteralExpr):
+        return numberp(expr.literal)
+    if isinstance(expr, Function):
+        return expr.prefix is not None or expr.name not in NON_NUMERIC
+    return True
+
+def is_positional(predicate):
+    """Return True if a predicate may select nodes by their position."""
+    return may_be_number(predicate) or uses_position(predicate)
+
 class PredicateList(Expr):
     """A list of predicates.
     
@@ -357,33 +1097,186 @@ class PredicateList(Expr):
         self.expr = expr
         self.axis = axes[axis]
 
-    def evaluate(self, node, pos, size, context):
-        result = self.expr.evaluate(node, pos, size, context)
-        if not nodesetp(result):
-            raise XPathTypeError("predicate input is not a node-set")
-
-        if self.axis.reverse:
-            result.reverse()
-
-        for pred in self.predicates:
-            match = []
-            for i, node in izip(count(1), result):
-                r = pred.evaluate(node, i, len(result), context)
-
-                # If a predicate evaluates to a number, select the node
-                # with that position.  Otherwise, select nodes for which
-                # the boolean value of the predicate is true.
-                if numberp(r):
-                    if r == i:
+    def compile(self):
+        expr = self.expr.compile()
+        reverse = self.axis.reverse
+        boolean = converter('boolean')
+
+        def positional(n):
+            # A constant numeric predicate selects at most one node.
+            def select(nodes, context):
+                if n == int(n) and 1 <= n <= len(nodes):
+                    return [nodes[int(n) - 1]]
+                return []
+            return select
+
+        def general(pred):
+            def select(nodes, context):
+                match = []
+                size = len(nodes)
+                for i, node in izip(count(1), nodes):
+                    r = pred(node, i, size, context)
+
+                    # If a predicate evaluates to a number, select the node
+                    # with that position.  Otherwise, select nodes for which
+                    # the boolean value of the predicate is true.
+                    if numberp(r):
+                        if r == i:
+                            match.append(node)
+                    elif boolean(r, node, i, size, context):
                         match.append(node)
-                elif invoke('boolean', node, pos, size, context, r):
-                    match.append(node)
-            result = match
-
-        if self.axis.reverse:
-            result.reverse()
+                return match
+            return select
+
+        def owners(test, value):
+            # Return a function looking up, in the attribute value index
+            # of the document, the elements whose attribute equals the
+            # value.  It returns None when the index cannot be used.
+            attribute = axes['attribute']
+            localName = test.localName
+            def lookup(node, context):
+                index = document_index(node)
+                if index is None:
+                    return None
+                namespaceURI = test.namespace(attribute, context)
+                v = value(node, 1, 1, context)
+                if stringp(v):
+                    return index.attribute_owners(namespaceURI, localName, v)
+                if nodesetp(v):
+                    strings = set(string_value(x) for x in v)
+                    return merge_nodesets([
+                        index.attribute_owners(namespaceURI, localName, x)
+                        for x in strings])
+                # Numbers and booleans are not compared as strings.
+                return None
+            return lookup
+
+        # The nodes selected by a step all belong to the document of the
+        # context node; other node-sets may span several documents, which
+        # the index of one of them cannot filter.
+        one_document = type(self.expr) is AxisStep
+
+        def indexed(lookup, scan):
+            def select(nodes, context):
+                if not nodes:
+                    return nodes
+                if not one_document:
+                    document = owner_document(nodes[0])
+                    for n in nodes:
+                        if owner_document(n) is not document:
+                            return scan(nodes, context)
+                match = lookup(nodes[0], context)
+                if match is None:
+                    return scan(nodes, context)
+                match = set(match)
+                return [n for n in nodes if n in match]
+            return select
+
+        filters = []
+        lookups = []
+        for pred in self.predicates:
+            if isinstance(pred, LiteralExpr) and numberp(pred.literal):
+                filters.append(positional(pred.literal))
+                lookups.append(None)
+                continue
+            if may_be_number(pred):
+                select = general(pred.compile())
+            else:
+                # Only the boolean value matters.
+                select = general(pred.iterated() or pred.compile())
+            equality = attribute_equality(pred)
+            if equality is not None:
+                lookups.append(owners(equality[0], equality[1].compile()))
+                select = indexed(lookups[-1], select)
+            else:
+                lookups.append(None)
+            filters.append(select)
+
+        def evaluate(node, pos, size, context):
+            result = expr(node, pos, size, context)
+            if not nodesetp(result):
+                raise XPathTypeError("predicate input is not a node-set")
+
+            ordered = getattr(result, 'ordered', False)
+            unique = getattr(result, 'unique', False)
+            if reverse:
+                result = result[::-1]
+
+            for select in filters:
+                result = select(result, context)
+
+            if reverse:
+                result.reverse()
+
+            if ordered and unique:
+                return OrderedNodeSet(result)
+            return NodeSet(result, ordered=ordered, unique=unique)
+
+        # descendant::N[@a = value] selects the indexed elements with the
+        # attribute value which lie in the subtree, without evaluating
+        # the step itself.
+        step = self.expr
+        if (lookups and lookups[0] is not None and type(step) is AxisStep and
+            isinstance(step.test, NameTest) and step.test.localName != '*' and
+            (step.axis is axes['descendant'] or
+             step.axis is axes['descendant-or-self'])):
+            lookup = lookups[0]
+            test = step.test
+            localName = test.localName
+            self_too = step.axis is axes['descendant-or-self']
+            rest = filters[1:]
+            def evaluate(node, pos, size, context, scan=evaluate):
+                if not hasattr(node, 'xpath_order'):
+                    return scan(node, pos, size, context)
+                match = lookup(node, context)
+                if match is None:
+                    return scan(node, pos, size, context)
+                namespaceURI = test.namespace(step.axis, context)
+                first = node.xpath_order
+                if self_too:
+                    first -= 1
+                last = node.xpath_last
+                result = [n for n in match if first < n.xpath_order <= last and
+                          n.namespaceURI == namespaceURI and
+                          (n.nodeName == localName or n.localName == localName)]
+                for select in rest:
+                    result = select(result, context)
+                return OrderedNodeSet(result)
+        return evaluate
+
+    def compile_filter(self, expr, iterate):
+        """Return a function like compile(), filtering the nodes of expr,
+        a compiled expression, one by one, or None if the predicates
+        may select nodes by their position.  iterate is iter_nodeset or
+        iter_unordered, the order the nodes are produced in.
 
-        return result
+        """
+        # Predicates comparing attributes are looked up in the index
+        # instead, see compile.
+        if any(is_positional(x) or attribute_equality(x) is not None
+               for x in self.predicates):
+            return None
+        predicates = [x.iterated() or x.compiled() for x in self.predicates]
+        boolean = converter('boolean')
+        def accept(node, context):
+            for pred in predicates:
+                if not boolean(pred(node, 1, 1, context),
+                               node, 1, 1, context):
+                    return False
+            return True
+        def select(node, pos, size, context):
+            nodes = iterate(expr(node, pos, size, context),
+                            "predicate input is not a node-set")
+            return (n for n in nodes if accept(n, context))
+        return select
+
+    def compile_iter(self):
+        return self.compile_filter(self.expr.iterated() or self.expr.compiled(),
+                                   iter_nodeset)
+
+    def compile_stream(self):
+        return (self.compile_filter(self.expr.streamed(), iter_unordered) or
+                Expr.compile_stream(self))
 
     def __str__(self):
         s = str(self.expr)
@@ -400,16 +1293,49 @@ class AxisStep(Expr):
         self.axis = axes[axis]
         self.test = test
 
-    def evaluate(self, node, pos, size, context):
-        match = []
-        for n in self.axis(node):
-            if self.test.match(n, self.axis, context):
-                match.append(n)
-
-        if self.axis.reverse:
-            match.reverse()
-
-        return match
+    def compile(self):
+        axis = self.axis
+        test = self.test
+
+        if isinstance(test, NameTest):
+            select = test.compile(axis)
+        elif isinstance(test, AnyKindTest):
+            if axis is axes['self']:
+                return lambda node, pos, size, context: \
+                    OrderedNodeSet([node])
+            select = lambda node, context: list(axis(node))
+        else:
+            match = test.match
+            select = lambda node, context: \
+                [n for n in axis(node) if match(n, axis, context)]
+
+        if axis.reverse:
+            def evaluate(node, pos, size, context):
+                match = select(node, context)
+                match.reverse()
+                return OrderedNodeSet(match)
+        else:
+            def evaluate(node, pos, size, context):
+                return OrderedNodeSet(select(node, context))
+        return evaluate
+
+    def compile_iter(self):
+        # Nodes along reverse axes come in reverse document order, and
+        # the self and parent axes select one node at most.
+        axis = self.axis
+        if (axis.reverse or axis is axes['self'] or axis is axes['parent']):
+            return None
+        test = self.test
+
+        if isinstance(test, NameTest):
+            select = test.compile_iter(axis)
+        elif isinstance(test, AnyKindTest):
+            select = lambda node, context: iter(axis(node))
+        else:
+            match = test.match
+            select = lambda node, context: \
+                (n for n in axis(node) if match(n, axis, context))
+        return lambda node, pos, size, context: select(node, context)
 
     def __str__(self):
         return '%s::%s' % (self.axis.__name__, self.test)
@@ -431,26 +1357,144 @@ class NameTest(object):
         if self.prefix == None and self.localName == '*':
             self.prefix = '*'
 
+    def namespace(self, axis, context):
+        """Return the namespace URI nodes must have to match the test
+        along 'axis', or '*' if any namespace matches.
+
+        """
+        if self.prefix == '*':
+            return '*'
+        if self.prefix is not None:
+            try:
+                return context.namespaces[self.prefix]
+            except KeyError:
+                raise XPathUnknownPrefixError(self.prefix)
+        if axis.principal_node_type == xml.dom.Node.ELEMENT_NODE:
+            return context.namespaces.get(None)
+        return None
+
     def match(self, node, axis, context):
         if node.nodeType != axis.principal_node_type:
             return False
 
-        if self.prefix != '*':
-            namespaceURI = None
-            if self.prefix is not None:
-                try:
-                    namespaceURI = context.namespaces[self.prefix]
-                except KeyError:
-                    raise XPathUnknownPrefixError(self.prefix)
-            elif axis.principal_node_type == node.ELEMENT_NODE:
-                namespaceURI = context.namespaces.get(None)
-            if namespaceURI != node.namespaceURI:
-                return False
+        namespaceURI = self.namespace(axis, context)
+        if namespaceURI != '*' and namespaceURI != node.namespaceURI:
+            return False
         if self.localName != '*':
             if self.localName != node.localName:
                 return False
         return True
 
+    def _namespace(self, axis):
+        # Return a function resolving the namespace of the test along
+        # axis in a context.
+        if (self.prefix is None and
+            axis.principal_node_type == xml.dom.Node.ELEMENT_NODE):
+            return lambda context: context.namespaces.get(None)
+        elif self.prefix is None or self.prefix == '*':
+            fixed = self.prefix
+            return lambda context: fixed
+        else:
+            return lambda context: self.namespace(axis, context)
+
+    def compile(self, axis):
+        """Return a function selecting the nodes matching the test along
+        'axis'.  The function takes (node, context) and returns a list of
+        nodes in axis order.
+
+        The namespace of the test is resolved once per call, rather than
+        for every node along the axis.
+
+        """
+        nodeType = axis.principal_node_type
+        localName = self.localName
+        namespace = self._namespace(axis)
+
+        if axis is axes['attribute'] and localName != '*':
+            def select(node, context):
+                if node.nodeType != node.ELEMENT_NODE:
+                    return []
+                attr = node.getAttributeNodeNS(namespace(context), localName)
+                return [attr] if attr is not None else []
+            return select
+
+        if localName == '*':
+            def select(node, context):
+                namespaceURI = namespace(context)
+                if namespaceURI == '*':
+                    return [n for n in axis(node) if n.nodeType == nodeType]
+                return [n for n in axis(node) if n.nodeType == nodeType and
+                        n.namespaceURI == namespaceURI]
+            return select
+
+        # The localName of minidom nodes is a property splitting the
+        # qualified name; only compute it for prefixed names.
+        def select(node, context):
+            namespaceURI = namespace(context)
+            if namespaceURI == '*':
+                return [n for n in axis(node) if n.nodeType == nodeType and
+                        (n.nodeName == localName or
+                         (':' in n.nodeName and n.localName == localName))]
+            return [n for n in axis(node) if n.nodeType == nodeType and
+                    (n.nodeName == localName or
+                     (':' in n.nodeName and n.localName == localName)) and
+                    n.namespaceURI == namespaceURI]
+
+        # Elements below a node of an indexed document are looked up in
+        # the element name index instead of walking the subtree.
+        if axis is axes['descendant'] or axis is axes['descendant-or-self']:
+            self_too = axis is axes['descendant-or-self']
+            def select(node, context, walk=select):
+                index = document_index(node)
+                if index is None or not hasattr(node, 'xpath_order'):
+                    return walk(node, context)
+                namespaceURI = namespace(context)
+                if namespaceURI == '*':
+                    return walk(node, context)
+                return index.descendants(node, namespaceURI, localName,
+                                         self_too)
+        return select
+
+    def compile_iter(self, axis):
+        """Like compile(), but the returned function returns an iterator
+        producing the nodes as they are found along 'axis'.
+
+        """
+        select = self.compile(axis)
+        nodeType = axis.principal_node_type
+        localName = self.localName
+
+        if axis is axes['attribute'] and localName != '*':
+            # at most one attribute
+            return lambda node, context: iter(select(node, context))
+
+        namespace = self._namespace(axis)
+        if localName == '*':
+            def iterate(node, context):
+                namespaceURI = namespace(context)
+                if namespaceURI == '*':
+                    return (n for n in axis(node) if n.nodeType == nodeType)
+                return (n for n in axis(node) if n.nodeType == nodeType and
+                        n.namespaceURI == namespaceURI)
+            return iterate
+
+        indexed = (axis is axes['descendant'] or
+                   axis is axes['descendant-or-self'])
+        def iterate(node, context):
+            if (indexed and hasattr(node, 'xpath_order') and
+                document_index(node) is not None):
+                return iter(select(node, context))
+            namespaceURI = namespace(context)
+            if namespaceURI == '*':
+                return (n for n in axis(node) if n.nodeType == nodeType and
+                        (n.nodeName == localName or
+                         (':' in n.nodeName and n.localName == localName)))
+            return (n for n in axis(node) if n.nodeType == nodeType and
+                    (n.nodeName == localName or
+                     (':' in n.nodeName and n.localName == localName)) and
+                    n.namespaceURI == namespaceURI)
+        return iterate
+
     def __str__(self):
         if self.prefix is not None:
             return '%s:%s' % (self.prefix, self.localName)
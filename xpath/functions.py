@@ -10,7 +10,8 @@ from itertools import *
 # parameters.
 #
 
-def function(minargs, maxargs, implicit=False, first=False, convert=None, namespaceUri=None):
+def function(minargs, maxargs, implicit=False, first=False, convert=None, namespaceUri=None,
+             lazy=False, aggregate=False):
     """Function decorator.
 
     minargs -- Minimum number of arguments taken by the function.
@@ -19,17 +20,26 @@ def function(minargs, maxargs, implicit=False, first=False, convert=None, namesp
                 of the current context node when passed no argument.
                 (e.g., string() and number().)
     convert -- When non-None, a function used to filter function arguments.
+    lazy -- True for functions which only use the first node (in document
+            order) of node-set arguments, like string().  Their arguments
+            are evaluated lazily (see xpath.expr.Expr.iterated); this is
+            implied by first and by converting arguments to strings,
+            numbers or booleans.
+    aggregate -- True for functions which go once over the nodes of
+                 node-set arguments, in any order, like count().  Their
+                 arguments may be iterators over the nodes instead of
+                 nodesets (see xpath.expr.Expr.streamed).
     """
             
     def decorator(f):
         def new_f(node, pos, size, context, *args):
-            if len(args) < new_f.minargs:
+            nargs = len(args)
+            if nargs < minargs:
                 raise XPathTypeError, 'too few arguments for "%s()"' % new_f.__name__
-            if (new_f.maxargs is not None and
-                len(args) > new_f.maxargs):
+            if maxargs is not None and nargs > maxargs:
                 raise XPathTypeError, 'too many arguments for "%s()"' % new_f.__name__
             
-            if implicit and len(args) == 0:
+            if implicit and nargs == 0:
                 args = [[node]]
 
             if first:
@@ -42,15 +52,17 @@ def function(minargs, maxargs, implicit=False, first=False, convert=None, namesp
                     
             if convert is not None:
                 if isinstance(convert, basestring):
-                    cvt = lambda x: invoke(convert, node, pos, size, context, x)
+                    args = [invoke(convert, node, pos, size, context, x)
+                            for x in args]
                 else:
-                    cvt = convert
-                args = [cvt(x) for x in args]
+                    args = [convert(x) for x in args]
                 
             return f(node, pos, size, context, *args)
 
         new_f.minargs = minargs
         new_f.maxargs = maxargs
+        new_f.lazy = lazy or first or convert in ('string', 'number', 'boolean')
+        new_f.aggregate = aggregate
         new_f.__name__ = f.__name__
         new_f.__doc__ = f.__doc__
         
@@ -76,9 +88,11 @@ def f_last(node, pos, size, context):
 def f_position(node, pos, size, context):
     return pos
 
-@function(1, 1, convert=nodeset)
+@function(1, 1, convert=node_iterable, aggregate=True)
 def f_count(node, pos, size, context, nodes):
-    return len(nodes)
+    if nodesetp(nodes):
+        return len(nodes)
+    return sum(1 for x in nodes)
 
 @function(1, 1)
 def f_id(node, pos, size, context, arg):
@@ -121,7 +135,7 @@ def f_name(node, pos, size, context, argnode):
 
 # String Functions
 
-@function(0, 1, implicit=True)
+@function(0, 1, implicit=True, lazy=True)
 def f_string(node, pos, size, context, v):
     """Convert a value to a string."""
     
@@ -169,7 +183,7 @@ def f_substring_after(node, pos, size, context, a, b):
     except ValueError:
         return ''
 
-@function(2, 3)
+@function(2, 3, lazy=True)
 def f_substring(node, pos, size, context, s, start, count=None):
     s = string(s, context)
     start = round(number(start, context))
@@ -223,11 +237,13 @@ def f_translate(node, pos, size, context, s, source, target):
 
 # Boolean functions
 
-@function(1, 1)
+@function(1, 1, aggregate=True)
 def f_boolean(node, pos, size, context, v):
     """Convert a value to a boolean."""
     if nodesetp(v):
         return len(v) > 0
+    elif type(v) in ITERATOR_TYPES:
+        return next(v, None) is not None
     elif numberp(v):
         if v == 0 or v != v:
             return False
@@ -262,7 +278,7 @@ def f_lang(node, pos, size, context, s):
 
 # Number functions
 
-@function(0, 1, implicit=True)
+@function(0, 1, implicit=True, lazy=True)
 def f_number(node, pos, size, context, v):
     """Convert a value to a number."""
     
@@ -273,7 +289,7 @@ def f_number(node, pos, size, context, v):
     except ValueError:
         return float('NaN')
 
-@function(1, 1, convert=nodeset)
+@function(1, 1, convert=node_iterable, aggregate=True)
 def f_sum(node, pos, size, context, nodes):
     return sum((number(string_value(x), context) for x in nodes))
 
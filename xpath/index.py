@@ -0,0 +1,147 @@
+from bisect import bisect_left, bisect_right
+from itertools import count
+import threading
+
+#
+# Per-document indexes.
+#
+
+# Order numbers are drawn from a single process-wide sequence, so that
+# numbers of nodes from different documents never collide and documents
+# are ordered by the time they were indexed.  A document is numbered
+# while holding the lock, so that documents indexed by concurrent threads
+# get consecutive ranges of numbers.
+_order = count()
+_order_lock = threading.Lock()
+
+class DocumentIndex(object):
+    """Precomputed information about a (read-only) document.
+
+    Building the index numbers every node of the document in document
+    order, in a single pass.  Each node gets two attributes:
+
+        xpath_order -- the preorder number of the node;
+        xpath_last  -- the largest preorder number in the node's subtree
+                       (including attributes).
+
+    Attributes are numbered after their element and before its children,
+    ordered by name.  Comparing the document order of two numbered nodes
+    is then a single integer comparison, and a node d is a descendant of
+    a node n iff n.xpath_order < d.xpath_order <= n.xpath_last.
+
+    Nodes inserted after the index was built have no numbers; code
+    comparing nodes must fall back to a structural comparison for them.
+
+    The index of elements by name, and the index of elements by the
+    value of an attribute, are only built the first time they are used
+    (see descendants() and attribute_owners()).
+
+    """
+
+    def __init__(self, root):
+        self.root = root
+        with _order_lock:
+            self._number(root, _order.next)
+        self._names = None
+        self._values = {}
+        root.xpath_index = self
+
+    def _number(self, root, number):
+        # Walks with a stack rather than recursion, documents may be
+        # deeper than the recursion limit.  None on the stack marks the
+        # end of the subtree of the node below it.
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            if node is None:
+                stack.pop().xpath_last = last
+                continue
+            last = node.xpath_order = number()
+            if node.nodeType == node.ELEMENT_NODE:
+                attrs = node.attributes.values()
+                attrs.sort(key=lambda attr: attr.name)
+                for attr in attrs:
+                    last = attr.xpath_order = attr.xpath_last = number()
+            stack.append(node)
+            stack.append(None)
+            stack.extend(reversed(node.childNodes))
+
+    def _index_names(self):
+        # Elements are visited in document order, so every list of
+        # elements with a given name is sorted.
+        names = {}
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            if node.nodeType == node.ELEMENT_NODE:
+                key = (node.namespaceURI, node.localName)
+                try:
+                    orders, nodes = names[key]
+                except KeyError:
+                    orders, nodes = names[key] = ([], [])
+                orders.append(node.xpath_order)
+                nodes.append(node)
+            stack.extend(reversed(node.childNodes))
+        return names
+
+    def descendants(self, node, namespaceURI, localName, self_too=False):
+        """Return the list of elements named (namespaceURI, localName)
+        which are descendants of node (or node itself, if self_too is
+        true), in document order.
+
+        node must have been numbered by this index.
+
+        """
+        if self._names is None:
+            self._names = self._index_names()
+        try:
+            orders, nodes = self._names[(namespaceURI, localName)]
+        except KeyError:
+            return []
+        if self_too:
+            start = bisect_left(orders, node.xpath_order)
+        else:
+            start = bisect_right(orders, node.xpath_order)
+        return nodes[start:bisect_right(orders, node.xpath_last, start)]
+
+    def _index_values(self, namespaceURI, localName):
+        values = {}
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            if node.nodeType == node.ELEMENT_NODE:
+                attr = node.getAttributeNodeNS(namespaceURI, localName)
+                if attr is not None:
+                    values.setdefault(attr.value, []).append(node)
+            stack.extend(reversed(node.childNodes))
+        return values
+
+    def attribute_owners(self, namespaceURI, localName, value):
+        """Return the list of elements whose attribute (namespaceURI,
+        localName) has the string value 'value', in document order.
+
+        """
+        key = (namespaceURI, localName)
+        try:
+            values = self._values[key]
+        except KeyError:
+            values = self._values[key] = self._index_values(*key)
+        return values.get(value, [])
+
+def index_document(root):
+    """Build a DocumentIndex for a document (or any other root node)
+    and return it.
+
+    """
+    return DocumentIndex(root)
+
+def document_index(node):
+    """Return the DocumentIndex of the document containing node, or None
+    if that document was not indexed.
+
+    """
+    if node.nodeType == node.ATTRIBUTE_NODE:
+        node = node.ownerElement
+    if node.nodeType != node.DOCUMENT_NODE:
+        node = node.ownerDocument
+    return getattr(node, 'xpath_index', None)
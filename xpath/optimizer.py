@@ -0,0 +1,182 @@
+from xpath.exceptions import *
+from expr import *
+import functions
+
+#
+# Static rewriting of expression trees.
+#
+# The parser keeps the literal shape of an expression: '//x' becomes
+# 'descendant-or-self::node()/child::x', which builds a list of every node
+# in the document before filtering it.  optimize() rewrites such shapes
+# into cheaper equivalent ones.
+#
+
+# Calls of pure core functions with constant arguments are evaluated
+# once, assuming the function table does not redefine them in an
+# incompatible way.
+FOLDABLE = PURE_FUNCTIONS
+
+class ConstantContext(object):
+    """The context constant subexpressions are evaluated in."""
+    functions = functions.xpath_functions
+    namespaces = {None: None}
+    variables = {}
+
+def optimize(expr):
+    """Return an expression equivalent to expr which is cheaper to
+    evaluate.  The tree is rewritten in place where possible, so expr
+    should not be used afterwards.
+
+    The following rewrites are done:
+
+        - constant subexpressions are folded into literals;
+        - 'descendant-or-self::node()/child::N' becomes 'descendant::N'
+          when the child step has no positional predicates;
+        - 'self::node()' steps are dropped from paths;
+        - 'not(not(x))' becomes 'boolean(x)'.
+
+    """
+    method = getattr(Optimizer, 'optimize_' + type(expr).__name__, None)
+    if method is None:
+        return expr
+    return method(expr)
+
+def constant(expr):
+    """Return a (True, value) pair if expr is a constant, (False, None)
+    otherwise."""
+    if isinstance(expr, LiteralExpr):
+        return True, expr.literal
+    if (isinstance(expr, Function) and expr.prefix is None and
+        not expr.args and expr.name in ('true', 'false')):
+        return True, expr.name == 'true'
+    return False, None
+
+def fold(expr):
+    """Evaluate a constant expression, returning the equivalent literal
+    expression, or expr itself if it cannot be evaluated statically."""
+    try:
+        value = expr.compile()(None, 1, 1, ConstantContext())
+    except XPathError:
+        # Leave the error to be reported when the expression is used.
+        return expr
+    if booleanp(value):
+        return Function(value and 'true' or 'false', [])
+    if numberp(value) or stringp(value):
+        return LiteralExpr(value)
+    return expr
+
+def is_self_node(step):
+    return (type(step) is AxisStep and step.axis is axes['self'] and
+            isinstance(step.test, AnyKindTest))
+
+def is_axis_step(step):
+    return type(step) is AxisStep or (type(step) is PredicateList and
+                                      type(step.expr) is AxisStep)
+
+class Optimizer(object):
+    """Rewrite rules, one per expression class.  Each rule optimizes the
+    subexpressions first and returns the rewritten expression."""
+
+    @staticmethod
+    def optimize_BinaryOperatorExpr(expr):
+        expr.left = optimize(expr.left)
+        expr.right = optimize(expr.right)
+        if constant(expr.left)[0] and constant(expr.right)[0]:
+            return fold(expr)
+        return expr
+
+    optimize_AndExpr = optimize_BinaryOperatorExpr
+    optimize_OrExpr = optimize_BinaryOperatorExpr
+    optimize_EqualityExpr = optimize_BinaryOperatorExpr
+    optimize_ArithmeticalExpr = optimize_BinaryOperatorExpr
+
+    @staticmethod
+    def optimize_UnionExpr(expr):
+        expr.left = optimize(expr.left)
+        expr.right = optimize(expr.right)
+        return expr
+
+    @staticmethod
+    def optimize_NegationExpr(expr):
+        expr.expr = optimize(expr.expr)
+        if constant(expr.expr)[0]:
+            return fold(expr)
+        return expr
+
+    @staticmethod
+    def optimize_Function(expr):
+        expr.args = [optimize(x) for x in expr.args]
+        if expr.prefix is not None:
+            return expr
+
+        # not(not(x)) is boolean(x).
+        if expr.name == 'not' and len(expr.args) == 1:
+            arg = expr.args[0]
+            if (isinstance(arg, Function) and arg.prefix is None and
+                arg.name == 'not' and len(arg.args) == 1):
+                return optimize(Function('boolean', arg.args))
+
+        if expr.name in FOLDABLE and expr.args and \
+                all(constant(x)[0] for x in expr.args):
+            return fold(expr)
+        return expr
+
+    @staticmethod
+    def optimize_AbsolutePathExpr(expr):
+        if expr.path is not None:
+            expr.path = optimize(expr.path)
+        return expr
+
+    @staticmethod
+    def optimize_PathExpr(expr):
+        steps = [optimize(x) for x in expr.steps]
+
+        # Drop self::node() steps.  The first step may be a filter
+        # expression, whose value only becomes a sorted node-set when
+        # followed by another step, so keep one step after it.
+        kept = [x for x in steps if not is_self_node(x)]
+        if not kept:
+            kept = steps[:1]
+        elif len(kept) == 1 and len(steps) > 1 and not is_axis_step(kept[0]):
+            kept = kept + [AxisStep('self')]
+
+        # descendant-or-self::node()/child::N is descendant::N unless the
+        # child step has positional predicates.
+        result = []
+        for step in kept:
+            if result and is_self_or_descendants(result[-1]):
+                rewritten = descendant_step(step)
+                if rewritten is not None:
+                    result[-1] = rewritten
+                    continue
+            result.append(step)
+
+        # A path of a single filter expression is that expression.
+        if len(result) == 1 and not is_axis_step(result[0]):
+            return result[0]
+        expr.steps = result
+        return expr
+
+    @staticmethod
+    def optimize_PredicateList(expr):
+        expr.expr = optimize(expr.expr)
+        expr.predicates = [optimize(x) for x in expr.predicates]
+        return expr
+
+def is_self_or_descendants(step):
+    return (type(step) is AxisStep and
+            step.axis is axes['descendant-or-self'] and
+            isinstance(step.test, AnyKindTest))
+
+def descendant_step(step):
+    """Return the descendant step equivalent to following a
+    descendant-or-self::node() step by step, or None if there is none."""
+    if type(step) is AxisStep:
+        if step.axis is axes['child']:
+            return AxisStep('descendant', step.test)
+    elif type(step) is PredicateList and type(step.expr) is AxisStep:
+        if step.expr.axis is axes['child'] and \
+                not any(is_positional(x) for x in step.predicates):
+            return PredicateList(AxisStep('descendant', step.expr.test),
+                                 step.predicates, 'descendant')
+    return None
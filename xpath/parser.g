@@ -288,7 +288,7 @@ parser XPath:
           r'id' r'\(' Literal r'\)'     {{ return X.Function('id', [ Literal ]) }}
         | r'key' 
           r'\(' Literal                 {{ arg1 = Literal }}
-          r'\,' Literal r'\)'           {{ return X.Function('id', [ arg1, Literal ]) }}
+          r'\,' Literal r'\)'           {{ return X.Function('key', [ arg1, Literal ]) }}
         
     rule RelativePathPattern:
         StepPattern                     {{ steps = [StepPattern] }}
@@ -471,7 +471,7 @@ class XPath(Parser):
             self._scan("r'\\,'")
             Literal = self.Literal()
             self._scan("r'\\)'")
-            return X.Function('id', [ arg1, Literal ])
+            return X.Function('key', [ arg1, Literal ])
 
     def RelativePathPattern(self):
         StepPattern = self.StepPattern()
@@ -0,0 +1,488 @@
+import re
+import xpath.expr as X
+from xpath.yappsrt import SyntaxError
+
+#
+# A hand-written parser for the grammar of parser.g.
+#
+# The generated parser asks the scanner for every token with the list of
+# token types allowed at that point and calls a method per grammar rule,
+# which makes parsing an expression cost hundreds of Python calls.  This
+# one splits the whole expression into tokens with a single regular
+# expression, parses binary operators by precedence climbing and only
+# descends into a method when the grammar branches.
+#
+# It builds exactly the trees the generated parser builds, including the
+# odd ones (see LocationPathPattern and AttributeValueTemplate), and
+# accepts and rejects the same strings: tokens of the generated scanner
+# depend on the token types allowed at a position, which is reproduced
+# below by interpreting names by the context they appear in.
+#
+
+_TOKEN = re.compile(r'\s*(?:'
+    r'(?P<number>(?:\.[0-9]+|[0-9]+(?:\.[0-9]*)?)(?:[eE][+\-]?[0-9]+)?)|'
+    r'(?P<name>[a-zA-Z_][\w.\-]*)|'
+    r'(?P<literal>"[^"]*"|\'[^\']*\')|'
+    r'(?P<op>::|//|\.\.|!=|<=|>=|[\-/()\[\]@$.,|*+=<>:{}]))')
+_SPACE = re.compile(r'\s*')
+_LITERALTEXT = re.compile(r'[^{]*')
+
+# Binary operators: token (the text of names) -> (precedence, class).
+BINARY_OPERATORS = {
+    'or': (1, X.OrExpr),
+    'and': (2, X.AndExpr),
+    '=': (3, X.EqualityExpr), '!=': (3, X.EqualityExpr),
+    '<': (4, X.EqualityExpr), '<=': (4, X.EqualityExpr),
+    '>': (4, X.EqualityExpr), '>=': (4, X.EqualityExpr),
+    '+': (5, X.ArithmeticalExpr), '-': (5, X.ArithmeticalExpr),
+    '*': (6, X.ArithmeticalExpr), 'div': (6, X.ArithmeticalExpr),
+    'mod': (6, X.ArithmeticalExpr),
+    '|': (7, X.UnionExpr),
+}
+
+# The generated scanner matches operator names without a word boundary:
+# 'a andb' is 'a and b'.
+_OPERATOR_PREFIX = re.compile('and|or|div|mod')
+
+KIND_TESTS = {
+    'comment': X.CommentTest,
+    'text': X.TextTest,
+    'node': X.AnyKindTest,
+    'processing-instruction': X.PITest,
+}
+
+FORWARD_AXES = frozenset(['child', 'descendant-or-self', 'attribute', 'self',
+                          'descendant', 'following-sibling', 'following',
+                          'namespace'])
+REVERSE_AXES = frozenset(['parent', 'preceding-sibling', 'preceding',
+                          'ancestor-or-self', 'ancestor'])
+
+# Tokens which may start a step after '/'.
+_STEP_START = frozenset(['name', 'number', 'literal', '(', '$', '.', '..',
+                         '@', '*'])
+# Tokens which may start a step of a pattern.
+_STEP_PATTERN_START = frozenset(['name', '@', '*'])
+
+# Names read as keywords rather than names at the start of a step and
+# of a location path pattern.
+_STEP_PATTERN_KEYWORDS = frozenset(['child', 'attribute']).union(KIND_TESTS)
+_PATTERN_KEYWORDS = _STEP_PATTERN_KEYWORDS.union(['id', 'key'])
+
+
+def tokenize(text, pos=0):
+    """Return the tokens of text from pos, as a list of (type, text,
+    start, end) tuples.  The type is 'name', 'number' or 'literal', the
+    text itself for other tokens, 'end' for the end of the input and
+    'error' for a character which starts no token.
+
+    Tokenizing stops after a '}', which ends an expression in an
+    attribute value template.
+
+    """
+    tokens = []
+    match = _TOKEN.match
+    while True:
+        m = match(text, pos)
+        if m is None:
+            pos = _SPACE.match(text, pos).end()
+            if pos == len(text):
+                tokens.append(('end', '', pos, pos))
+            else:
+                tokens.append(('error', text[pos], pos, pos))
+            return tokens
+        kind = m.lastgroup
+        start, pos = m.span(kind)
+        value = text[start:pos]
+        if kind == 'op':
+            kind = value
+            if kind == '}':
+                tokens.append((kind, value, start, pos))
+                return tokens
+        tokens.append((kind, value, start, pos))
+
+
+class Parser(object):
+    """Parses one string with one of the methods XPath, Pattern and
+    AttributeValueTemplate (the rules of the generated parser), raising
+    xpath.yappsrt.SyntaxError for invalid strings.
+
+    """
+    def __init__(self, text):
+        self.text = text
+        self.tokens = None
+        self.i = 0
+
+    def XPath(self):
+        self.tokens = tokenize(self.text)
+        expr = self.Expr()
+        self.expect('end')
+        return expr
+
+    def Pattern(self):
+        self.tokens = tokenize(self.text)
+        expr = self.LocationPathPattern()
+        while self.tokens[self.i][0] == '|':
+            self.i += 1
+            expr = X.UnionExpr('|', expr, self.LocationPathPattern())
+        self.expect('end')
+        return expr
+
+    def AttributeValueTemplate(self):
+        text = self.text
+        m = _LITERALTEXT.match(text)
+        args = [X.LiteralExpr(self.literalText(m.group()))]
+        pos = m.end()
+        while pos < len(text):
+            # at a '{'
+            self.tokens = tokenize(text, pos + 1)
+            self.i = 0
+            args.append(self.Expr())
+            pos = self.expect('}')[3]
+            m = _LITERALTEXT.match(text, pos)
+            args.append(X.LiteralExpr(self.literalText(m.group())))
+            pos = m.end()
+        return X.Function('concat', args)
+
+    def literalText(self, text):
+        # the generated scanner skips text made of whitespace only
+        if text.isspace():
+            return ''
+        return text
+
+    def error(self, token, expected=None):
+        if expected is not None:
+            msg = 'Trying to find %s' % expected
+        elif token[0] == 'end':
+            msg = 'Unexpected end of expression'
+        else:
+            msg = 'Unexpected %r' % token[1]
+        raise SyntaxError(token[2], msg)
+
+    def expect(self, kind):
+        token = self.tokens[self.i]
+        if token[0] != kind:
+            self.error(token, repr(kind))
+        self.i += 1
+        return token
+
+    def split(self, n):
+        """Split the current name token after n characters, the rest of
+        the input is tokenized again."""
+        token = self.tokens[self.i]
+        end = token[2] + n
+        self.tokens[self.i:] = [('name', token[1][:n], token[2], end)] + \
+                               tokenize(self.text, end)
+
+    def name(self, keywords=()):
+        """Return the current name token, treating it like the generated
+        scanner does where function names may not appear: a name
+        immediately followed by '(' loses its last character to the
+        next token unless it is one of keywords.
+
+        """
+        token = self.tokens[self.i]
+        while (self.text[token[3]:token[3] + 1] == '(' and
+               token[1] not in keywords):
+            if len(token[1]) == 1:
+                self.error(token)
+            self.split(len(token[1]) - 1)
+            token = self.tokens[self.i]
+        return token
+
+    #
+    # Expressions
+    #
+
+    def Expr(self, precedence=1):
+        expr = self.UnaryExpr()
+        tokens = self.tokens
+        while True:
+            token = tokens[self.i]
+            kind = token[0]
+            if kind == 'name':
+                operator = BINARY_OPERATORS.get(token[1])
+                if operator is None:
+                    m = _OPERATOR_PREFIX.match(token[1])
+                    if m is None:
+                        return expr
+                    self.split(m.end())
+                    token = tokens[self.i]
+                    operator = BINARY_OPERATORS[token[1]]
+            else:
+                operator = BINARY_OPERATORS.get(kind)
+                if operator is None:
+                    return expr
+            if operator[0] < precedence:
+                return expr
+            self.i += 1
+            right = self.Expr(operator[0] + 1)
+            expr = operator[1](token[1], expr, right)
+
+    def UnaryExpr(self):
+        if self.tokens[self.i][0] == '-':
+            self.i += 1
+            return X.NegationExpr(self.PathExpr())
+        return self.PathExpr()
+
+    def PathExpr(self):
+        token = self.tokens[self.i]
+        kind = token[0]
+        if kind == '/':
+            self.i += 1
+            token = self.tokens[self.i]
+            if (token[0] not in _STEP_START or
+                (token[0] == 'name' and token[1] in ('and', 'or'))):
+                return X.AbsolutePathExpr(None)
+            return X.AbsolutePathExpr(self.RelativePathExpr())
+        elif kind == '//':
+            self.i += 1
+            path = self.RelativePathExpr()
+            path.steps.insert(0, X.AxisStep('descendant-or-self'))
+            return X.AbsolutePathExpr(path)
+        return self.RelativePathExpr()
+
+    def RelativePathExpr(self):
+        steps = [self.StepExpr()]
+        tokens = self.tokens
+        while True:
+            kind = tokens[self.i][0]
+            if kind == '/':
+                self.i += 1
+            elif kind == '//':
+                self.i += 1
+                steps.append(X.AxisStep('descendant-or-self'))
+            else:
+                return X.PathExpr(steps)
+            steps.append(self.StepExpr())
+
+    def StepExpr(self):
+        tokens = self.tokens
+        token = tokens[self.i]
+        kind = token[0]
+        if kind == 'name':
+            name = token[1]
+            end = token[3]
+            follow = self.text[end:end + 1]
+            if follow == '(':
+                if name in KIND_TESTS:
+                    return self.AxisStep('child', self.KindTest())
+                self.i += 1
+                return self.FilterExpr(self.FunctionCall(name))
+            if follow == ':':
+                colon, local = tokens[self.i + 1], tokens[self.i + 2]
+                if (colon[0] == ':' and local[0] == 'name' and
+                    local[2] == end + 1 and
+                    self.text[local[3]:local[3] + 1] == '('):
+                    self.i += 3
+                    return self.FilterExpr(
+                        self.FunctionCall(name + ':' + local[1]))
+            following = tokens[self.i + 1][0]
+            if ((name in FORWARD_AXES and following == '::') or
+                 (name in REVERSE_AXES and following != '(')):
+                self.i += 1
+                self.expect('::')
+                return self.AxisStep(name, self.NodeTest())
+            return self.AxisStep('child', self.NodeTest())
+        elif kind == '@':
+            self.i += 1
+            return self.AxisStep('attribute', self.NodeTest())
+        elif kind == '..':
+            self.i += 1
+            return self.AxisStep('parent', None)
+        elif kind == '*':
+            return self.AxisStep('child', self.NodeTest())
+        return self.FilterExpr(self.PrimaryExpr())
+
+    def AxisStep(self, axis, test):
+        expr = X.AxisStep(axis, test)
+        if self.tokens[self.i][0] == '[':
+            expr = X.PredicateList(expr, self.PredicateList(), axis)
+        return expr
+
+    def NodeTest(self):
+        token = self.tokens[self.i]
+        if token[0] == 'name':
+            token = self.name(KIND_TESTS)
+            if token[1] in KIND_TESTS:
+                return self.KindTest()
+        elif token[0] != '*':
+            self.error(token, 'a node test')
+        return self.NameTest()
+
+    def NameTest(self):
+        localpart = self.WildcardOrNCName()
+        if self.tokens[self.i][0] == ':':
+            self.i += 1
+            return X.NameTest(localpart, self.WildcardOrNCName())
+        return X.NameTest(None, localpart)
+
+    def WildcardOrNCName(self):
+        token = self.tokens[self.i]
+        if token[0] == '*':
+            self.i += 1
+            return '*'
+        if token[0] != 'name':
+            self.error(token, 'a name')
+        token = self.name()
+        self.i += 1
+        return token[1]
+
+    def KindTest(self):
+        token = self.tokens[self.i]
+        self.i += 1
+        self.expect('(')
+        if token[1] == 'processing-instruction':
+            name = None
+            token = self.tokens[self.i]
+            if token[0] == 'name':
+                name = self.name()[1]
+                self.i += 1
+            elif token[0] == 'literal':
+                name = token[1][1:-1]
+                self.i += 1
+            self.expect(')')
+            return X.PITest(name)
+        self.expect(')')
+        return KIND_TESTS[token[1]]()
+
+    def FilterExpr(self, expr):
+        if self.tokens[self.i][0] == '[':
+            expr = X.PredicateList(expr, self.PredicateList())
+        return expr
+
+    def PredicateList(self):
+        tokens = self.tokens
+        predicates = []
+        while tokens[self.i][0] == '[':
+            self.i += 1
+            predicates.append(self.Expr())
+            self.expect(']')
+        return predicates
+
+    def PrimaryExpr(self):
+        token = self.tokens[self.i]
+        kind = token[0]
+        self.i += 1
+        if kind == 'number':
+            return X.LiteralExpr(float(token[1]))
+        elif kind == 'literal':
+            return X.LiteralExpr(token[1][1:-1])
+        elif kind == '$':
+            return X.VariableReference(*self.QName())
+        elif kind == '(':
+            expr = self.Expr()
+            self.expect(')')
+            return expr
+        elif kind == '.':
+            return X.AxisStep('self')
+        self.error(token)
+
+    def FunctionCall(self, name):
+        self.expect('(')
+        args = []
+        if self.tokens[self.i][0] not in (',', ')'):
+            args.append(self.Expr())
+            while self.tokens[self.i][0] == ',':
+                self.i += 1
+                args.append(self.Expr())
+        self.expect(')')
+        return X.Function(name, args)
+
+    def QName(self):
+        name = self.NCName()
+        if self.tokens[self.i][0] == ':':
+            self.i += 1
+            return (name, self.NCName())
+        return (None, name)
+
+    def NCName(self):
+        if self.tokens[self.i][0] != 'name':
+            self.error(self.tokens[self.i], 'a name')
+        token = self.name()
+        self.i += 1
+        return token[1]
+
+    def Literal(self):
+        token = self.tokens[self.i]
+        self.i += 1
+        if token[0] == 'number':
+            return float(token[1])
+        elif token[0] == 'literal':
+            return token[1][1:-1]
+        self.error(token, 'a literal')
+
+    #
+    # Patterns
+    #
+
+    def LocationPathPattern(self):
+        token = self.tokens[self.i]
+        kind = token[0]
+        if kind == '/':
+            self.i += 1
+            if self.tokens[self.i][0] not in _STEP_PATTERN_START:
+                return X.AbsolutePathExpr(None)
+            return X.AbsolutePathExpr(self.RelativePathPattern())
+        if kind == 'name' and self.name(_PATTERN_KEYWORDS)[1] in ('id', 'key'):
+            expr = [self.IdKeyPattern()]
+            kind = self.tokens[self.i][0]
+            if kind in ('/', '//'):
+                self.i += 1
+                path = self.RelativePathPattern()
+                if kind == '//':
+                    path.steps.append(X.AxisStep('descendant-or-self'))
+                # sic, the generated parser appends the list
+                path.steps.append(expr)
+                expr = path
+            return X.AbsolutePathExpr(expr)
+        if kind == '//':
+            self.i += 1
+        path = self.RelativePathPattern()
+        path.steps.insert(0, X.AxisStep('descendant-or-self'))
+        return X.AbsolutePathExpr(path)
+
+    def IdKeyPattern(self):
+        token = self.tokens[self.i]
+        self.i += 1
+        self.expect('(')
+        args = [self.Literal()]
+        if token[1] == 'key':
+            self.expect(',')
+            args.append(self.Literal())
+        self.expect(')')
+        return X.Function(token[1], args)
+
+    def RelativePathPattern(self):
+        steps = [self.StepPattern()]
+        tokens = self.tokens
+        while True:
+            kind = tokens[self.i][0]
+            if kind == '/':
+                self.i += 1
+            elif kind == '//':
+                self.i += 1
+                steps.append(X.AxisStep('descendant-or-self'))
+            else:
+                return X.PathExpr(steps)
+            steps.append(self.StepPattern())
+
+    def StepPattern(self):
+        token = self.tokens[self.i]
+        kind = token[0]
+        if kind == 'name':
+            token = self.name(_STEP_PATTERN_KEYWORDS)
+            if token[1] in ('child', 'attribute'):
+                self.i += 1
+                self.expect('::')
+                return self.AxisStep(token[1], self.NodeTest())
+        elif kind == '@':
+            self.i += 1
+            return self.AxisStep('attribute', self.NodeTest())
+        elif kind != '*':
+            self.error(token, 'a step')
+        return self.AxisStep('child', self.NodeTest())
+
+
+def parse(rule, text):
+    """Parse text with the grammar rule named rule."""
+    return getattr(Parser(text), rule)()
@@ -1,5 +1,6 @@
 from exceptions import *
 from axes import *
+from types import GeneratorType
             
 def string_value(node):
     """Compute the string-value of a node."""
@@ -26,14 +27,68 @@ def invoke(name, node, pos, size, context, *args):
         raise XPathUnknownFunctionError, 'unknown function "%s()"' % name
     return fn(node, pos, size, context, *args)
         
+class NodeSet(list):
+    """A node-set.
+
+    A NodeSet is a list of nodes which also records what is known about
+    the order of its nodes:
+
+        ordered -- the nodes are known to be in document order;
+        unique  -- the nodes are known to be free of duplicates.
+
+    Operators use the flags to skip sorting and duplicate removal when
+    they are unnecessary.  The flags describe the list as it was created;
+    code that modifies a NodeSet in place must reset them.
+
+    """
+
+    ordered = False
+    unique = False
+
+    def __init__(self, nodes=(), ordered=False, unique=False):
+        list.__init__(self, nodes)
+        if ordered:
+            self.ordered = True
+        if unique:
+            self.unique = True
+
+class OrderedNodeSet(NodeSet):
+    """A NodeSet known to be in document order and free of duplicates.
+
+    Creating one costs no more than creating a plain list, which matters
+    for the many small node-sets produced by location steps.
+
+    """
+
+    ordered = True
+    unique = True
+
+    __init__ = list.__init__
+
 def nodeset(v):
     """Convert a value to a nodeset."""
     if not nodesetp(v):
         raise XPathTypeError, "value is not a node-set"
     return v
 
+# Types of the iterators lazily evaluated expressions return for node-sets
+# (see xpath.expr.Expr.iterated and Expr.streamed).
+ITERATOR_TYPES = frozenset([GeneratorType, type(iter([])), type(iter(()))])
+
+def node_iterable(v):
+    """Convert a value to a nodeset, or an iterator over nodes as passed
+    to aggregate functions (see xpath.functions.function)."""
+    if type(v) not in ITERATOR_TYPES and not nodesetp(v):
+        raise XPathTypeError, "value is not a node-set"
+    return v
+
 def nodesetp(v):
-    """Return true iff 'v' is a node-set."""
+    """Return true iff 'v' is a node-set.
+
+    Plain lists are accepted as node-sets (with nothing known about their
+    order) as well as NodeSets.
+
+    """
     if isinstance(v, list):
         return True
 
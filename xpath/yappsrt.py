@@ -4,6 +4,7 @@
 
 from string import join, count, find, rfind
 import re
+import sre_parse, sre_constants
 
 class SyntaxError(Exception):
     """When we run into an unexpected token, this is the exception to use"""
@@ -19,6 +20,78 @@ class NoMoreTokens(Exception):
     """Another exception object, for when we run out of tokens"""
     pass
 
+# All characters a pattern may start with, see first_chars.
+ALL_CHARS = frozenset(map(chr, range(256)))
+
+_categories = {
+    sre_constants.CATEGORY_DIGIT: r'\d', sre_constants.CATEGORY_NOT_DIGIT: r'\D',
+    sre_constants.CATEGORY_SPACE: r'\s', sre_constants.CATEGORY_NOT_SPACE: r'\S',
+    sre_constants.CATEGORY_WORD: r'\w', sre_constants.CATEGORY_NOT_WORD: r'\W',
+}
+
+def first_chars(pattern):
+    """Return (chars, nullable) for a regex: the set of characters a
+    match of the pattern may start with and whether it may match the
+    empty string.  The result may be larger than the exact set (e.g.
+    lookahead assertions are ignored), but never smaller."""
+    try:
+        return _first_chars(sre_parse.parse(pattern))
+    except Exception:
+        return ALL_CHARS, True
+
+def _first_chars(items):
+    chars = set()
+    for op, av in items:
+        first, nullable = _first_char(op, av)
+        chars |= first
+        if not nullable:
+            return frozenset(chars), False
+    return frozenset(chars), True
+
+def _first_char(op, av):
+    if op == sre_constants.LITERAL:
+        return set([chr(av)]), False
+    if op == sre_constants.IN:
+        return set(c for c in ALL_CHARS if _in_set(av, c)), False
+    if op in (sre_constants.NOT_LITERAL, sre_constants.ANY):
+        return ALL_CHARS, False
+    if op == sre_constants.BRANCH:
+        chars, nullable = set(), False
+        for branch in av[1]:
+            first, n = _first_chars(branch)
+            chars |= first
+            nullable = nullable or n
+        return chars, nullable
+    if op == sre_constants.SUBPATTERN:
+        return _first_chars(av[1])
+    if op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT):
+        first, nullable = _first_chars(av[2])
+        return first, nullable or av[0] == 0
+    if op in (sre_constants.AT, sre_constants.ASSERT, sre_constants.ASSERT_NOT):
+        # zero-width: the next item decides
+        return set(), True
+    return ALL_CHARS, True
+
+def _in_set(items, c):
+    """Return True if c is in the character set of an IN item."""
+    negate = False
+    for op, av in items:
+        if op == sre_constants.NEGATE:
+            negate = True
+        elif op == sre_constants.LITERAL:
+            if c == chr(av):
+                return not negate
+        elif op == sre_constants.RANGE:
+            if av[0] <= ord(c) <= av[1]:
+                return not negate
+        elif op == sre_constants.CATEGORY:
+            if re.match(_categories.get(av, '.'), c):
+                return not negate
+        else:
+            # unknown set item, assume it matches
+            return True
+    return negate
+
 class Scanner:
     def __init__(self, patterns, ignore, input):
         """Patterns is [(terminal,regex)...]
@@ -37,6 +110,16 @@ class Scanner:
             self.patterns = []
             for k, r in patterns:
                 self.patterns.append( (k, re.compile(r)) )
+            self._tables = {}
+        else:
+            # Shared by all scanners of the class.  Holds the first
+            # characters of the patterns (key None), the candidates for
+            # a restriction and a character (see scan) and restrictions
+            # as sets (see token).
+            cls = self.__class__
+            if '_tables' not in cls.__dict__:
+                cls._tables = {}
+            self._tables = cls._tables
         
     def token(self, i, restrict=0):
         """Get the i'th token, and if i is one past the end, then scan
@@ -46,11 +129,36 @@ class Scanner:
         if i < len(self.tokens):
             # Make sure the restriction is more restricted
             if restrict and self.restrictions[i]:
-                for r in restrict:
-                    if r not in self.restrictions[i]:
-                        raise NotImplementedError("Unimplemented: restriction set changed")
+                if not self._allowed(restrict) <= self.restrictions[i]:
+                    raise NotImplementedError("Unimplemented: restriction set changed")
             return self.tokens[i]
         raise NoMoreTokens()
+
+    def _allowed(self, restrict):
+        """Return restrict as a frozenset."""
+        key = type(restrict) is tuple and restrict or tuple(restrict)
+        try:
+            return self._tables[key]
+        except KeyError:
+            allowed = self._tables[key] = frozenset(restrict)
+            return allowed
+
+    def candidates(self, restrict, c):
+        """Return the patterns, in order, which are allowed by restrict
+        and may match at a position starting with the character c
+        ('' at the end of the input)."""
+        try:
+            first = self._tables[None]
+        except KeyError:
+            first = self._tables[None] = \
+                [first_chars(regexp.pattern) for p, regexp in self.patterns]
+        result = []
+        for (p, regexp), (chars, nullable) in zip(self.patterns, first):
+            if restrict and p not in restrict and p not in self.ignore:
+                continue
+            if nullable or c in chars or (c and c not in ALL_CHARS):
+                result.append((p, regexp))
+        return result
     
     def __repr__(self):
         """Print the last 10 tokens that have been scanned in"""
@@ -62,16 +170,23 @@ class Scanner:
     def scan(self, restrict):
         """Should scan another token and add it to the list, self.tokens,
         and add the restriction to self.restrictions"""
+        # Only the patterns that may start with the next character are
+        # tried, see candidates; they are looked up by the restriction
+        # and the character.
+        restrict_key = restrict and tuple(restrict) or ()
         # Keep looking for a token, ignoring any in self.ignore
         while 1:
+            c = self.input[self.pos:self.pos+1]
+            try:
+                patterns = self._tables[restrict_key, c]
+            except KeyError:
+                patterns = self._tables[restrict_key, c] = \
+                    self.candidates(restrict, c)
             # Search the patterns for the longest match, with earlier
             # tokens in the list having preference
             best_match = -1
             best_pat = '(error)'
-            for p, regexp in self.patterns:
-                # First check to see if we're ignoring this token
-                if restrict and p not in restrict and p not in self.ignore:
-                    continue
+            for p, regexp in patterns:
                 m = regexp.match(self.input, self.pos)
                 if m and len(m.group(0)) > best_match:
                     # We got a match that's better than the previous one
@@ -95,7 +210,7 @@ class Scanner:
                 # (to prevent looping)
                 if not self.tokens or token != self.tokens[-1]:
                     self.tokens.append(token)
-                    self.restrictions.append(restrict)
+                    self.restrictions.append(restrict and self._allowed(restrict))
                 return
             else:
                 # This token should be ignored ..
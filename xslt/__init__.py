@@ -1,19 +1,35 @@
 # elements need to register themselves as Element subclasses
 import core
 import elements
+import serializer
+import cache
+import registry
+import batch
 
 from stylesheet import Stylesheet
 from exceptions import *
 
 
 class XSLTProcessor(object):
-	def __init__(self, dp=core.DocumentProvider()):
+	def __init__(self, dp=core.DocumentProvider(), cacheDir=None, registry=None):
+		"""Compiled stylesheets are kept in cacheDir if it is given, 
+		see cache.StylesheetCache. With a registry.StylesheetRegistry 
+		(like registry.defaultRegistry) stylesheets are shared with 
+		other processors using it."""
+		
 		self.dp = dp
 		self.stylesheet = None
 		self.params = {}
+		self.cache = cache.StylesheetCache(cacheDir) if cacheDir is not None else None
+		self.registry = registry
 		
 	def setStylesheet(self, uriOrDoc):
-		self.stylesheet = Stylesheet(uriOrDoc, dp=self.dp)
+		if self.registry is not None and isinstance(uriOrDoc, basestring):
+			self.stylesheet = self.registry.stylesheet(uriOrDoc)
+		elif self.cache is not None and isinstance(uriOrDoc, basestring):
+			self.stylesheet = self.cache.stylesheet(uriOrDoc, self.dp)
+		else:
+			self.stylesheet = Stylesheet(uriOrDoc, dp=self.dp)
 		
 	def setParameter(self, name, value=None):
 		if value is None:
@@ -39,4 +55,36 @@ class XSLTProcessor(object):
 			messages.extend(context.messages)
 			
 		return s
+		
+	def transformToStream(self, uriOrDoc, stream, messages=None, chunkSize=serializer.CHUNK_SIZE):
+		"""Writes the result to stream (a file-like object) while it is generated,
+		in chunks of about chunkSize characters."""
+		
+		context = self.createContext()
+		
+		self.stylesheet.transformToStream(uriOrDoc, context, stream, chunkSize)
+		
+		if messages is not None:
+			messages.extend(context.messages)
+			
+	def transformIter(self, uriOrDoc, messages=None, chunkSize=serializer.CHUNK_SIZE):
+		"""Returns an iterator over encoded chunks of the result,
+		the first chunks are available while the transformation runs.
+		messages are extended when the iteration is complete."""
+		
+		context = self.createContext()
+		
+		for chunk in self.stylesheet.transformIter(uriOrDoc, context, chunkSize):
+			yield chunk
+			
+		if messages is not None:
+			messages.extend(context.messages)
+			
+	def transformMany(self, uris, workers=None, ordered=True):
+		"""Transforms many documents in parallel processes forked after 
+		the stylesheet is compiled, see batch.transformMany. Yields
+		(uri, result, messages, error) for each document, a failed 
+		document does not stop the others."""
+		
+		return batch.transformMany(self, uris, workers, ordered)
 	
\ No newline at end of file
@@ -0,0 +1,81 @@
+import threading
+import multiprocessing
+from exceptions import TransformFailed
+
+
+# the processor of the pool being started, inherited by the forked workers
+_processor = None
+_forkLock = threading.Lock()
+
+
+def transformItem(processor, uri):
+	"""Returns (uri, result, messages, error) for one document,
+	see transformMany."""
+
+	messages = []
+	try:
+		result = processor.transform(uri, messages=messages)
+		error = None
+	except Exception, e:
+		try:
+			message = unicode(e)
+		except Exception:
+			message = repr(e)
+		result = None
+		error = TransformFailed(uri, type(e).__name__, message)
+	finally:
+		_forget(processor, uri)
+	return uri, result, messages, error
+
+
+def _forget(processor, uri):
+	# each document is usually transformed once, it is not kept by the
+	# provider of the stylesheet, which loaded it (see Stylesheet.transform)
+	try:
+		dp = processor.stylesheet.dp
+		dp.remove(dp.absUri(uri))
+	except Exception:
+		pass # an error of the transformation is already reported
+
+
+def _transformInWorker(uri):
+	return transformItem(_processor, uri)
+
+
+def transformMany(processor, uris, workers=None, ordered=True):
+	"""Transforms documents in worker processes forked from this one,
+	so they share the compiled stylesheet of processor. 
+	Yields (uri, result, messages, error) for each document: the encoded 
+	result and xsl:message output, or a TransformFailed error and None.
+	With ordered, items come in the order of uris, otherwise as soon as
+	they are done. workers defaults to the number of CPUs; with one 
+	worker, documents are transformed in this process."""
+
+	global _processor
+
+	if workers is None:
+		workers = multiprocessing.cpu_count()
+	if workers <= 1:
+		for uri in uris:
+			yield transformItem(processor, uri)
+		return
+
+	with _forkLock:
+		_processor = processor
+		try:
+			pool = multiprocessing.Pool(workers)
+		finally:
+			_processor = None
+
+	try:
+		if ordered:
+			items = pool.imap(_transformInWorker, uris)
+		else:
+			items = pool.imap_unordered(_transformInWorker, uris)
+		for item in items:
+			yield item
+		pool.close()
+	finally:
+		# stops the workers if the caller does not read all items
+		pool.terminate()
+		pool.join()
@@ -0,0 +1,128 @@
+import os, stat, errno, tempfile
+import cPickle
+import hashlib
+from stylesheet import Stylesheet
+
+
+# changes whenever pickled stylesheets of an older version can not be used
+FORMAT = 1
+
+
+def isPrivate(st):
+	"""Returns True if the file of the os.stat result st is owned by the
+	current user and not writable by the group or others."""
+
+	if hasattr(os, 'getuid') and st.st_uid != os.getuid():
+		return False
+	return not st.st_mode & (stat.S_IWGRP | stat.S_IWOTH)
+
+
+def fileDigest(path):
+	"""Returns the SHA-1 hex digest of the content of a file."""
+
+	h = hashlib.sha1()
+	f = open(path, 'rb')
+	try:
+		for block in iter(lambda: f.read(65536), ''):
+			h.update(block)
+	finally:
+		f.close()
+	return h.hexdigest()
+
+
+class StylesheetCache(object):
+	"""Keeps compiled stylesheets in a directory, so that
+	stylesheets are not parsed and compiled again in every process.
+
+	An entry is named by the URI and the content hash of the main
+	stylesheet and records the content hashes of all its includes and
+	imports; it is only used while all of them match the files.
+	Entries are pickled Stylesheet objects: compiled expressions and
+	dispatch tables are rebuilt when they are first used.
+
+	Unpickling an entry can run arbitrary code, so whoever can write to
+	the directory can run code in every process using the cache. The
+	directory is created private (mode 0700); a directory which is not
+	owned by the current user or is writable by the group or others is
+	refused with an OSError, and such entries are ignored. Do not share
+	a cache directory between users."""
+
+	def __init__(self, directory):
+		self.directory = directory
+		if not os.path.isdir(directory):
+			os.makedirs(directory, 0700)
+		if not isPrivate(os.stat(directory)):
+			raise OSError(errno.EPERM, 'stylesheet cache directory is not private', directory)
+
+
+	def entryPath(self, uri, digest):
+		if isinstance(uri, unicode):
+			uri = uri.encode('utf-8')
+		key = hashlib.sha1('%d\0%s\0%s' % (FORMAT, uri, digest)).hexdigest()
+		return os.path.join(self.directory, key + '.pickle')
+
+
+	def stylesheet(self, uri, dp):
+		"""Returns the compiled stylesheet at uri, from the cache
+		if it is up to date, otherwise compiles and stores it."""
+
+		uri = dp.absUri(uri)
+		path = self.entryPath(uri, fileDigest(uri))
+
+		stylesheet = self.load(path)
+		if stylesheet is None:
+			stylesheet = Stylesheet(uri, dp=dp)
+			self.store(path, stylesheet)
+		else:
+			stylesheet.setDocumentProvider(dp)
+		return stylesheet
+
+
+	def load(self, path):
+		"""Returns the stylesheet stored in the entry at path
+		or None if there is no valid entry."""
+
+		try:
+			f = open(path, 'rb')
+		except IOError:
+			return None
+		try:
+			# checked on the open file, it can not be replaced meanwhile
+			if not isPrivate(os.fstat(f.fileno())):
+				return None
+			try:
+				digests, stylesheet = cPickle.load(f)
+			except Exception:
+				# a truncated or otherwise broken entry is compiled again
+				return None
+		finally:
+			f.close()
+
+		for dependency, digest in digests:
+			try:
+				if fileDigest(dependency) != digest:
+					return None
+			except IOError:
+				return None
+		return stylesheet
+
+
+	def store(self, path, stylesheet):
+		digests = [(uri, fileDigest(uri)) for uri in stylesheet.dependencies()]
+		data = cPickle.dumps((digests, stylesheet), cPickle.HIGHEST_PROTOCOL)
+
+		# written to a temporary file and renamed, so that other processes
+		# never read a partly written entry
+		try:
+			fd, tmp = tempfile.mkstemp(dir=self.directory)
+		except (IOError, OSError):
+			# the cache is an optimization, the stylesheet is still usable
+			return
+		try:
+			try:
+				os.write(fd, data)
+			finally:
+				os.close(fd)
+			os.rename(tmp, path)
+		except (IOError, OSError):
+			os.remove(tmp)
@@ -1,6 +1,8 @@
 import tools
 import xp, xslt.functions
+import xpath.index
 import os.path, sys
+import threading, collections, weakref
 import xml.dom.minidom
 from properties import *
 
@@ -61,21 +63,39 @@ def xsltChildren(node, allowedNames=[]):
 			
 	return elements
 	
-def fixNamespaces(node):
+def fixNamespaces(node, inScope=None):
 	"""Add missing namespace definitions (xmlns: attributes)
-	for namespace URI's used in node subtree"""
+	for namespace URI's used in node subtree. 
+	inScope are the bindings (prefix -> uri) in scope of node."""
 	
+	if inScope is None:
+		inScope = {None: None, 'xml': xml.dom.XML_NAMESPACE}
+		
 	if node.nodeType == xml.dom.Node.ELEMENT_NODE:
-		ns = tools.getNamespaceBindings(node)
-		if node.namespaceURI not in ns.values():
-			node.setAttributeNS(xml.dom.XMLNS_NAMESPACE, 'xmlns:'+node.prefix, node.namespaceURI)
+		scope = inScope.copy()
+		for prefix, uri in tools.getNamespaceBindings(node).iteritems():
+			scope[prefix] = uri or None
+			
+		names = [(node.prefix, node.namespaceURI)]
 		for i in range(node.attributes.length):
 			attr = node.attributes.item(i)
-			if attr.namespaceURI not in ns.values() and attr.namespaceURI != xml.dom.XMLNS_NAMESPACE:
-				node.setAttributeNS(xml.dom.XMLNS_NAMESPACE, 'xmlns:'+attr.prefix, attr.namespaceURI)
+			# an attribute without prefix is never in a namespace, it can not be fixed here
+			if attr.prefix is not None and attr.namespaceURI != xml.dom.XMLNS_NAMESPACE:
+				names.append((attr.prefix, attr.namespaceURI))
+				
+		for prefix, uri in names:
+			if scope.get(prefix) == uri or (prefix is not None and uri is None):
+				continue
+			if prefix is None:
+				node.setAttributeNS(xml.dom.XMLNS_NAMESPACE, 'xmlns', uri or '')
+			else:
+				node.setAttributeNS(xml.dom.XMLNS_NAMESPACE, 'xmlns:'+prefix, uri)
+			scope[prefix] = uri
 	else:
-		for i in node.childNodes:
-			fixNamespaces(i)
+		scope = inScope
+		
+	for i in node.childNodes:
+		fixNamespaces(i, scope)
 	
 def assertEmptyNode(node):
 	"""Raises an UnexpectedNode excpetion if node has children"""
@@ -84,28 +104,159 @@ def assertEmptyNode(node):
 		raise UnexpectedNode(node.firstChild)
 		
 		
+def fileStamp(path):
+	"""Returns what tells whether a file has changed, or None if it is gone."""
+	
+	try:
+		st = os.stat(path)
+	except OSError:
+		return None
+	return (st.st_mtime, st.st_size)
+	
+	
 class DocumentProvider(object):
-	def __init__(self):
-		self.cache = {}
+	"""Loads documents by URI and keeps them to be used again.
+	
+	At most maxEntries documents of files taking at most maxBytes 
+	(None for no limit) are kept, the least recently used ones are 
+	dropped first. The memory used by a document is estimated as the 
+	size of its file. With revalidate, a document is parsed again when 
+	the modification time or size of its file has changed.
+	
+	Dropped documents and their stripped copies (see 
+	Stylesheet.strippedDocument) are unlink()ed to break their reference 
+	cycles, but only when the transformations that were running when they 
+	were dropped have ended (see acquire), as their nodes may still be in 
+	use. Documents added with addDOMDocument belong to the caller and are 
+	never unlinked."""
+	
+	def __init__(self, maxEntries=100, maxBytes=64*1024*1024, revalidate=False):
+		self.maxEntries = maxEntries
+		self.maxBytes = maxBytes
+		self.revalidate = revalidate
+		
+		# uri -> document, least recently used first
+		self.cache = collections.OrderedDict()
+		# uri -> fileStamp of the documents parsed here
+		self.stamps = {}
+		self.size = 0
+		self.evictions = 0
+		
+		# incremented for each document dropped while in use
+		self._generation = 0
+		# generation at acquire -> number of transformations not released
+		self._users = {}
+		# (generation, document) of dropped documents not unlinked yet
+		self._dropped = []
+		self._lock = threading.Lock()
 	
 	def document(self, uri, base = ''):
 		uri = self.absUri(uri, base)
 		
-		if uri not in self.cache:
-			self.cache[uri] = xml.dom.minidom.parse(uri)
-			self.cache[uri].baseUri = uri
-			
-		return self.cache[uri]
+		with self._lock:
+			doc = self.cache.get(uri)
+			if doc is not None:
+				if self.revalidate and uri in self.stamps and fileStamp(uri) != self.stamps[uri]:
+					self._drop(uri)
+				else:
+					self.cache[uri] = self.cache.pop(uri)
+					return doc
+		
+		stamp = fileStamp(uri)
+		doc = xml.dom.minidom.parse(uri)
+		doc.baseUri = uri
+		xpath.index.index_document(doc)
+		# template rules matching its nodes, see dispatch.DispatchTable.find;
+		# documents of the caller may change and get no such cache
+		doc.xslt_matches = weakref.WeakKeyDictionary()
+		
+		with self._lock:
+			if uri in self.cache and self.stamps.get(uri) == (stamp or (None, 0)):
+				# parsed by another thread meanwhile, which may be using it
+				return self.cache[uri]
+			if uri in self.cache:
+				self._drop(uri)
+			self.cache[uri] = doc
+			self.stamps[uri] = stamp or (None, 0)
+			self.size += self.stamps[uri][1]
+			self._evict()
+		return doc
+		
+	def remove(self, uri):
+		"""Forgets the document at uri, it is parsed again when it is needed."""
+		
+		with self._lock:
+			if uri in self.cache:
+				self._drop(uri)
 		
 	def addDOMDocument(self, doc):
-		uri = '#id'+hash(doc)
-		self.cache[uri] = doc
+		"""Returns a uri for a document of the caller, which is indexed 
+		when it is added. doc must not be changed while the provider 
+		keeps it, as its index and stripped copies would be stale: call 
+		remove(uri) first, it is indexed again when it is added next."""
+		
+		uri = '#id%x' % id(doc)
+		with self._lock:
+			if self.cache.get(uri) is doc:
+				self.cache[uri] = self.cache.pop(uri)
+				return uri
 		doc.baseUri = uri
+		xpath.index.index_document(doc)
+		with self._lock:
+			self.cache[uri] = doc
+			self._evict()
 		return uri
 		
+	def acquire(self):
+		"""Tells that documents of the provider are used until release 
+		is called with the returned token, so documents dropped meanwhile 
+		are not unlinked before. Documents dropped later may be unlinked 
+		while other transformations still run."""
+		
+		with self._lock:
+			generation = self._generation
+			self._users[generation] = self._users.get(generation, 0) + 1
+			return generation
+			
+	def release(self, generation):
+		with self._lock:
+			self._users[generation] -= 1
+			if not self._users[generation]:
+				del self._users[generation]
+			# documents dropped before the oldest running transformation 
+			# started are no longer used
+			oldest = min(self._users) if self._users else self._generation
+			dropped = [doc for g, doc in self._dropped if g < oldest]
+			self._dropped = [(g, doc) for g, doc in self._dropped if g >= oldest]
+		for doc in dropped:
+			doc.unlink()
+			
+	def _evict(self):
+		while len(self.cache) > 1 and (
+				(self.maxEntries is not None and len(self.cache) > self.maxEntries) or 
+				(self.maxBytes is not None and self.size > self.maxBytes)):
+			self._drop(next(iter(self.cache)))
+			self.evictions += 1
+			
+	def _drop(self, uri):
+		doc = self.cache.pop(uri)
+		dropped = doc.__dict__.pop('xslt_stripped', {}).values()
+		stamp = self.stamps.pop(uri, None)
+		if stamp is not None: # not added with addDOMDocument
+			self.size -= stamp[1]
+			dropped.append(doc)
+		if self._users:
+			self._dropped.extend((self._generation, d) for d in dropped)
+			self._generation += 1
+		else:
+			for d in dropped:
+				d.unlink()
+		
 	def absUri(self, uri, base = ''):
 		if uri == '':
 			return base
+		if uri.startswith('#id'):
+			return uri # see addDOMDocument
 			
 		base = os.path.abspath(os.path.dirname(base))
 		uri = os.path.join(base, uri)
@@ -115,22 +266,57 @@ class DocumentProvider(object):
 		return xml.dom.getDOMImplementation().createDocument(None, None, None)
 		
 		
+class VariableBinding(object):
+	"""One link of the chain of variable bindings visible to an instruction.
+	Looked up like a dict: the innermost binding of a name wins, names not
+	bound in the chain are looked up in the mapping at its end.
+	Binding a variable [XSLT 11.5] creates a link in front of the chain, 
+	so the bindings of enclosing instructions are never copied."""
+	
+	__slots__ = ('name', 'value', 'parent')
+	
+	def __init__(self, name, value, parent):
+		self.name = name
+		self.value = value
+		self.parent = parent
+		
+	def __getitem__(self, name):
+		binding = self
+		while type(binding) is VariableBinding:
+			if binding.name == name:
+				return binding.value
+			binding = binding.parent
+		return binding[name]
+		
+		
 class XSLTContext(object):
 	"""XSLT stylesheet execution context.
-	Compatible with xpath.XPathContext."""
+	Compatible with xpath.XPathContext.
+	
+	A single context is shared by all instructions of a transformation.
+	An instruction changes the fields it needs (the current node list, 
+	result, variables...) and restores them when it is done, see 
+	Element.instantiate, focus and restoreFocus. Variables are chains of
+	VariableBinding ending with a dict."""
 	
-	functions = xpath.functions.xpath_functions
+	__slots__ = ('_stylesheet', 'toplevelContext', 'keyTables', 'messages', 
+		'fallback', 'cause', 'params', 'baseUri', 'namespaces', 'variables', 
+		'globals', '_nodeSet', 'node', 'pos', 'size', 'result', 'resultDocument')
+	
+	# XPath core functions with XSLT additions and overrides.
+	# Copied so that plain XPath evaluation keeps the core functions.
+	functions = dict(xpath.functions.xpath_functions)
 	functions.update(xslt.functions.xpath_functions)
 	
-	def __init__(self, stylesheet, parent=None):
+	def __init__(self, stylesheet):
 		# stylesheet applyed (root of import tree)
 		self._stylesheet = stylesheet
-		self._parent = parent
 		
 		# for attr-sets and apply-imports
 		self.toplevelContext = self
 		
-		self.matches = {}
+		# (key name, document) -> key table, see elements.Key
+		self.keyTables = {}
 		self.messages = []
 		self.fallback = False
 		
@@ -140,34 +326,38 @@ class XSLTContext(object):
 		
 		self.baseUri = ''
 		self.namespaces = {}
-		self.variables = {}
-		self._pos = 0
-		self._nodeSet = [None]
+		# bindings of global variables and of the current instruction
+		self.globals = {}
+		self.variables = self.globals
 		
+		self.nodeset = [None]
+		# a result.ResultBuilder
 		self.result = None
+		# the document result tree fragments are created in
+		self.resultDocument = None
 		
 	@property
 	def stylesheet(self):
 		return self._stylesheet
 		
-	@property
-	def parent(self):
-		return self._parent
-		
 	def copy(self):
-		ctx = type(self)(self.stylesheet, self)
-		ctx.__dict__.update(self.__dict__)
-		ctx._parent = self
-		ctx.variables = self.variables.copy()
+		"""Returns an independent context with the same state
+		sharing the transformation-wide data with this one."""
+		
+		ctx = object.__new__(type(self))
+		for name in XSLTContext.__slots__:
+			setattr(ctx, name, getattr(self, name))
 		return ctx
 	
 	def __iter__(self):
-		for self._pos in range(self.size):
-			yield self.node
+		"""Makes each node of the current node list current in turn."""
 		
-	@property
-	def resultDocument(self):
-		return self.result.ownerDocument
+		pos = 0
+		for node in self._nodeSet:
+			pos += 1
+			self.node = node
+			self.pos = pos
+			yield node
 		
 	@property
 	def nodeset(self):
@@ -176,22 +366,21 @@ class XSLTContext(object):
 	@nodeset.setter
 	def nodeset(self, newList):
 		self._nodeSet = newList
-		self._pos = 0
+		self.node = newList[0] if newList else None
+		self.pos = 1
+		self.size = len(newList)
 		
-	@property
-	def node(self):
-		return self.nodeset[self._pos]
+	def focus(self):
+		"""Returns the current node list, node, position and size
+		to be passed to restoreFocus."""
 		
-	@property
-	def size(self):
-		return len(self.nodeset)
+		return (self._nodeSet, self.node, self.pos, self.size)
 		
-	@property
-	def pos(self):
-		return self._pos
+	def restoreFocus(self, focus):
+		self._nodeSet, self.node, self.pos, self.size = focus
 		
 	def pushResult(self, value):
-		tools.pushResult(value, self.result)
+		self.result.push(value)
 		return value
 		
 
@@ -202,7 +391,8 @@ class TemplateContent(object):
 
 	allowedElements = [ 'apply-templates', 'call-template', 'apply-imports',
 		'for-each', 'value-of', 'copy-of', 'number', 'choose', 'if', 'text',
-		'copy', 'variable', 'message', 'fallback' ]
+		'copy', 'variable', 'message', 'fallback', 'element', 'attribute',
+		'comment', 'processing-instruction' ]
 
 	def __init__(self, nodeList=None, stylesheet=None, options=None):
 		"""If nodeList is not None initializes children list with Elements
@@ -315,10 +505,19 @@ class Element(object):
 		
 	
 	def instantiate(self, context):
-		subContext = context.copy()
-		subContext.namespaces = self.namespaces
-		subContext.baseUri =  self.baseUri
-		r = self.instantiateImpl(subContext)
+		"""Instantiates the element in context. Returns what instantiateImpl returns.
+		Namespaces, base URI, result and variables are restored afterwards, 
+		so instantiateImpl may change them freely. Elements changing other 
+		context fields restore them themselves."""
+		
+		namespaces, baseUri = context.namespaces, context.baseUri
+		result, variables = context.result, context.variables
+		context.namespaces = self.namespaces
+		context.baseUri = self.baseUri
+		r = self.instantiateImpl(context)
+		context.namespaces, context.baseUri = namespaces, baseUri
+		context.result, context.variables = result, variables
+		return r
 		
 	def instantiateImpl(self, context):
 		"""Override in subclass to control what 
@@ -0,0 +1,306 @@
+import xml.dom
+from xml.dom import Node
+import xpath.expr as X
+import xpath.optimizer
+
+
+class DispatchTable(object):
+	"""Selects the template rule for a node [XSLT 5.5].
+
+	Patterns are compiled to matchers testing a single node: the last step
+	of a pattern is checked against the node, the steps before it against
+	its ancestors (right to left). Matchers are put into buckets by the
+	kind and name of nodes they may match, so that only the patterns that
+	can match a node are tried.
+
+	Import precedence is handled by the stylesheet: a table holds the
+	template rules of one stylesheet for one mode.
+
+	Results are remembered for documents parsed by a DocumentProvider,
+	in their xslt_matches attribute (keyed by the table, weakly, and by
+	the node objects), so transforming the same cached document again
+	with the same stylesheet does no pattern matching. Such documents
+	are assumed not to change between transformations; DOM documents
+	of the caller are always matched again."""
+
+	def __init__(self, patterns):
+		"""patterns is a list of (xp.Pattern, template, priority) sorted
+		by ascending priority and document order."""
+
+		self.buckets = {}
+		# whether a match only depends on the node and the stylesheet
+		self.cacheable = True
+		for index, (pattern, template, priority) in enumerate(patterns):
+			bucket, matcher = compilePattern(pattern, template.namespaces)
+			self.buckets.setdefault(bucket, []).append((index, matcher, template))
+			if bucket == 'any' or referencesVariables(pattern.expr):
+				self.cacheable = False
+
+		# (node type, namespace uri, node name) -> candidates for such nodes
+		self._candidates = {}
+
+
+	def find(self, node, context):
+		"""Returns the template rule matching node or None.
+		context.node must be node."""
+
+		if not self.cacheable:
+			return self.match(node, context)
+
+		doc = node if node.nodeType == Node.DOCUMENT_NODE else node.ownerDocument
+		tables = getattr(doc, 'xslt_matches', None)
+		if tables is None:
+			return self.match(node, context)
+		try:
+			matches = tables[self]
+		except KeyError:
+			matches = tables[self] = {}
+
+		try:
+			return matches[node]
+		except KeyError:
+			template = matches[node] = self.match(node, context)
+			return template
+
+
+	def match(self, node, context):
+		"""Tries the patterns which may match node in order of preference."""
+
+		nodeType = node.nodeType
+		if nodeType == Node.PROCESSING_INSTRUCTION_NODE:
+			handle = (nodeType, None, node.target)
+		else:
+			handle = (nodeType, node.namespaceURI, node.nodeName)
+
+		try:
+			candidates = self._candidates[handle]
+		except KeyError:
+			candidates = self._candidates[handle] = self.candidates(node)
+
+		for matcher, template in candidates:
+			if matcher(node, context):
+				return template
+		return None
+
+
+	def candidates(self, node):
+		"""Returns a list of (matcher, template) for all patterns that may
+		match nodes like node, most preferable first: by descending priority,
+		then the last rule in the stylesheet."""
+
+		nodeType = node.nodeType
+		if nodeType == Node.ELEMENT_NODE or nodeType == Node.ATTRIBUTE_NODE:
+			ns = node.namespaceURI
+			keys = [(nodeType, ns, node.localName), (nodeType, ns, '*'), (nodeType, '*', '*')]
+		elif nodeType == Node.PROCESSING_INSTRUCTION_NODE:
+			keys = [(nodeType, node.target), (nodeType, '*')]
+		elif nodeType == Node.CDATA_SECTION_NODE:
+			keys = []
+		else:
+			keys = [(nodeType,)]
+
+		if nodeType != Node.ATTRIBUTE_NODE and nodeType != Node.DOCUMENT_NODE:
+			keys.append('child')
+		keys.append('any')
+
+		entries = []
+		for key in keys:
+			entries.extend(self.buckets.get(key, []))
+		entries.sort(reverse=True)
+		return [(matcher, template) for (index, matcher, template) in entries]
+
+
+def compilePattern(pattern, namespaces):
+	"""Compiles an xp.Pattern into (bucket, matcher).
+	matcher(node, context) returns True if pattern matches node.
+	namespaces are the namespace bindings of the template."""
+
+	expr = pattern.expr
+	if type(expr) is X.AbsolutePathExpr:
+		if expr.path is None:
+			return (Node.DOCUMENT_NODE,), lambda node, context: True
+
+		steps = None
+		if type(expr.path) is X.PathExpr:
+			steps = [analyzeStep(s, namespaces) for s in expr.path.steps]
+		if steps and None not in steps:
+			matcher = chainSteps(steps, len(steps) - 1)
+			if any(s[4] for s in steps):
+				matcher = withNamespaces(matcher, namespaces)
+			return steps[-1][2], matcher
+
+	# id() and key() patterns: select the nodes and look for node among them
+	def matcher(node, context):
+		return node in pattern.nodes(context)
+	return 'any', withNamespaces(matcher, namespaces)
+
+
+def referencesVariables(expr):
+	"""Returns True if expr refers to a variable or the current node."""
+
+	if isinstance(expr, X.VariableReference):
+		return True
+	if isinstance(expr, X.Function) and expr.name == 'current':
+		return True
+	children = []
+	for name in ('left', 'right', 'expr', 'path'):
+		child = getattr(expr, name, None)
+		if isinstance(child, X.Expr):
+			children.append(child)
+	for name in ('args', 'steps', 'predicates'):
+		children.extend(getattr(expr, name, None) or [])
+	return any(referencesVariables(x) for x in children)
+
+
+def withNamespaces(matcher, namespaces):
+	"""Evaluates matcher with template namespaces in the context."""
+
+	def match(node, context):
+		saved = context.namespaces
+		context.namespaces = namespaces
+		try:
+			return matcher(node, context)
+		finally:
+			context.namespaces = saved
+	return match
+
+
+def analyzeStep(step, namespaces):
+	"""Returns (kind, axis name, bucket, check, hasPredicates) for a pattern
+	step or None if the step can not be matched right to left.
+	check(node, context) tests the node test and predicates of the step."""
+
+	predicates = []
+	if type(step) is X.PredicateList:
+		predicates = step.predicates
+		select = step.compiled()
+		step = step.expr
+	if type(step) is not X.AxisStep:
+		return None
+
+	axis = step.axis.__name__
+	if axis == 'descendant-or-self' and type(step.test) is X.AnyKindTest and not predicates:
+		return ('gap', axis, 'any', None, False)
+	if axis not in ('child', 'attribute', 'descendant'):
+		return None
+
+	bucket, test = compileTest(step.test, step.axis, namespaces)
+	if bucket is None:
+		return None
+	if not predicates:
+		return ('step', axis, bucket, test, False)
+
+	if any(xpath.optimizer.is_positional(p) for p in predicates):
+		# the position depends on the siblings: select them from the parent
+		def check(node, context):
+			if not test(node, context):
+				return False
+			parent = parentNode(node)
+			return parent is not None and node in select(parent, 1, 1, context)
+	else:
+		preds = [p.compiled() for p in predicates]
+		boolean = X.converter('boolean')
+		def check(node, context):
+			if not test(node, context):
+				return False
+			for pred in preds:
+				if not boolean(pred(node, 1, 1, context), node, 1, 1, context):
+					return False
+			return True
+	return ('step', axis, bucket, check, True)
+
+
+def compileTest(test, axis, namespaces):
+	"""Returns (bucket, test) for a node test along axis, where
+	test(node, context) checks the node test. Returns (None, None) if
+	the test can not be resolved statically."""
+
+	if type(test) is X.NameTest:
+		nodeType = axis.principal_node_type
+		if test.prefix == '*':
+			ns = '*'
+		elif test.prefix is not None:
+			if test.prefix not in namespaces:
+				return None, None
+			ns = namespaces[test.prefix]
+		elif nodeType == Node.ELEMENT_NODE:
+			ns = namespaces.get(None)
+		else:
+			ns = None
+		localName = test.localName
+
+		if ns == '*':
+			return (nodeType, '*', '*'), lambda node, context: node.nodeType == nodeType
+		if localName == '*':
+			return (nodeType, ns, '*'), lambda node, context: \
+				node.nodeType == nodeType and node.namespaceURI == ns
+		# localName of minidom nodes is a property splitting nodeName
+		return (nodeType, ns, localName), lambda node, context: \
+			node.nodeType == nodeType and node.namespaceURI == ns and \
+			(node.nodeName == localName or node.localName == localName)
+
+	if type(test) is X.AnyKindTest:
+		if axis.principal_node_type == Node.ATTRIBUTE_NODE:
+			return (Node.ATTRIBUTE_NODE, '*', '*'), lambda node, context: \
+				node.nodeType == Node.ATTRIBUTE_NODE
+		return 'child', lambda node, context: \
+			node.nodeType != Node.ATTRIBUTE_NODE and node.nodeType != Node.DOCUMENT_NODE
+
+	if type(test) is X.TextTest:
+		return (Node.TEXT_NODE,), lambda node, context: node.nodeType == Node.TEXT_NODE
+	if type(test) is X.CommentTest:
+		return (Node.COMMENT_NODE,), lambda node, context: node.nodeType == Node.COMMENT_NODE
+	if type(test) is X.PITest:
+		nodeType = Node.PROCESSING_INSTRUCTION_NODE
+		if test.name is None:
+			return (nodeType, '*'), lambda node, context: node.nodeType == nodeType
+		name = test.name
+		return (nodeType, name), lambda node, context: \
+			node.nodeType == nodeType and node.target == name
+
+	return None, None
+
+
+def parentNode(node):
+	if node.nodeType == Node.ATTRIBUTE_NODE:
+		return node.ownerElement
+	return node.parentNode
+
+
+def chainSteps(steps, i):
+	"""Returns a matcher for nodes selected by steps[0..i] from the root."""
+
+	if i < 0:
+		return lambda node, context: node.nodeType == Node.DOCUMENT_NODE
+
+	previous = chainSteps(steps, i - 1)
+	kind, axis, bucket, check, hasPredicates = steps[i]
+
+	if kind == 'gap':
+		# descendant-or-self::node(): any ancestor-or-self
+		def match(node, context):
+			while node is not None:
+				if previous(node, context):
+					return True
+				node = node.parentNode
+			return False
+
+	elif axis == 'descendant':
+		def match(node, context):
+			if not check(node, context):
+				return False
+			node = node.parentNode
+			while node is not None:
+				if previous(node, context):
+					return True
+				node = node.parentNode
+			return False
+
+	else:
+		def match(node, context):
+			if not check(node, context):
+				return False
+			parent = parentNode(node)
+			return parent is not None and previous(parent, context)
+
+	return match
@@ -1,8 +1,8 @@
 import tools, properties
 import xp
-from StringIO import StringIO
 from properties import *
 from core import *
+from result import DOMBuilder, TextBuilder
 
 		
 class LiteralText(Element):
@@ -16,7 +16,7 @@ class LiteralText(Element):
 	
 	
 	def instantiate(self, context):
-		context.pushResult(self.text)
+		context.result.text(self.text)
 		
 		
 class LiteralElement(Element):
@@ -37,7 +37,7 @@ class LiteralElement(Element):
 		if (stringProperty(element, (XSLT_NAMESPACE, 'version')) == '1.0'):
 			options['forwardsCompatible'] = False
 		
-		self.attrs = {}
+		self.attrs = []
 		for i in range(element.attributes.length):
 			attr = element.attributes.item(i)
 			
@@ -52,27 +52,28 @@ class LiteralElement(Element):
 				if nsUri in options['excludeResultNS']:
 					continue
 			
-			self.attrs[(attr.prefix, attr.localName, attr.namespaceURI)] = xp.AttributeTemplate(attr.value)
+			self.attrs.append(((attr.prefix, attr.localName, attr.namespaceURI), xp.AttributeTemplate(attr.value)))
 			
 		self.setContent(element.childNodes, stylesheet, options)
 			
 			
 	def instantiateImpl(self, context):
 		ss = context.stylesheet
-		e = context.resultDocument.createElementNS(ss.getNamespaceAlias(self.ns), tools.formatQName(self.name))
+		result = context.result
+		result.startElement(ss.getNamespaceAlias(self.ns), tools.formatQName(self.name))
 		
 		for attrSet in self.useSets:
 			ss.instantiateAttributeSet(context, attrSet)
 			
-		for (k, v) in self.attrs.iteritems():
+		for (k, v) in self.attrs:
 			if k[2] == xml.dom.XMLNS_NAMESPACE:
-				e.setAttributeNS(k[2], 'xmlns:%s'%k[1], ss.getNamespaceAlias(v.value(context)))
+				name = 'xmlns' if k[0] is None else 'xmlns:%s'%k[1]
+				result.attribute(k[2], name, ss.getNamespaceAlias(v.value(context)))
 			else:
-				e.setAttributeNS(ss.getNamespaceAlias(k[2]), tools.formatQName(k[0:2]), v.value(context))
+				result.attribute(ss.getNamespaceAlias(k[2]), tools.formatQName(k[0:2]), v.value(context))
 				
-		context.pushResult(e)
-		context.result = e
 		self.instantiateContent(context)
+		result.endElement()
 		
 		
 class PerformFallback(Element):
@@ -84,8 +85,10 @@ class PerformFallback(Element):
 		self.setContent(fallbacks, stylesheet, options)
 			
 	def instantiateImpl(self, context):
+		fallback = context.fallback
 		context.fallback = True
 		self.instantiateContent(context)
+		context.fallback = fallback
 		
 		
 class Output(Element):
@@ -99,7 +102,7 @@ class Output(Element):
 			output['method'] = qnameProperty(node, 'method', \
 				namespaces=options['namespaces'], resolveDefault=False)
 		if node.hasAttribute('indent'): 
-			output['indent'] = boolsProperty(node, 'indent')
+			output['indent'] = boolProperty(node, 'indent')
 		if node.hasAttribute('encoding'): 
 			output['encoding'] = stringProperty(node, 'encoding')
 		if node.hasAttribute('version'): 
@@ -177,12 +180,12 @@ class AttributeSet(Element):
 		
 		
 	def instantiateImpl(self, context):
-		context.variables = context.toplevelContext.variables.copy()
+		context.variables = context.globals
 		
 		for attrSet in self.useSets:
 			context.stylesheet.instantiateAttributeSet(context, attrSet)
 			
-		for a in self.attributes:
+		for a in self.attributes.itervalues():
 			a.instantiate(context)
 			
 			
@@ -194,25 +197,62 @@ class Key(Element):
 		self.name = qnameProperty(node, 'name', required=True,
 				namespaces=options['namespaces'], resolveDefault=False)
 		match = patternProperty(node, 'match', required=True)
-		use = exprProperty(node, 'user', required=True)
-		self.keys = (match, use)
+		use = exprProperty(node, 'use', required=True)
+		# all xsl:key elements with this name as (match, use, namespaces)
+		self.keys = [(match, use, self.namespaces)]
 		
 		
 	def update(self, key):
 		self.keys.extend(key.keys)
 		
 		
-	def select(self, context, value):
-		subContext = context.toplevelContext.copy()
-		nodes = []
-		for key in self.keys:
-			cands = key[0].nodes(subContext)
-			for cand in cands:
+	def table(self, context, doc):
+		"""Returns a dict mapping use values to lists of doc nodes in document order.
+		The table is built on first use and kept for the rest of the transformation."""
+		
+		tables = context.toplevelContext.keyTables
+		handle = (self.name, doc)
+		if handle in tables:
+			return tables[handle]
+			
+		table = {}
+		subContext = context.copy()
+		subContext.variables = context.globals
+		for (match, use, namespaces) in self.keys:
+			subContext.namespaces = namespaces
+			subContext.nodeset = [doc]
+			for cand in match.nodes(subContext):
 				subContext.nodeset = [cand]
-				if key[1].findString(subContext) == xpath.tools.string(value, context):
-					nodes.append(cand)
+				value = use.find(subContext)
+				if xpath.tools.nodesetp(value):
+					values = set(xpath.tools.string_value(x) for x in value)
+				else:
+					values = [xpath.tools.string(value, subContext)]
+				for v in values:
+					table.setdefault(v, []).append(cand)
+					
+		# several xsl:key elements may add the same node out of order
+		if len(self.keys) > 1:
+			for v in table:
+				table[v] = xpath.expr.ordered_nodeset(table[v])
+				
+		tables[handle] = table
+		return table
+		
+		
+	def select(self, context, node, value):
+		"""Returns nodes of the document of node, the context node of key(),
+		having value as the key value [XSLT 12.2].
+		If value is a node-set, returns the union of nodes for string-values of its nodes."""
 		
-		return nodes
+		doc = node if node.nodeType == xml.dom.Node.DOCUMENT_NODE else node.ownerDocument
+		table = self.table(context, doc)
+		
+		if xpath.tools.nodesetp(value):
+			values = set(xpath.tools.string_value(x) for x in value)
+			return xpath.expr.merge_nodesets([table.get(v, []) for v in values])
+		
+		return xpath.tools.OrderedNodeSet(table.get(xpath.tools.string(value, context), []))
 		
 		
 class Template(Element):
@@ -240,7 +280,7 @@ class Template(Element):
 		
 		
 	def instantiateImpl(self, context):
-		context.variables = context.toplevelContext.variables.copy()
+		context.variables = context.globals
 		
 		for param in self.params:
 			param.instantiate(context)
@@ -269,15 +309,24 @@ class Variable(Element):
 		options['definedVars'].append(self.name)
 		
 		
+	def instantiate(self, context):
+		"""Binds the variable for following siblings and their descendants."""
+		
+		value = super(Variable, self).instantiate(context)
+		context.variables = VariableBinding(self.name, value, context.variables)
+		
+		
 	def instantiateImpl(self, context):
+		"""Returns the value of the variable."""
+		
 		if self.select:
-			context.parent.variables[self.name] = self.select.find(context)
+			return self.select.find(context)
 		else:
 			varTree = context.resultDocument.createDocumentFragment()
 			varTree.xslt_baseUri = self.baseUri
-			context.parent.variables[self.name] = varTree
-			context.result = varTree
+			context.result = DOMBuilder(varTree)
 			self.instantiateContent(context)
+			return varTree
 			
 		
 class Param(Variable):
@@ -285,9 +334,9 @@ class Param(Variable):
 	
 	def instantiateImpl(self, context):
 		if self.name in context.params:
-			context.parent.variables[self.name] = context.params[self.name]
+			return context.params[self.name]
 		else:
-			super(Param, self).instantiateImpl(context)
+			return super(Param, self).instantiateImpl(context)
 			
 			
 class WithParam(Element):
@@ -310,7 +359,7 @@ class WithParam(Element):
 			varTree = context.resultDocument.createDocumentFragment()
 			varTree.xslt_baseUri = self.baseUri
 			context.params[self.name] = varTree
-			context.result = varTree
+			context.result = DOMBuilder(varTree)
 			self.instantiateContent(context)
 		
 		
@@ -358,7 +407,8 @@ class Sort(object):
 				if r != 0:
 					return r
 		if sortList:
-			context.nodeset.sort(compare)
+			# the node-set may be the value of a variable, do not sort it in place
+			context.nodeset = sorted(context.nodeset, compare)
 		
 class ApplyTemplates(Element):
 	name = 'apply-templates'
@@ -378,12 +428,16 @@ class ApplyTemplates(Element):
 		
 		
 	def instantiateImpl(self, context):
-		context.nodeset = self.select.findNodeset(context)
-		Sort.sort(context, self.sorts)
+		focus, cause, params = context.focus(), context.cause, context.params
+		# parameters are evaluated with the current node of apply-templates
 		context.params = {}
 		for i in self.params:
 			i.instantiate(context)
+		context.nodeset = self.select.findNodeset(context)
+		Sort.sort(context, self.sorts)
 		context.stylesheet.applyTemplates(context, self.mode)
+		context.restoreFocus(focus)
+		context.cause, context.params = cause, params
 			
 			
 class CallTemplate(Element):
@@ -395,10 +449,12 @@ class CallTemplate(Element):
 		self.params = [WithParam(i, stylesheet, options) for i in children]
 		
 	def instantiateImpl(self, context):
+		cause, params = context.cause, context.params
 		context.params = {}
 		for i in self.params:
 			i.instantiate(context)
 		context.stylesheet.callTemplate(context, self.name)
+		context.cause, context.params = cause, params
 
 		
 class ForEach(Element):
@@ -411,11 +467,17 @@ class ForEach(Element):
 		self.setContent(content, stylesheet, options)
 			
 	def instantiateImpl(self, context):
+		focus, cause = context.focus(), context.cause
 		context.nodeset = self.select.findNodeset(context)
 		context.cause = (None, None)
 		Sort.sort(context, self.sorts)
+		variables = context.variables
 		for node in context:
 			self.instantiateContent(context)
+			# drop variables bound by the content
+			context.variables = variables
+		context.restoreFocus(focus)
+		context.cause = cause
 			
 	
 class Comment(Element):
@@ -425,10 +487,10 @@ class Comment(Element):
 		self.setContent(element.childNodes, stylesheet, options)
 		
 	def instantiateImpl(self, context):
-		comment = resultDocument.createComment(text)
-		context.pushResult(comment)
-		context.result = comment
+		result = context.result
+		context.result = TextBuilder()
 		self.instantiateContent(context)
+		result.comment(context.result.getvalue())
 		
 		
 class Copy(Element):
@@ -441,22 +503,23 @@ class Copy(Element):
 	
 	
 	def instantiateImpl(self, context):
-		r = context.resultDocument.importNode(context.node, False)
-		if r.nodeType == xml.dom.Node.ELEMENT_NODE:
-			# don't copy attrs except xmlns
-			for i in reversed(range(r.attributes.length)):
-				attr = r.attributes.item(i)
+		node = context.node
+		result = context.result
+		if node.nodeType == xml.dom.Node.ELEMENT_NODE:
+			result.startElement(node.namespaceURI, node.nodeName)
+			# copy namespace declarations but not attributes [XSLT 7.5]
+			for i in range(node.attributes.length):
+				attr = node.attributes.item(i)
 				if attr.namespaceURI == xml.dom.XMLNS_NAMESPACE:
-					if attr.value in options['excludeResultNS']:
-						r.removeAttributeNode(attr)
-				if attr.namespaceURI != xml.dom.XMLNS_NAMESPACE:
-					r.removeAttributeNode(attr)
-					
-		context.pushResult(r)
-		context.result = r
-		
-		for s in useSets:
-			context.stylesheet.instantiateAttributeSet(context, s)
+					result.attribute(attr.namespaceURI, attr.name, attr.value)
+			for s in self.useSets:
+				context.stylesheet.instantiateAttributeSet(context, s)
+			self.instantiateContent(context)
+			result.endElement()
+		elif node.nodeType == xml.dom.Node.DOCUMENT_NODE:
+			self.instantiateContent(context)
+		else:
+			result.node(node)
 			
 			
 class CopyOf(Element):
@@ -470,10 +533,11 @@ class CopyOf(Element):
 	def instantiateImpl(self, context):
 		value = self.select.find(context)
 		
-		if not xpath.expr.nodesetp(value):
-			value = xpath.expr.string(value)
-			
-		context.pushResult(value)
+		if xpath.expr.nodesetp(value):
+			for node in value:
+				context.result.node(node)
+		else:
+			context.result.text(xpath.tools.string(value, context))
 		
 		
 class ValueOf(Element):
@@ -486,9 +550,7 @@ class ValueOf(Element):
 		
 	def instantiateImpl(self, context):
 		value = self.select.findString(context)
-		text = context.resultDocument.createTextNode(value)
-		text.xslt_disableOutputExcaping = self.disableOutputExcaping
-		context.pushResult(text)
+		context.result.text(value, self.disableOutputExcaping)
 		
 		
 class ApplyImports(Element):
@@ -568,11 +630,10 @@ class Text(Element):
 		self.setContent(element.childNodes, stylesheet, options)
 		
 	def instantiateImpl(self, context):
-		r = context.resultDocument.createTextNode('')
-		r.xslt_disableOutputExcaping = self.disableOutputExcaping
-		context.pushResult(r)
-		context.result = r
+		result = context.result
+		context.result = TextBuilder()
 		self.instantiateContent(context)
+		result.text(context.result.getvalue(), self.disableOutputExcaping)
 		
 		
 class Message(Element):
@@ -583,7 +644,7 @@ class Message(Element):
 		self.setContent(element.childNodes, stylesheet, options)
 		
 	def instantiateImpl(self, context):
-		context.result = StringIO()
+		context.result = TextBuilder()
 		self.instantiateContent(context)
 		context.toplevelContext.messages.append(context.result.getvalue())
 		if self.terminate:
@@ -605,16 +666,16 @@ class ProcessingInstruction(Element):
 	name = 'processing-instruction'
 	
 	def initImpl(self, element, stylesheet, options):
-		self.name = stringProperty(element, 'name')
+		self.name = attributeTemplateProperty(element, 'name', required=True)
 		self.setContent(element.childNodes, stylesheet, options)
 		# TODO: check name is NCName and PITarget
 		
 		
 	def instantiateImpl(self, context):
-		context.result = StringIO()
+		result = context.result
+		context.result = TextBuilder()
 		self.instantiateContent(context)
-		pi = context.resultDocument.createProcessingInstruction(self.name.value(context), context.result.getvalue())
-		context.pushResult(pi)
+		result.processingInstruction(self.name.value(context), context.result.getvalue())
 		
 class ElementTemplate(Element):
 	name = 'element'
@@ -629,21 +690,19 @@ class ElementTemplate(Element):
   
 	def instantiateImpl(self, context):
 		name = parseQName(self.name.value(context))
-		if namespace is None:
-			namespace = resolveQName(name, namespaces=context.namespaces, resolveDefault=True)[0]
+		if self.namespace is None:
+			namespace = resolveNamespace(name[0], context.namespaces, resolveDefault=True)
 		else:
-			namespace = self.namespace.value(context)
-			if namespace == '':
-				namespace = None
+			namespace = self.namespace.value(context) or None
 
-		e = context.resultDocument.createElementNS(namespace, formatQName(name))
-		context.pushResult(e)
-		context.result = e
+		result = context.result
+		result.startElement(namespace, tools.formatQName(name))
 		
 		for attrSet in self.useSets: 
 			context.stylesheet.instantiateAttributeSet(context, attrSet)
 			
 		self.instantiateContent(context)
+		result.endElement()
 		
 class Attribute(Element):
 	name = 'attribute'
@@ -654,15 +713,13 @@ class Attribute(Element):
 		
 	def instantiateImpl(self, context):
 		name = parseQName(self.name.value(context))
-		if namespace is None:
-			namespace = resolveQName(name, namespaces=context.namespaces, resolveDefault=True)[0]
+		if self.namespace is None:
+			namespace = resolveNamespace(name[0], context.namespaces)
 		else:
-			namespace = self.namespace.value(context)
-			if namespace == '':
-				namespace = None
+			namespace = self.namespace.value(context) or None
 		
-		e = context.resultDocument.createAttribute(namespace, formatQName(name))
-		context.pushResult(e)
-		context.result = e
+		result = context.result
+		context.result = TextBuilder()
 		self.instantiateContent(context)
+		result.attribute(namespace, tools.formatQName(name), context.result.getvalue())
 		
\ No newline at end of file
@@ -26,6 +26,12 @@ class InvalidContent(RuntimeError):
 	def __unicode__(self):
 		return u"%s(%s)" % (type(self).__name__, unicode(self.content))
 	
+class UnencodableContent(InvalidContent):
+	"""Raised when a comment or a processing instruction has characters 
+	the output encoding can not represent, they can not be written as 
+	character references there."""
+	pass
+	
 class UnexpectedAttribute(RuntimeError):
 	"""Raised if an attribute is generated after some content 
 	was generated."""
@@ -108,6 +114,30 @@ class NotFound(RuntimeError):
 		return u'NotFound(%s, %s)' % (self.type, self.name)
 		
 		
+class Cancelled(RuntimeError):
+	"""Raised in a transformation whose output is not read any more."""
+	pass
+	
+	
+class TransformFailed(RuntimeError):
+	"""Describes an error raised while transforming one of the documents
+	of XSLTProcessor.transformMany: errors raised in worker processes 
+	can not be passed back as they are."""
+	
+	def __init__(self, uri, type, message):
+		# args are what is pickled to pass the error between processes
+		RuntimeError.__init__(self, uri, type, message)
+		self.uri = uri
+		self.type = type
+		self.message = message
+		
+	def __unicode__(self):
+		return u'TransformFailed(%s, %s: %s)' % (self.uri, self.type, self.message)
+		
+	def __str__(self):
+		return unicode(self).encode('utf-8')
+		
+		
 class Terminate(RuntimeError):
 	"""Raised when xsl:message caused terminate."""
 	
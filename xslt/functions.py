@@ -6,7 +6,8 @@ import xml.dom
 
 @function(0, 0)
 def f_current(node, pos, size, context):
-	return [node]
+	# the current node, not the context node of the expression [XSLT 12.4]
+	return xpath.tools.OrderedNodeSet([context.node])
 	
 @function(0, 1, implicit=True, first=True)
 def f_generate_id(node, pos, size, context, v):
@@ -30,7 +31,7 @@ def f_system_property(node, pos, size, context, s):
 def f_unparsed_entity_uri(node, pos, size, context, s):
 	return ''
 	
-@function(0, 1, implicit=True)
+@function(0, 1, implicit=True, lazy=True)
 def f_string(node, pos, size, context, v):
 	if (isinstance(v, xml.dom.Node) and
 			v.nodeType == xml.dom.Node.DOCUMENT_FRAGMENT_NODE):
@@ -38,14 +39,14 @@ def f_string(node, pos, size, context, v):
 	else:
 		return xpath.functions.f_string(node, pos, size, context, v)
 		
-@function(0, 1, implicit=True)
+@function(0, 1, implicit=True, lazy=True)
 def f_number(node, pos, size, context, v):
 	if (isinstance(v, xml.dom.Node) and
 			v.nodeType == xml.dom.Node.DOCUMENT_FRAGMENT_NODE):
 		v = xpath.tools.string(v, context)
 	return xpath.functions.f_number(node, pos, size, context, v)
 
-@function(0, 1, implicit=True)
+@function(0, 1, implicit=True, aggregate=True)
 def f_boolean(node, pos, size, context, v):
 	if (isinstance(v, xml.dom.Node) and
 			v.nodeType == xml.dom.Node.DOCUMENT_FRAGMENT_NODE):
@@ -76,8 +77,10 @@ def f_document(node, pos, size, context, obj, nodeset = None):
 		else:
 			baseUri = '' # wow!?
 			
-	uri = xpath.tools.string(object, context)
-	return [context.stylesheet.dp.document(uri, baseUri)]
+	uri = xpath.tools.string(obj, context)
+	doc = context.stylesheet.dp.document(uri, baseUri)
+	# whitespace is stripped from every source document [XSLT 3.4]
+	return [context.stylesheet.strippedDocument(doc)]
 	
 
 @function(1, 1, convert='string')
@@ -100,13 +103,6 @@ def f_function_available(node, pos, size, context, name):
 @function(2, 2)
 def f_key(node, pos, size, context, name, obj):
 	name = xpath.tools.string(name, context)
-	
-	if xpath.tools.nodesetp(obj):
-		r = []
-		for x in obj:
-			r += f_key(node, pos, size, context, name, x)
-		return r
-		
 	name = properties.resolveQName(name, namespaces=context.namespaces)
-	return context.stylesheet.keys[name].select(context, obj)
+	return context.stylesheet.keys[name].select(context, node, obj)
 	
\ No newline at end of file
@@ -0,0 +1,124 @@
+import threading
+import collections
+import core
+from core import fileStamp
+from stylesheet import Stylesheet
+
+
+class StylesheetRegistry(object):
+	"""Compiled stylesheets shared by URI, e.g. by all processors
+	of a process (see defaultRegistry).
+
+	A stylesheet is compiled again when the modification time or size
+	of any file of its import/include tree has changed. The least
+	recently used stylesheets are dropped when there are more than
+	maxEntries of them or when their size is over maxBytes; the size
+	of a stylesheet is estimated as the total size of its source files.
+
+	Shared stylesheets load documents with the document provider of
+	the registry. With a cache.StylesheetCache, stylesheets which are
+	not in the registry are loaded from it instead of being compiled."""
+
+	def __init__(self, maxEntries=100, maxBytes=None, dp=core.DocumentProvider(), cache=None):
+		self.maxEntries = maxEntries
+		self.maxBytes = maxBytes
+		self.dp = dp
+		self.cache = cache
+
+		# uri -> (stylesheet, [(file, stamp)], size), least recently used first
+		self.entries = collections.OrderedDict()
+		self.size = 0
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		self.lock = threading.Lock()
+
+
+	def stylesheet(self, uri):
+		"""Returns the compiled stylesheet at uri."""
+
+		uri = self.dp.absUri(uri)
+		known = [uri]
+		with self.lock:
+			entry = self.entries.pop(uri, None)
+			if entry is not None:
+				if all(fileStamp(f) == stamp for f, stamp in entry[1]):
+					self.entries[uri] = entry
+					self.hits += 1
+					return entry[0]
+				self.size -= entry[2]
+				for f, stamp in entry[1]:
+					self.dp.remove(f)
+					known.append(f)
+			self.misses += 1
+
+		# stamps are read before compiling, so that a file changed meanwhile
+		# is compiled again next time
+		before = dict((f, fileStamp(f)) for f in known)
+
+		# compiled without the lock, the same stylesheet may be compiled
+		# twice concurrently but other stylesheets are not held up
+		if self.cache is not None:
+			stylesheet = self.cache.stylesheet(uri, self.dp)
+		else:
+			stylesheet = Stylesheet(uri, dp=self.dp)
+		stamps = [(f, self.compiledStamp(f, before)) for f in stylesheet.dependencies()]
+		size = sum(stamp[1] for f, stamp in stamps if stamp is not None)
+
+		with self.lock:
+			old = self.entries.pop(uri, None)
+			if old is not None:
+				self.size -= old[2]
+			self.entries[uri] = (stylesheet, stamps, size)
+			self.size += size
+			self.evict()
+		return stylesheet
+
+
+	def compiledStamp(self, f, before):
+		"""Returns the stamp of file f as it was compiled: the one read by
+		the document provider before parsing it, which may have kept an
+		older document, or else the one read before compiling."""
+
+		stamp = self.dp.stamps.get(f)
+		if stamp is not None:
+			return stamp if stamp != (None, 0) else None # see DocumentProvider.document
+		if f in before:
+			return before[f]
+		return fileStamp(f)
+
+
+	def evict(self):
+		"""Drops least recently used entries while over the budget,
+		always keeping the most recent one."""
+
+		while len(self.entries) > 1 and (len(self.entries) > self.maxEntries or
+				(self.maxBytes is not None and self.size > self.maxBytes)):
+			uri, entry = self.entries.popitem(last=False)
+			self.size -= entry[2]
+			self.evictions += 1
+
+
+	def remove(self, uri):
+		with self.lock:
+			entry = self.entries.pop(self.dp.absUri(uri), None)
+			if entry is not None:
+				self.size -= entry[2]
+
+
+	def clear(self):
+		with self.lock:
+			self.entries.clear()
+			self.size = 0
+
+
+	def stats(self):
+		"""Returns a dict of the counters and the current size."""
+
+		with self.lock:
+			return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+				'entries': len(self.entries), 'bytes': self.size}
+
+
+# the registry shared by processors in this process
+defaultRegistry = StylesheetRegistry()
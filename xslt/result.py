@@ -0,0 +1,143 @@
+import xml.dom
+from xml.dom import Node
+from exceptions import *
+
+
+class ResultBuilder(object):
+	"""Receives the result tree as a sequence of events [XSLT 7].
+
+	Instructions write to context.result, which is a ResultBuilder:
+	startElement and endElement enclose the content of an element,
+	the attributes of an element (including namespace declarations,
+	attributes in the XMLNS namespace) must come right after its
+	startElement. Builders either build a tree (DOMBuilder), collect
+	text (TextBuilder) or write the result out as it is generated
+	(serializer.XMLSerializer and TextSerializer)."""
+
+	def startDocument(self):
+		pass
+
+	def endDocument(self):
+		pass
+
+	def startElement(self, namespaceURI, qname):
+		raise InvalidContent(qname)
+
+	def endElement(self):
+		pass
+
+	def attribute(self, namespaceURI, qname, value):
+		raise InvalidContent(qname)
+
+	def text(self, data, disableOutputEscaping=False):
+		pass
+
+	def comment(self, data):
+		raise InvalidContent(data)
+
+	def processingInstruction(self, target, data):
+		raise InvalidContent(target)
+
+
+	def node(self, node):
+		"""Copies a node with all its descendants [XSLT 11.3]."""
+
+		nodeType = node.nodeType
+		if nodeType == Node.TEXT_NODE or nodeType == Node.CDATA_SECTION_NODE:
+			self.text(node.data, getattr(node, 'xslt_disableOutputExcaping', False))
+		elif nodeType == Node.ELEMENT_NODE:
+			self.startElement(node.namespaceURI, node.nodeName)
+			attrs = node.attributes
+			for i in range(attrs.length):
+				attr = attrs.item(i)
+				self.attribute(attr.namespaceURI, attr.name, attr.value)
+			for child in node.childNodes:
+				self.node(child)
+			self.endElement()
+		elif nodeType == Node.ATTRIBUTE_NODE:
+			self.attribute(node.namespaceURI, node.name, node.value)
+		elif nodeType == Node.DOCUMENT_NODE or nodeType == Node.DOCUMENT_FRAGMENT_NODE:
+			for child in node.childNodes:
+				self.node(child)
+		elif nodeType == Node.COMMENT_NODE:
+			self.comment(node.data)
+		elif nodeType == Node.PROCESSING_INSTRUCTION_NODE:
+			self.processingInstruction(node.target, node.data)
+
+
+	def push(self, value):
+		"""Adds value to the result. value can be basestring,
+		a Node or a list of them."""
+
+		if isinstance(value, basestring):
+			self.text(value)
+		elif type(value) is list:
+			for v in value:
+				self.push(v)
+		else:
+			self.node(value)
+
+
+class DOMBuilder(ResultBuilder):
+	"""Builds the result as children of a DOM node
+	(Element, DocumentFragment or Document)."""
+
+	def __init__(self, parent):
+		self.root = parent
+		self.current = parent
+		self.document = parent if parent.nodeType == Node.DOCUMENT_NODE else parent.ownerDocument
+
+	def startElement(self, namespaceURI, qname):
+		e = self.document.createElementNS(namespaceURI, qname)
+		self.current.appendChild(e)
+		self.current = e
+
+	def endElement(self):
+		self.current = self.current.parentNode
+
+	def attribute(self, namespaceURI, qname, value):
+		e = self.current
+		if e.nodeType != Node.ELEMENT_NODE or e.childNodes.length > 0:
+			raise UnexpectedAttribute(qname)
+		e.setAttributeNS(namespaceURI, qname, value)
+
+	def text(self, data, disableOutputEscaping=False):
+		if self.current.nodeType == Node.DOCUMENT_NODE:
+			# a document has no text children, only whitespace can be ignored
+			if data.strip():
+				raise InvalidContent(data)
+			return
+		t = self.document.createTextNode(data)
+		if disableOutputEscaping:
+			t.xslt_disableOutputExcaping = True
+		self.current.appendChild(t)
+
+	def comment(self, data):
+		self.current.appendChild(self.document.createComment(data))
+
+	def processingInstruction(self, target, data):
+		self.current.appendChild(self.document.createProcessingInstruction(target, data))
+
+	def node(self, node):
+		nodeType = node.nodeType
+		if nodeType in (Node.TEXT_NODE, Node.CDATA_SECTION_NODE, Node.ATTRIBUTE_NODE,
+				Node.DOCUMENT_NODE, Node.DOCUMENT_FRAGMENT_NODE):
+			super(DOMBuilder, self).node(node)
+		else:
+			# importing is faster than building the copy node by node
+			self.current.appendChild(self.document.importNode(node, True))
+
+
+class TextBuilder(ResultBuilder):
+	"""Collects the text of a result which can only contain text,
+	like the value of an attribute or a comment [XSLT 7.1.3].
+	Raises InvalidContent for other nodes."""
+
+	def __init__(self):
+		self.data = []
+
+	def text(self, data, disableOutputEscaping=False):
+		self.data.append(data)
+
+	def getvalue(self):
+		return u''.join(self.data)
@@ -1,15 +1,93 @@
 from StringIO import StringIO
+import codecs
 import xml.dom
 from xml.sax.saxutils import quoteattr, escape
+from result import ResultBuilder
+from exceptions import *
 
-class XMLSerializer(object):
-	def __init__(self, output):
+# characters collected by StreamWriter before they are written out
+CHUNK_SIZE = 16384
+
+class StreamWriter(object):
+	"""Encodes unicode strings written to it and writes them to a file-like 
+	object in chunks of about chunkSize characters. Characters the encoding can 
+	not represent are written as character references."""
+	
+	def __init__(self, stream, encoding='utf-8', chunkSize=CHUNK_SIZE):
+		self.stream = stream
+		self.encoder = codecs.getincrementalencoder(encoding)('xmlcharrefreplace')
+		self.chunkSize = chunkSize
+		self.buffer = []
+		self.size = 0
+		
+	def write(self, s):
+		self.buffer.append(s)
+		self.size += len(s)
+		if self.size >= self.chunkSize:
+			self.flush()
+			
+	def flush(self):
+		"""Writes out everything written so far."""
+		
+		if self.buffer:
+			data = self.encoder.encode(u''.join(self.buffer))
+			self.buffer = []
+			self.size = 0
+			if data:
+				self.stream.write(data)
+				
+	def close(self):
+		"""Flushes the writer and the encoder. Does not close the stream."""
+		
+		self.flush()
+		data = self.encoder.encode(u'', True)
+		if data:
+			self.stream.write(data)
+			
+			
+def prefixOf(qname):
+	i = qname.find(':')
+	return qname[:i] if i >= 0 else None
+	
+
+class XMLSerializer(ResultBuilder):
+	"""Writes the result as XML [XSLT 16.1] while it is generated,
+	no result tree is built. Namespace declarations are added where 
+	the name of an element or an attribute needs one.
+	
+	writer is a file-like object, it is passed unicode strings."""
+	
+	def __init__(self, output, writer=None):
 		self.output = output
+		self.writer = writer
+		self.indent = output.get('indent', False)
+		self.cdataElements = output.get('cdata-section-elements', set())
+		self.encoding = output.get('encoding', 'utf-8')
+		self.doctype = False
+		
+		# namespace bindings (prefix -> uri) in scope for each open element
+		self.scopes = [{None: None, 'xml': xml.dom.XML_NAMESPACE}]
+		# open elements as [qname, is cdata section element, has child elements]
+		self.elements = []
+		# (namespaceURI, qname, attributes) of the last started element
+		# while its start tag is not written
+		self.pending = None
+		
 		
 	def serializeResult(self, frag):
+		"""Serializes a result tree, returns an encoded string."""
+		
 		s = StringIO()
+		self.writer = s
+		self.startDocument()
+		self.node(frag)
+		self.endDocument()
+		return s.getvalue().encode(self.output.get('encoding', 'utf-8'))
+		
 		
+	def startDocument(self):
 		if self.output.get('omit-xml-declaration') != True:
+			s = self.writer
 			s.write('<?xml')
 			s.write(' version="%s"' % self.output.get('version', '1.0'))
 			if self.output.has_key('encoding'):
@@ -17,97 +95,212 @@ class XMLSerializer(object):
 			if self.output.has_key('standalone'):
 				s.write(' standalone="%s"' % ('yes' if self.output.get('standalone') else 'no'))
 			s.write('?>')
-			
-		if self.output.has_key('doctype-system'):
-			s.write('<!DOCTYPE %s' % frag.firstChild.nodeName)
+		# written before the first element
+		self.doctype = self.output.has_key('doctype-system')
+		
+		
+	def endDocument(self):
+		self.flush('>')
+		
+		
+	def startElement(self, namespaceURI, qname):
+		self.flush('>')
+		
+		if self.doctype:
+			self.doctype = False
+			self.writer.write('<!DOCTYPE %s' % qname)
 			if self.output.has_key('doctype-public'):
-				s.write(' PUBLIC %s %s' % (self.output.get('doctype-public'), self.output.get('doctype-system')))
+				self.writer.write(' PUBLIC %s %s>' % (quoteattr(self.output['doctype-public']), 
+					quoteattr(self.output['doctype-system'])))
 			else:
-				s.write(' SYSTEM %s' % self.output.get('doctype-system'))
-			s.write('>')
+				self.writer.write(' SYSTEM %s>' % quoteattr(self.output['doctype-system']))
+				
+		if self.elements:
+			self.elements[-1][2] = True
+		if self.indent:
+			self.writer.write('\n' + '  ' * len(self.elements))
 			
-		self.serialize(frag, s)
+		localName = qname[qname.find(':')+1:]
+		self.elements.append([qname, (namespaceURI, localName) in self.cdataElements, False])
+		self.pending = (namespaceURI, qname, [])
 		
-		return s.getvalue().encode(self.output.get('encoding', 'utf-8'))
+		
+	def attribute(self, namespaceURI, qname, value):
+		if self.pending is None:
+			raise UnexpectedAttribute(qname)
 			
-	def serializeDoc(self, doc):
-		pass
+		attrs = self.pending[2]
+		for i in range(len(attrs)):
+			if attrs[i][1] == qname:
+				# the last attribute with a name is used [XSLT 7.1.3]
+				attrs[i] = (namespaceURI, qname, value)
+				return
+		attrs.append((namespaceURI, qname, value))
 		
-	def serialize(self, node, writer, indent=0):
-		if node.nodeType == xml.dom.Node.ATTRIBUTE_NODE:
-			writer.write(' %s=%s' % (node.name, quoteattr(node.value)))
+		
+	def endElement(self):
+		qname, cdata, hasChildElements = self.elements.pop()
+		if self.pending is not None:
+			self.flush('/>')
+		else:
+			if self.indent and hasChildElements:
+				self.writer.write('\n' + '  ' * len(self.elements))
+			self.writer.write('</%s>' % qname)
+		self.scopes.pop()
+		
+		
+	def flush(self, end):
+		"""Writes the pending start tag followed by end."""
+		
+		if self.pending is None:
+			return
+		namespaceURI, qname, attrs = self.pending
+		self.pending = None
+		
+		parent = self.scopes[-1]
+		declarations = {}
+		order = []
+		def lookup(prefix):
+			if prefix in declarations:
+				return declarations[prefix]
+			return parent.get(prefix)
+		def declare(prefix, uri):
+			if prefix not in declarations:
+				order.append(prefix)
+			declarations[prefix] = uri
 			
-		elif node.nodeType == xml.dom.Node.CDATA_SECTION_NODE:
-			s = node.data.replace(']]>', ']]]]><![CDATA[>')
-			writer.write('<![CDATA[%s]]>' % s)
+		for (ns, name, value) in attrs:
+			if ns == xml.dom.XMLNS_NAMESPACE:
+				declare(None if name == 'xmlns' else name[6:], value or None)
+				
+		prefix = prefixOf(qname)
+		if lookup(prefix) != namespaceURI and (prefix is None or namespaceURI is not None):
+			declare(prefix, namespaceURI)
 			
-		elif node.nodeType == xml.dom.Node.COMMENT_NODE:
-			s = node.data.replace('--', '- -')
-			if s[-1:] == '-': s += ' '
-			writer.write('<!--%s-->' % s)
+		s = ['<', qname]
+		for (ns, name, value) in attrs:
+			if ns == xml.dom.XMLNS_NAMESPACE:
+				continue
+			if ns is not None:
+				prefix = prefixOf(name)
+				if prefix is None or (lookup(prefix) != ns and prefix in declarations):
+					prefix = self.newPrefix(ns, lookup)
+					name = '%s:%s' % (prefix, name[name.find(':')+1:])
+				if lookup(prefix) != ns:
+					declare(prefix, ns)
+			s.append(' %s=%s' % (name, quoteattr(value)))
 			
-		elif node.nodeType in (xml.dom.Node.DOCUMENT_FRAGMENT_NODE, 
-				xml.dom.Node.DOCUMENT_NODE):
-			for i in node.childNodes:
-				self.serialize(i, writer, indent)
-				
-		elif node.nodeType == xml.dom.Node.ELEMENT_NODE:
-			if self.output.get('indent', False):
-				writer.write( '\n' + '  ' * indent)
-			writer.write('<%s' % node.tagName)
-			for i in range(node.attributes.length):
-				attr = node.attributes.item(i)
-				self.serialize(attr, writer, indent)
+		s[2:2] = [' %s=%s' % ('xmlns' if prefix is None else 'xmlns:' + prefix, 
+			quoteattr(declarations[prefix] or '')) for prefix in order]
+		s.append(end)
+		self.writer.write(''.join(s))
+		
+		if declarations:
+			scope = dict(parent)
+			scope.update(declarations)
+			parent = scope
+		self.scopes.append(parent)
+		
+		
+	def newPrefix(self, uri, lookup):
+		"""Returns a prefix for an attribute in namespace uri."""
+		
+		for prefix, ns in self.scopes[-1].iteritems():
+			if ns == uri and prefix is not None and lookup(prefix) == uri:
+				return prefix
+		i = 0
+		while lookup('ns%d' % i) is not None:
+			i += 1
+		return 'ns%d' % i
+		
+		
+	def text(self, data, disableOutputEscaping=False):
+		if not data:
+			return
+		self.flush('>')
+		if self.elements and self.elements[-1][1]:
+			self.cdata(data)
+		elif disableOutputEscaping:
+			self.writer.write(data)
+		else:
+			self.writer.write(escape(data))
 			
-			if node.childNodes.length > 0:
-				writer.write('>')
-				
-				for i in node.childNodes:
-					self.serialize(i, writer, indent+1)
-				
-				if self.output.get('indent', False):
-					writer.write( '\n' + '  ' * indent)
-					
-				writer.write('</%s>' % node.tagName)
-			else:
-				writer.write('/>')
 			
-		elif node.nodeType == xml.dom.Node.ENTITY_REFERENCE_NODE:
-			writer.write('&%s;' % node.nodeName)
+	def cdata(self, data):
+		"""Writes data in CDATA sections. Characters the encoding can not 
+		represent are written between sections as character references."""
+		
+		if not self.encodable(data):
+			start = 0
+			for i, c in enumerate(data):
+				if not self.encodable(c):
+					if start < i:
+						self.cdata(data[start:i])
+					self.writer.write('&#%d;' % ord(c))
+					start = i + 1
+			data = data[start:]
+			if not data:
+				return
+		self.writer.write('<![CDATA[%s]]>' % data.replace(']]>', ']]]]><![CDATA[>'))
+		
+		
+	def encodable(self, s):
+		try:
+			s.encode(self.encoding)
+			return True
+		except UnicodeEncodeError:
+			return False
 			
-		elif node.nodeType == xml.dom.Node.PROCESSING_INSTRUCTION_NODE:
-			writer.write('<?%s %s?>' % (node.nodeName, node.nodeValue))
 			
-		elif node.nodeType == xml.dom.Node.TEXT_NODE:
-			if (node.parentNode is not None and 
-					(node.parentNode.namespaceURI, node.parentNode.localName) in 
-					self.output.get('cdata-section-elements', set())):
-				s = node.data.replace(']]>', ']]]]><![CDATA[>')
-				writer.write('<![CDATA[%s]]>' % s)
-			else:
-				s = node.data
-				
-				if (hasattr(node, 'xslt_disableOutputExcaping') and 
-						getattr(node, 'xslt_disableOutputExcaping')):
-					s = escape(s)
-					
-				writer.write(s)
-				
-class TextSerializer(object):
-	def __init__(self, output):
+	def comment(self, data):
+		self.flush('>')
+		if not self.encodable(data):
+			raise UnencodableContent(data)
+		s = data.replace('--', '- -')
+		if s[-1:] == '-': s += ' '
+		self.writer.write('<!--%s-->' % s)
+		
+		
+	def processingInstruction(self, target, data):
+		self.flush('>')
+		if not self.encodable(data):
+			raise UnencodableContent(data)
+		self.writer.write('<?%s %s?>' % (target, data))
+		
+		
+class TextSerializer(ResultBuilder):
+	"""Writes the text of the result [XSLT 16.3]."""
+	
+	def __init__(self, output, writer=None):
 		self.output = output
+		self.writer = writer
 		
 	def serializeResult(self, frag):
 		s = StringIO()
-		self.serialize(frag, s)
+		self.writer = s
+		self.node(frag)
 		return s.getvalue().encode(self.output.get('encoding', 'utf-8'))
 		
-	def serialize(self, node, writer, indent=0):
-		if node.nodeType in (xml.dom.Node.DOCUMENT_FRAGMENT_NODE, 
-				xml.dom.Node.DOCUMENT_NODE, xml.dom.Node.ELEMENT_NODE):
-			for i in node.childNodes:
-				self.serialize(i, writer)
-				
-		elif node.nodeType == xml.dom.Node.TEXT_NODE:
-			writer.write(node.data)
-				
\ No newline at end of file
+	def startElement(self, namespaceURI, qname):
+		pass
+		
+	def attribute(self, namespaceURI, qname, value):
+		pass
+		
+	def comment(self, data):
+		pass
+		
+	def processingInstruction(self, target, data):
+		pass
+		
+	def text(self, data, disableOutputEscaping=False):
+		self.writer.write(data)
+		
+		
+def forOutput(output, writer=None):
+	"""Returns the serializer for the output method in output (xsl:output 
+	attributes). Methods other than text are written as XML."""
+	
+	if output.get('method', (None, 'xml')) == (None, 'text'):
+		return TextSerializer(output, writer)
+	return XMLSerializer(output, writer)
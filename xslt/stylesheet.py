@@ -1,14 +1,46 @@
 from xml.dom import Node
+import xpath.tools
 import core
 import properties
 import xp
 import elements
+import dispatch
 import serializer
+from result import DOMBuilder
+from StringIO import StringIO
+import sys, threading, weakref, Queue
+import xpath.index
 from exceptions import *
 from tools import *
 
 
+class ChunkQueue(object):
+	"""A file-like object passing the chunks written to it 
+	to the thread iterating over transformIter."""
+	
+	# put after the last chunk
+	END = object()
+	
+	def __init__(self, maxChunks):
+		self.queue = Queue.Queue(maxChunks)
+		self.cancelled = False
+		self.error = None
+		
+	def write(self, data):
+		if self.cancelled:
+			raise Cancelled()
+		self.queue.put(data)
+
+
+# stripped copies of source documents are made one at a time,
+# see Stylesheet.strippedDocument
+_stripLock = threading.Lock()
+
+
 class Stylesheet(object):
+	"""A compiled stylesheet. It is not changed after construction, 
+	so one stylesheet can be used by concurrent transformations, 
+	each with its own XSLTContext."""
 
 	def __init__(self, uriOrDoc=None, dp=core.DocumentProvider()):
 		self.dp = dp
@@ -16,10 +48,8 @@ class Stylesheet(object):
 		if isinstance(uriOrDoc, xml.dom.Node):
 			if uriOrDoc.nodeType != xml.dom.Node.DOCUMENT_NODE:
 				uriOrDoc = uriOrDoc.ownerDocument
-			uriOrDoc = self.dp.addDOMDocument(doc)
+			uriOrDoc = self.dp.addDOMDocument(uriOrDoc)
 			
-		doc = self.dp.document(uriOrDoc)
-
 		self.stripSpace = []
 		self.preserveSpace = []
 		self.output = {}
@@ -33,8 +63,13 @@ class Stylesheet(object):
 		self.patterns = { (None, None): [] }
 		self.namedTemplates = {}
 		self.imports = []
+		self.sources = [] # files of this stylesheet and its includes
 		
-		self._parseStylesheetContent(doc, uriOrDoc)
+		generation = self.dp.acquire()
+		try:
+			self._parseStylesheetContent(self.dp.document(uriOrDoc), uriOrDoc)
+		finally:
+			self.dp.release(generation)
 		for i in self.patterns:
 			self.patterns[i].sort(key=lambda x: x[2])
 		
@@ -47,54 +82,174 @@ class Stylesheet(object):
 			combineOutput(self.output, imp.output)
 			for key in imp.keys.values():
 				self.addKey(key)
+				
+		self._buildDispatchTables()
+		
+	def transform(self, uriOrDoc, context, result=None):
+		"""Transforms a document writing the result to result (a result.ResultBuilder).
+		Without result, builds the result tree and returns it as a DocumentFragment.
+		A DOM document is kept by the document provider, see 
+		DocumentProvider.addDOMDocument before changing it."""
 		
-	def transform(self, uriOrDoc, context):
 		if isinstance(uriOrDoc, xml.dom.Node):
 			if uriOrDoc.nodeType != xml.dom.Node.DOCUMENT_NODE:
 				uriOrDoc = uriOrDoc.ownerDocument
-			uriOrDoc = self.dp.addDOMDocument(doc)
+			uriOrDoc = self.dp.addDOMDocument(uriOrDoc)
+			
+		# documents read during the transformation are not unlinked before its end
+		generation = self.dp.acquire()
+		try:
+			return self._transform(self.dp.document(uriOrDoc), context, result)
+		finally:
+			self.dp.release(generation)
 			
-		doc = self.dp.document(uriOrDoc)
+	def strippedDocument(self, doc):
+		"""Returns doc without the whitespace text nodes removed by the
+		xsl:strip-space and xsl:preserve-space rules [XSLT 3.4].
 		
-		stripSpace(doc, self.stripSpace, self.preserveSpace, defaultStrip=False)
+		doc itself is never changed, other transformations (maybe with
+		other rules) may be reading it: the nodes are removed from a copy.
+		The copy is kept with doc for the next transformations with the 
+		same rules, until the document provider drops doc."""
 		
-		result = self.dp.createDocument().createDocumentFragment()
-		context.nodeset = [doc]
+		if not self.stripSpace:
+			return doc # whitespace is preserved by default
+			
+		rules = (tuple(self.stripSpace), tuple(self.preserveSpace))
+		with _stripLock:
+			copies = getattr(doc, 'xslt_stripped', {})
+			if rules in copies:
+				return copies[rules]
+			copy = doc.cloneNode(True)
+			stripSpace(copy.documentElement, self.stripSpace, self.preserveSpace, 
+				defaultStrip=False, stripComments=False)
+			copy.baseUri = doc.baseUri
+			xpath.index.index_document(copy)
+			# the copy is never changed, even if doc belongs to the caller
+			copy.xslt_matches = weakref.WeakKeyDictionary()
+			copies[rules] = copy
+			doc.xslt_stripped = copies
+		return copy
+		
+	def _transform(self, doc, context, result):
+		doc = self.strippedDocument(doc)
+		
+		context.resultDocument = self.dp.createDocument()
+		if result is None:
+			frag = context.resultDocument.createDocumentFragment()
+			result = DOMBuilder(frag)
+		else:
+			frag = None
+			
+		context.nodeset = xpath.tools.NodeSet([doc], ordered=True, unique=True)
 		context.result = result
 		
 		for i, v in self.variables.iteritems():
 			v.instantiate(context)
+		context.globals = context.variables
 
+		result.startDocument()
 		self.applyTemplates(context, (None, None))
+		result.endDocument()
 		
-		return result
+		return frag
 		
 		
-	def transformToDoc(self, *args):
-		frag = self.transform(*args)
-		doc = frag.ownerDocument
-		doc.appendChild(frag)
+	def transformToDoc(self, uriOrDoc, context):
+		doc = self.dp.createDocument()
+		self.transform(uriOrDoc, context, DOMBuilder(doc))
 		core.fixNamespaces(doc)
 		return doc
 		
 		
-	def transformToString(self, *args):
-		frag = self.transform(*args)
-		core.fixNamespaces(frag)
+	def transformToString(self, uriOrDoc, context):
+		"""Returns the serialized result as an encoded string."""
+		
+		s = StringIO()
+		self.transformToStream(uriOrDoc, context, s)
+		return s.getvalue()
+		
+		
+	def transformToStream(self, uriOrDoc, context, stream, chunkSize=serializer.CHUNK_SIZE):
+		"""Writes the serialized result to stream (a file-like object) 
+		encoded as specified by xsl:output. The result is written 
+		in chunks while it is generated."""
+		
+		writer = serializer.StreamWriter(stream, self.output.get('encoding', 'utf-8'), chunkSize)
+		self.transform(uriOrDoc, context, serializer.forOutput(self.output, writer))
+		writer.close()
+		
 		
-		method = self.output.get('method', (None, 'xml'))
-		if method == (None, 'xml'):
-			ser = serializer.XMLSerializer(self.output)
-		elif method == (None, 'text'):
-			ser = serializer.TextSerializer(self.output)
+	def transformIter(self, uriOrDoc, context, chunkSize=serializer.CHUNK_SIZE, maxChunks=4):
+		"""Returns an iterator over chunks of the encoded result.
+		The transformation runs in another thread, chunks are available 
+		as soon as they are written. At most maxChunks chunks wait to be read.
+		Closing the iterator early stops the transformation."""
+		
+		chunks = ChunkQueue(maxChunks)
+		
+		def run():
+			try:
+				self.transformToStream(uriOrDoc, context, chunks, chunkSize)
+			except Cancelled:
+				return
+			except BaseException:
+				chunks.error = sys.exc_info()
+			chunks.queue.put(ChunkQueue.END)
 			
-		if ser is not None:
-			return ser.serializeResult(frag)
-		else:
-			return ''
+		thread = threading.Thread(target=run)
+		thread.daemon = True
+		thread.start()
+		try:
+			while True:
+				chunk = chunks.queue.get()
+				if chunk is ChunkQueue.END:
+					break
+				yield chunk
+			if chunks.error is not None:
+				raise chunks.error[0], chunks.error[1], chunks.error[2]
+		finally:
+			# unblock and stop the transformation if it is still running
+			chunks.cancelled = True
+			while thread.is_alive():
+				try:
+					chunks.queue.get(timeout=0.1)
+				except Queue.Empty:
+					pass
+		
+		
+	def dependencies(self):
+		"""Returns the files the stylesheet was compiled from:
+		the stylesheet itself, its includes and imports."""
+		
+		files = list(self.sources)
+		for imp in self.imports:
+			files.extend(imp.dependencies())
+		return files
+		
+		
+	def setDocumentProvider(self, dp):
+		self.dp = dp
+		for imp in self.imports:
+			imp.setDocumentProvider(dp)
+			
+			
+	def __getstate__(self):
+		# see cache.StylesheetCache; the document provider is set when loading,
+		# dispatch tables are made of closures and built again
+		state = self.__dict__.copy()
+		del state['dp']
+		del state['_dispatch'], state['_noRules']
+		return state
+		
+		
+	def __setstate__(self, state):
+		self.__dict__.update(state)
+		self._buildDispatchTables()
 		
 		
 	def _parseStylesheetContent(self, doc, baseUri):
+		self.sources.append(baseUri)
 		sheet = doc.documentElement
 		if sheet.namespaceURI != core.XSLT_NAMESPACE or not(sheet.localName == 'stylesheet' or sheet.localName == 'transform'):
 			raise UnexpectedNode(doc.documentElement)
@@ -125,7 +280,7 @@ class Stylesheet(object):
 			if node.localName == 'import':
 				# TODO: check that imports come first
 				href = properties.stringProperty(node, 'href', required=True)
-				self.imports.append(Stylesheet(href, dp=self.dp))
+				self.imports.append(Stylesheet(self.dp.absUri(href, baseUri), dp=self.dp))
 				
 			if node.localName == 'include':
 				href = properties.stringProperty(node, 'href', required=True)
@@ -141,11 +296,11 @@ class Stylesheet(object):
 				self.addTemplateRule(template)
 				
 			if node.localName == 'strip-space':
-				space = elements.SpaceStripping(node)
+				space = elements.SpaceStripping(node, self, options)
 				self.stripSpace.extend(space.nameTests())
 				
 			if node.localName == 'preserve-space':
-				space = elements.SpaceStripping(node)
+				space = elements.SpaceStripping(node, self, options)
 				self.preserveSpace.extend(space.nameTests())
 				
 			if node.localName == 'output':
@@ -214,32 +369,18 @@ class Stylesheet(object):
 			self.patterns[mode] += patterns
 				
 				
-	def initMode(self, context, mode):
-		self._matchAll(context, mode)
-		for i in self.imports:
-			i.initMode(context, mode)
+	def _buildDispatchTables(self):
+		self._dispatch = {} # mode -> dispatch.DispatchTable
+		for mode, patterns in self.patterns.iteritems():
+			self._dispatch[mode] = dispatch.DispatchTable(patterns)
+		# for modes without template rules in this stylesheet
+		self._noRules = dispatch.DispatchTable([])
 		
 		
-	def _matchAll(self, context, mode):
-		document = (context.node.ownerDocument
-				if context.node.nodeType != Node.DOCUMENT_NODE
-				else context.node)
-				
-		handle = (hash(self), hash(document), mode)
-		
-		if handle in context.matches:
-			return # already matched this stylesheet agains current document and current mode
-		
-		patterns = self.patterns[mode]
-		matches = {}
-		nsCopy = context.namespaces.copy()
-		for (pattern, template, priority) in patterns:
-			context.namespaces.update(template.namespaces)
-			nodes = template.match.nodes(context)
-			for node in nodes:
-				matches[hash(node)] = template
-				
-		context.matches[handle] = matches
+	def dispatchTable(self, mode):
+		"""Returns the DispatchTable for template rules of this stylesheet in mode."""
+		
+		return self._dispatch.get(mode, self._noRules)
 	
 	
 	def applyTemplates(self, context, mode):
@@ -262,16 +403,11 @@ class Stylesheet(object):
 			
 			
 	def applyTemplatesImpl(self, context, mode):
-		self.initMode(context, mode)
-		
 		context.cause = (None, mode)
 		node = context.node
-		doc = (context.node.ownerDocument
-				if context.node.nodeType != Node.DOCUMENT_NODE
-				else context.node)
-		handle = (hash(self), hash(doc), mode)
-		if hash(node) in context.matches[handle]:
-			context.matches[handle][hash(node)].instantiate(context)
+		template = self.dispatchTable(mode).find(node, context)
+		if template is not None:
+			template.instantiate(context)
 			return True
 		else:
 			r = self.applyImports(context)
@@ -285,13 +421,15 @@ class Stylesheet(object):
 		if context.node.nodeType == Node.ELEMENT_NODE or \
 				context.node.nodeType == Node.DOCUMENT_NODE:
 			if node.childNodes.length > 0:
-				subContext = context.copy()
-				subContext.nodeset = list(node.childNodes)
-				self.applyTemplates(subContext, mode)
+				focus = context.focus()
+				context.nodeset = xpath.tools.NodeSet(node.childNodes, ordered=True, unique=True)
+				self.applyTemplates(context, mode)
+				context.restoreFocus(focus)
 		elif context.node.nodeType == Node.TEXT_NODE or \
-				context.node.nodeType == Node.CDATA_SECTION_NODE or \
-				node.nodeType == Node.ATTRIBUTE_NODE:
-			context.pushResult(context.node)
+				context.node.nodeType == Node.CDATA_SECTION_NODE:
+			context.result.text(node.data)
+		elif node.nodeType == Node.ATTRIBUTE_NODE:
+			context.result.text(node.value)
 		# OK: <xsl:template match="processing-instruction()|comment()"/>
 		# OK: The built-in template rule for namespace nodes is also to do nothing
 			
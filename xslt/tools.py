@@ -93,7 +93,8 @@ def stripSpace(node, stripSpaceList=[], preserveSpaceList=[], defaultStrip=True,
 			
 		childNodes = list(node.childNodes) # save ChildNodes. deleting a child will modify node.childNodes
 		for child in childNodes:
-			stripSpace(child, stripSpaceList, preserveSpaceList, active=active, currentActive=currentActive)
+			stripSpace(child, stripSpaceList, preserveSpaceList, defaultStrip=defaultStrip,
+				stripComments=stripComments, active=active, currentActive=currentActive)
 			
 	elif node.nodeType == xml.dom.Node.COMMENT_NODE and stripComments:
 		node.parentNode.removeChild(node)
@@ -207,24 +208,33 @@ def computeDefaultPriority(pattern):
 		raise TypeError
 	
 	# if the expressiong had a form of ChildOrAttributeAxisSpecifier NodeTest
-	if type(pattern) is X.AbsolutePathExpr and \
-			type(pattern.path) is X.PathExpr and \
-			len(pattern.path.steps) == 2 and \
-			type(pattern.path.steps[0]) is X.AxisStep and \
-			type(pattern.path.steps[0].test) is X.AnyKindTest and \
-			pattern.path.steps[0].axis.__name__ == 'descendant-or-self' and \
-			type(pattern.path.steps[1]) is X.AxisStep:
-		nodeTest = pattern.path.steps[1].test
-		if type(nodeTest) is X.PITest: # processing-instruction(Literal)
+	# (the optimizer turns descendant-or-self::node()/child::x into descendant::x)
+	if type(pattern) is not X.AbsolutePathExpr or \
+			type(pattern.path) is not X.PathExpr:
+		return 0.5
+	steps = pattern.path.steps
+	if len(steps) == 2 and \
+			type(steps[0]) is X.AxisStep and \
+			type(steps[0].test) is X.AnyKindTest and \
+			steps[0].axis.__name__ == 'descendant-or-self' and \
+			type(steps[1]) is X.AxisStep:
+		nodeTest = steps[1].test
+	elif len(steps) == 1 and \
+			type(steps[0]) is X.AxisStep and \
+			steps[0].axis.__name__ == 'descendant':
+		nodeTest = steps[0].test
+	else:
+		return 0.5
+	
+	if type(nodeTest) is X.PITest: # processing-instruction(Literal)
+		return 0
+	if type(nodeTest) is X.NameTest:
+		if nodeTest.localName != '*': # ChildOrAttributeAxisSpecifier QName
 			return 0
-		if type(nodeTest) is X.NameTest:
-			if nodeTest.localName != '*': # ChildOrAttributeAxisSpecifier QName
-				return 0
-			if nodeTest.prefix != '*' and nodeTest.localName == '*': # ChildOrAttributeAxisSpecifier NCName:*
-				return -0.25
-			return -0.5 # *
-		return 0.5 # NodeTypeTest
-	return 0.5
+		if nodeTest.prefix != '*' and nodeTest.localName == '*': # ChildOrAttributeAxisSpecifier NCName:*
+			return -0.25
+		return -0.5 # *
+	return 0.5 # NodeTypeTest
 	
 	
 def splitUnionExpr(expr):
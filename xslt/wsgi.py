@@ -0,0 +1,64 @@
+import os.path
+import xslt
+import serializer
+
+
+class XSLTApplication(object):
+	"""WSGI application transforming local files with one stylesheet.
+
+	The stylesheet is compiled once. A request for /path serves the
+	transformation of root/path; the result is sent in chunks while the
+	transformation runs (see XSLTProcessor.transformIter)."""
+
+	def __init__(self, stylesheet, root, chunkSize=serializer.CHUNK_SIZE, dp=None):
+		self.processor = xslt.XSLTProcessor() if dp is None else xslt.XSLTProcessor(dp)
+		self.processor.setStylesheet(stylesheet)
+		self.root = os.path.abspath(root)
+		self.chunkSize = chunkSize
+
+
+	def contentType(self):
+		output = self.processor.stylesheet.output
+		if 'media-type' in output:
+			mediaType = output['media-type']
+		elif output.get('method') == (None, 'text'):
+			mediaType = 'text/plain'
+		else:
+			mediaType = 'text/xml'
+		return '%s; charset=%s' % (mediaType, output.get('encoding', 'utf-8'))
+
+
+	def resolve(self, path):
+		"""Returns the file for a request path or None
+		if it is not a file under root."""
+
+		path = os.path.normpath(os.path.join(self.root, path.lstrip('/')))
+		if not path.startswith(self.root + os.sep) or not os.path.isfile(path):
+			return None
+		return path
+
+
+	def __call__(self, environ, start_response):
+		path = self.resolve(environ.get('PATH_INFO', ''))
+		if path is None:
+			start_response('404 Not Found', [('Content-Type', 'text/plain')])
+			return ['Not Found']
+
+		chunks = self.processor.transformIter(path, chunkSize=self.chunkSize)
+		# errors before the first chunk are raised before the response starts
+		try:
+			first = chunks.next()
+		except StopIteration:
+			first = ''
+		start_response('200 OK', [('Content-Type', self.contentType())])
+		return self.iterate(first, chunks)
+
+
+	def iterate(self, first, chunks):
+		try:
+			yield first
+			for chunk in chunks:
+				yield chunk
+		finally:
+			# stops the transformation if the client has gone
+			chunks.close()
@@ -1,11 +1,22 @@
-import xpath.expr, xpath.parser
-import xpath.yappsrt, xpath.exceptions
+import xpath.expr, xpath.parser, xpath.rdparser, xpath.optimizer
+import xpath.yappsrt, xpath.exceptions, xpath.cache
 import tools
 		
 		
 class XPathBase(object):
-	_max_cache = 100
-	_cache = {}
+	# (grammar rule, optimize, expression string) -> parsed expression,
+	# shared by the subclasses. Its size can be changed with cache.resize.
+	cache = xpath.cache.LRUCache(500)
+	_rule = 'XPath'
+	
+	# Makes the parser of an expression string, which has a method for
+	# each grammar rule. YappsParser is the slower parser generated from
+	# xpath/parser.g; both build the same expression trees.
+	parser = xpath.rdparser.Parser
+
+	# Set to False to compile expressions exactly as they were parsed.
+	# Optimized and plain trees are cached apart.
+	optimize = True
 
 	def __init__(self, expr, useCache=True):
 		"""Init docs.
@@ -13,38 +24,75 @@ class XPathBase(object):
 		
 		if isinstance(expr, xpath.expr.Expr):
 			self.expr = expr
-			return
-			
-		if useCache:
+		elif useCache:
 			self.expr = type(self).get(expr)
 		else:
 			self.expr = type(self).compile(expr)
+			
+		# the expression tree compiled to a function
+		self._evaluate = self.expr.compiled()
 
 	@classmethod
 	def get(cls, s):
 		if isinstance(s, xpath.expr.Expr):
 			return s
+		return cls.cache.get(cls._key(s), cls._compileKey)
 		
-		if s not in cls._cache:
-			if len(cls._cache) >= cls._max_cache:
-				del cls._cache[0:cls._max_cache/2]
-				
-			cls._cache[s] = cls.compile(s)
-			
-		return cls._cache[s]
+	@classmethod
+	def warm(cls, expressions):
+		"""Compiles expressions into the cache, e.g. at startup."""
+		
+		cls.cache.warm([cls._key(s) for s in expressions], cls._compileKey)
+		
+	@classmethod
+	def _key(cls, s):
+		return (cls._rule, bool(cls.optimize), s)
+		
+	@classmethod
+	def _compileKey(cls, key):
+		rule, optimize, s = key
+		return cls.compile(s, optimize)
 	
-	@staticmethod
-	def compile(s):
+	@classmethod
+	def compile(cls, s, optimize=None):
+		"""Parse s with the grammar rule named by cls._rule and optimize
+		the resulting expression tree unless optimize (cls.optimize by 
+		default) is false."""
+		if optimize is None:
+			optimize = cls.optimize
 		try:
-			parser = xpath.parser.XPath(xpath.parser.XPathScanner(str(s)))
-			expr = parser.XPath()
+			expr = getattr(cls.parser(str(s)), cls._rule)()
 		except xpath.yappsrt.SyntaxError, e:
 			raise xpath.exceptions.XPathParseError(str(s), e.pos, e.msg)
+		if optimize:
+			expr = xpath.optimizer.optimize(expr)
 		return expr
 
+	def __getstate__(self):
+		state = self.__dict__.copy()
+		del state['_evaluate']
+		state.pop('_iterate', None)
+		return state
+		
+	def __setstate__(self, state):
+		self.__dict__.update(state)
+		self._evaluate = self.expr.compiled()
+
 	@xpath.api
 	def find(self, context):
-		return self.expr.evaluate(context.node, context.pos, context.size, context)
+		return self._evaluate(context.node, context.pos, context.size, context)
+
+	@xpath.api
+	def findLazy(self, context):
+		"""Like find, but a node-set may be returned as an iterator
+		producing its nodes in document order as they are found
+		(see xpath.expr.Expr.iterated)."""
+		try:
+			iterate = self._iterate
+		except AttributeError:
+			# compiled on first use, most expressions are never evaluated lazily
+			iterate = self._iterate = self.expr.iterated() or self._evaluate
+		return iterate(context.node, context.pos, context.size, context)
 
 	def __repr__(self):
 		return '%s.%s(%s)' % (type(self).__module__,
@@ -54,33 +102,48 @@ class XPathBase(object):
 	def __str__(self):
 		return str(self.expr)
 
+class YappsParser(xpath.parser.XPath):
+	def __init__(self, s):
+		xpath.parser.XPath.__init__(self, xpath.parser.XPathScanner(s))
+
+
+# conversions of the values of findLazy
+toBoolean = xpath.expr.converter('boolean')
+toString = xpath.expr.converter('string')
+
+
 class XPath(XPathBase):
-	_max_cache = 100
-	_cache = {}
-	
 	@xpath.api
 	def findNodeset(self, context):
+		"""Evaluate a node-set expression (like a select attribute).
+		Returns a NodeSet in document order without duplicates."""
+		
 		result = self.find(context)
 		if not xpath.expr.nodesetp(result):
 			raise XPathTypeError("expression is not a node-set")
-		return result
+		return xpath.expr.ordered_nodeset(result)
 
 	@xpath.api
 	def findNode(self, context):
-		result = self.findnodeset(context)
+		"""Returns the first node of a node-set expression in document
+		order or None; the nodes after it are not computed."""
+		
+		result = xpath.expr.first_only(self.findLazy(context))
+		if not xpath.expr.nodesetp(result):
+			raise xpath.exceptions.XPathTypeError("expression is not a node-set")
 		if len(result) == 0:
 			return None
-		return result[0]
+		return xpath.expr.ordered_nodeset(result)[0]
 
 	@xpath.api
 	def findBoolean(self, context):
-		result = self.find(context)
-		return xpath.tools.boolean(result, context)
+		result = self.findLazy(context)
+		return toBoolean(result, context.node, context.pos, context.size, context)
 
 	@xpath.api
 	def findString(self, context):
-		result = self.find(context)
-		return xpath.tools.string(result, context)
+		result = self.findLazy(context)
+		return toString(result, context.node, context.pos, context.size, context)
 
 	@xpath.api
 	def findNumber(self, context):
@@ -88,17 +151,7 @@ class XPath(XPathBase):
 		return xpath.tools.number(result, context)
 
 class Pattern(XPathBase):
-	_max_cache = 100
-	_cache = {}
-	
-	@staticmethod
-	def compile(s):
-		try:
-			parser = xpath.parser.XPath(xpath.parser.XPathScanner(str(s)))
-			expr = parser.Pattern()
-		except xpath.yappsrt.SyntaxError, e:
-			raise xpath.exceptions.XPathParseError(str(s), e.pos, e.msg)
-		return expr
+	_rule = 'Pattern'
 		
 	@xpath.api
 	def nodes(self, context):
@@ -108,17 +161,7 @@ class Pattern(XPathBase):
 		return result
 		
 class AttributeTemplate(XPathBase):
-	_max_cache = 100
-	_cache = {}
-	
-	@staticmethod
-	def compile(s):
-		try:
-			parser = xpath.parser.XPath(xpath.parser.XPathScanner(str(s)))
-			expr = parser.AttributeValueTemplate()
-		except xpath.yappsrt.SyntaxError, e:
-			raise xpath.exceptions.XPathParseError(str(s), e.pos, e.msg)
-		return expr
+	_rule = 'AttributeValueTemplate'
 		
 	@xpath.api
 	def value(self, context):
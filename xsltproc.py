@@ -1,15 +1,161 @@
 import xslt
-import sys
-
-if len(sys.argv) < 3:
-	print "Usage: xsltproc.py <stylesheet> <document>"
-	
-proc = xslt.XSLTProcessor()
-proc.setStylesheet(sys.argv[1])
-msgs = []
-s = proc.transform(sys.argv[2], messages=msgs)
-
-for i in msgs:
-	print "[MSG]: %s" % i
-	
-print s
\ No newline at end of file
+import sys, os, glob, time
+import optparse
+import multiprocessing
+
+usage = """Usage: xsltproc.py <stylesheet> <document>
+       xsltproc.py -o <dir> [-j N] [-g <pattern>] [--stdin] <stylesheet> [<document>...]
+
+With -o the stylesheet is compiled once and applied to every document,
+results are written to <dir> (named after the documents, in the
+subdirectories they are in relative to the directory containing all of
+them) and a summary is printed to stderr."""
+
+parser = optparse.OptionParser(usage=usage)
+parser.add_option('-o', '--output-dir', dest='outputDir',
+	help='batch mode: write results to DIR', metavar='DIR')
+parser.add_option('-g', '--glob', dest='patterns', action='append', default=[],
+	help='transform documents matching PATTERN (may be repeated)', metavar='PATTERN')
+parser.add_option('--stdin', dest='stdin', action='store_true', default=False,
+	help='read the list of documents from stdin, one per line')
+parser.add_option('-j', '--jobs', dest='jobs', type='int', default=1,
+	help='number of worker processes forked after compiling the stylesheet', metavar='N')
+parser.add_option('-e', '--extension', dest='extension',
+	help='extension of result files (default .xml, .txt for text output)', metavar='EXT')
+
+# compiled before the workers are forked, so they share it
+processor = xslt.XSLTProcessor()
+
+
+def outputPaths(outputDir, extension, documents):
+	"""Returns the result file of each of documents. Their paths relative
+	to the directory containing all of them are mirrored in outputDir, so
+	documents of the same name in different directories are kept apart."""
+
+	paths = [os.path.abspath(d) for d in documents]
+	dirs = [os.path.dirname(p).split(os.sep) for p in paths]
+	base = os.sep.join(os.path.commonprefix(dirs)) or os.sep
+	return [os.path.join(outputDir, os.path.splitext(os.path.relpath(p, base))[0] + extension)
+		for p in paths]
+
+
+def transformFile(job):
+	"""Transforms one document in batch mode.
+	Returns (document, seconds, error, messages)."""
+
+	document, output = job
+	msgs = []
+	start = time.time()
+	try:
+		f = open(output, 'wb')
+		try:
+			processor.transformToStream(document, f, messages=msgs)
+		finally:
+			f.close()
+		error = None
+	except Exception, e:
+		error = '%s: %s' % (type(e).__name__, e)
+		if os.path.exists(output):
+			os.remove(output)
+	# the document is not needed again
+	processor.dp.remove(processor.dp.absUri(document))
+	return document, time.time() - start, error, msgs
+
+
+def percentile(values, p):
+	return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def batch(options, documents):
+	extension = options.extension
+	if extension is None:
+		extension = '.txt' if processor.stylesheet.output.get('method') == (None, 'text') else '.xml'
+	# a document given twice is transformed once
+	unique = []
+	seen = set()
+	for d in documents:
+		if os.path.abspath(d) not in seen:
+			seen.add(os.path.abspath(d))
+			unique.append(d)
+	documents = unique
+	jobs = zip(documents, outputPaths(options.outputDir, extension, documents))
+
+	# documents differing only in their extension would overwrite each other
+	targets = {}
+	for document, output in jobs:
+		if output in targets:
+			print >>sys.stderr, "[ERROR] %s and %s would both be written to %s" % (
+				targets[output], document, output)
+			return False
+		targets[output] = document
+
+	for directory in set([options.outputDir] + [os.path.dirname(o) for o in targets]):
+		if not os.path.isdir(directory):
+			os.makedirs(directory)
+
+	start = time.time()
+	pool = multiprocessing.Pool(options.jobs) if options.jobs > 1 else None
+	try:
+		if pool is not None:
+			results = pool.imap_unordered(transformFile, jobs, chunksize=4)
+		else:
+			results = (transformFile(job) for job in jobs)
+
+		latencies = []
+		failures = 0
+		for document, seconds, error, msgs in results:
+			latencies.append(seconds)
+			for i in msgs:
+				print >>sys.stderr, "[MSG] %s: %s" % (document, i)
+			if error is not None:
+				failures += 1
+				print >>sys.stderr, "[ERROR] %s: %s" % (document, error)
+		elapsed = time.time() - start
+		if pool is not None:
+			pool.close()
+	finally:
+		if pool is not None:
+			# stops the workers after an error or KeyboardInterrupt
+			pool.terminate()
+			pool.join()
+
+	latencies.sort()
+	print >>sys.stderr, "%d documents, %d failed, %.2fs, %.1f documents/s" % (
+		len(latencies), failures, elapsed, len(latencies) / elapsed if elapsed else 0)
+	if latencies:
+		print >>sys.stderr, "latency: mean %.1fms, median %.1fms, 95%% %.1fms, max %.1fms" % (
+			sum(latencies) / len(latencies) * 1000, percentile(latencies, 0.5) * 1000,
+			percentile(latencies, 0.95) * 1000, latencies[-1] * 1000)
+	return failures == 0
+
+
+def main():
+	options, args = parser.parse_args()
+
+	if options.outputDir is None:
+		if len(args) != 2:
+			parser.error('expected a stylesheet and a document')
+		processor.setStylesheet(args[0])
+		msgs = []
+		processor.transformToStream(args[1], sys.stdout, messages=msgs)
+		print
+
+		for i in msgs:
+			print >>sys.stderr, "[MSG]: %s" % i
+		return
+
+	if not args:
+		parser.error('expected a stylesheet')
+	documents = args[1:]
+	for pattern in options.patterns:
+		documents.extend(sorted(glob.glob(pattern)))
+	if options.stdin:
+		documents.extend(line.strip() for line in sys.stdin if line.strip())
+
+	processor.setStylesheet(args[0])
+	if not batch(options, documents):
+		sys.exit(1)
+
+
+if __name__ == '__main__':
+	main()